@@ -0,0 +1,13 @@
+"""
+Benchmarks for the regex to FSM pipeline.
+
+Run them with `python -m benchmarks`, see `--help` for the options. Every
+operation in `suite.OPERATIONS` is timed over every corpus in
+`corpora.CORPORA`, several times, and the median and percentiles of these runs
+are reported together with the peak memory of one more run under tracemalloc.
+Results can be saved as JSON with `--output`, and compared against an earlier
+such file with `--baseline`.
+
+`python -m benchmarks.scaling` measures how the FSM primitives themselves scale
+instead, see `scaling`.
+"""
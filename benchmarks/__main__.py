@@ -0,0 +1,69 @@
+import argparse
+import json
+import platform
+import sys
+from datetime import datetime, timezone
+
+from benchmarks.corpora import CORPORA, DEFAULT_CORPORA
+from benchmarks.suite import OPERATIONS, run, regressions
+
+
+def _print_measurement(corpus, operation, measurement):
+    print(f"{corpus:<14} {operation:<9} {measurement['median'] * 1000:>10.2f} "
+          f"{measurement['p10'] * 1000:>10.2f} {measurement['p90'] * 1000:>10.2f} "
+          f"{measurement['peak_bytes'] / 1024:>10.0f}", flush=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m benchmarks",
+                                     description="Benchmark parsing, compiling and comparing regexes.")
+    parser.add_argument("--corpus", action="append", choices=sorted(CORPORA),
+                        help=f"corpus to run, may be repeated (default: {', '.join(DEFAULT_CORPORA)})")
+    parser.add_argument("--ops", default=",".join(OPERATIONS),
+                        help="comma-separated operations (default: %(default)s)")
+    parser.add_argument("--repeat", type=int, default=5, help="timed runs per measurement (default: %(default)s)")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the generated corpora (default: %(default)s)")
+    parser.add_argument("--output", metavar="FILE", help="save the results to FILE as JSON")
+    parser.add_argument("--baseline", metavar="FILE", help="compare against the results in FILE")
+    parser.add_argument("--threshold", type=float, default=0.1,
+                        help="slowdown of the median, relative to the baseline, that counts as "
+                             "a regression (default: %(default)s)")
+    args = parser.parse_args(argv)
+
+    operations = [op for op in args.ops.split(",") if op]
+    for op in operations:
+        if op not in OPERATIONS:
+            parser.error(f"unknown operation {op!r}, expected some of {', '.join(OPERATIONS)}")
+    if args.repeat < 1:
+        parser.error("--repeat must be at least 1")
+    corpora = {name: CORPORA[name](args.seed) for name in args.corpus or DEFAULT_CORPORA}
+
+    print(f"{'corpus':<14} {'operation':<9} {'median ms':>10} {'p10 ms':>10} {'p90 ms':>10} {'peak KiB':>10}")
+    results = run(corpora, operations, args.repeat, _print_measurement)
+    for corpus, errors in results['errors'].items():
+        for error in errors:
+            print(f"{corpus}: skipped {error}", file=sys.stderr)
+    results['meta'] = {
+        'date': datetime.now(timezone.utc).isoformat(),
+        'python': platform.python_version(),
+        'repeat': args.repeat,
+        'seed': args.seed,
+    }
+
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    if args.baseline is not None:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        found = regressions(results, baseline, args.threshold)
+        for r in found:
+            print(f"Regression: {r['corpus']} {r['operation']} took {r['median'] * 1000:.2f} ms, "
+                  f"{r['ratio']:.2f} times the baseline's {r['baseline'] * 1000:.2f} ms")
+        if found:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
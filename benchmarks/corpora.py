@@ -0,0 +1,62 @@
+"""
+The regexes benchmarks run over. Every corpus is a function taking the seed and
+returning a list of `(name, regex)` pairs in Python `re` syntax.
+"""
+import os
+from ast import literal_eval
+from typing import Callable, Dict, List, Tuple
+
+import regex_generator
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+Corpus = List[Tuple[str, str]]
+
+
+def terminals(seed: int = 0) -> Corpus:
+    """The regex terminals of the Python grammar, as dumped by `grammar_checker.py`"""
+    with open(os.path.join(ROOT, 'terminals.pydata')) as f:
+        data = literal_eval(f.read())
+    return [(name, regex) for kind, name, regex in data if kind == 're']
+
+
+def lookaheads(seed: int = 0) -> Corpus:
+    """The terminals with lookaheads, which is STRING with its `(?!"")`, and variants of it
+    with longer and more lookaheads"""
+    corpus = [(name, regex) for name, regex in terminals(seed) if '(?=' in regex or '(?!' in regex]
+    corpus += [
+        ('LONG_STRING', r'(?s:(?i:[ubf]?r?("""(?!"""")(?:[^\\]|\\.)*"""|' + r"'(?!'')(?:[^\n\\']|\\.)*')))"),
+        ('PREFIXED_STRING', r'(?![ub]{2})(?!rr)[ubr]{0,2}"(?!"")(?:[^"\n\\]|\\.)*"(?![a-z])'),
+        ('DOUBLED_CHARS', ''.join(f'(?!{c}{c})[a-h]' for c in 'abcdefgh')),
+    ]
+    return corpus
+
+
+def rfc5322(seed: int = 0) -> Corpus:
+    """The email address regexes in `rfc5322/`. Most of these are far too big to compile
+    in reasonable time, so this corpus is not run by default."""
+    directory = os.path.join(ROOT, 'rfc5322')
+    corpus = []
+    for file in sorted(os.listdir(directory)):
+        with open(os.path.join(directory, file)) as f:
+            corpus.append((file, f.read().strip()))
+    return corpus
+
+
+def generated(seed: int = 0, size: int = 10, count: int = 10) -> Corpus:
+    """`count` regexes of `size` nodes from `regex_generator`, the same ones for the same
+    `seed`"""
+    return [(item['id'], item['regex']) for item in regex_generator.corpus(seed, [size], count)]
+
+
+CORPORA: Dict[str, Callable[[int], Corpus]] = {
+    'terminals': terminals,
+    'lookaheads': lookaheads,
+    'rfc5322': rfc5322,
+    'generated-5': lambda seed: generated(seed, 5),
+    'generated-10': lambda seed: generated(seed, 10),
+    'generated-20': lambda seed: generated(seed, 20),
+    'generated-40': lambda seed: generated(seed, 40),
+}
+
+DEFAULT_CORPORA = ('terminals', 'lookaheads', 'generated-5', 'generated-10')
@@ -0,0 +1,254 @@
+"""
+How the FSM primitives scale. Every primitive in `PRIMITIVES` is timed on every
+family of FSMs in `FAMILIES` at doubling sizes, until one measurement takes longer
+than the budget. The growth exponent `k` of `time ~ size ** k` is then fitted by
+least squares on a log-log scale, and curves with `k` above `--max-exponent` are
+flagged as super-linear. Size is counted in transitions, so that a primitive
+which is linear in its input has `k` close to 1 on every family.
+
+Run it with `python -m benchmarks.scaling`, see `--help` for the options.
+"""
+import argparse
+import json
+import math
+import random
+import signal
+import statistics
+import sys
+import time
+from itertools import islice
+from typing import Callable, Dict, List, Optional, Tuple
+
+from greenery.fsm import FSM, crawl, parallel, OblivionError
+from greenery.lego import from_fsm
+
+
+def _symbols(n: int) -> List[str]:
+    # Letters first, so small FSMs stay readable
+    return [chr(ord('a') + i) if i < 26 else chr(0x100 + i) for i in range(n)]
+
+
+def chain(n: int, seed: int = 0) -> FSM:
+    """A path of `n` transitions on "a", accepting only "a" * n"""
+    return FSM(
+        alphabet={'a', 'b'},
+        states=range(n + 1),
+        initial=0,
+        finals={n},
+        map={i: {'a': i + 1} for i in range(n)},
+    )
+
+
+def clique(n: int, seed: int = 0) -> FSM:
+    """About `n` transitions: every state goes to every state, each on its own symbol"""
+    k = max(1, math.isqrt(n))
+    symbols = _symbols(k)
+    return FSM(
+        alphabet=set(symbols),
+        states=range(k),
+        initial=0,
+        finals={0},
+        map={i: {symbols[j]: j for j in range(k)} for i in range(k)},
+    )
+
+
+def random_dfa(n: int, seed: int = 0, degree: int = 2) -> FSM:
+    """`n` transitions: `n / degree` states with `degree` random successors each, half of
+    them final"""
+    generator = random.Random(seed)
+    k = max(1, n // degree)
+    symbols = _symbols(degree)
+    return FSM(
+        alphabet=set(symbols),
+        states=range(k),
+        initial=0,
+        finals={i for i in range(k) if generator.random() < 0.5},
+        map={i: {s: generator.randrange(k) for s in symbols} for i in range(k)},
+    )
+
+
+def nth_from_end(n: int, seed: int = 0) -> FSM:
+    """`(a|b)*a(a|b){m}`, whose minimal DFA has `2 ** (m + 2)` transitions, with `m`
+    picked to make that about `n`. It is built directly: the state is the bitmask of
+    which of the last `m + 1` symbols were "a"."""
+    m = max(0, round(math.log2(max(n, 4))) - 2)
+    mask = (1 << (m + 1)) - 1
+    return FSM(
+        alphabet={'a', 'b'},
+        states=range(mask + 1),
+        initial=0,
+        finals={s for s in range(mask + 1) if s >> m},
+        map={s: {'a': ((s << 1) | 1) & mask, 'b': (s << 1) & mask} for s in range(mask + 1)},
+    )
+
+
+FAMILIES: Dict[str, Callable[[int, int], FSM]] = {
+    'chain': chain,
+    'clique': clique,
+    'random': random_dfa,
+    'nth-from-end': nth_from_end,
+}
+
+
+def _crawl(f: FSM):
+    def follow(state, symbol):
+        try:
+            return f.map[state][symbol]
+        except KeyError:
+            raise OblivionError
+
+    return crawl(f.alphabet, f.initial, lambda state: state in f.finals, follow)
+
+
+def _cardinality(f: FSM):
+    try:
+        return f.cardinality()
+    except OverflowError:
+        return None
+
+
+PRIMITIVES: Dict[str, Callable[[FSM], object]] = {
+    'crawl': _crawl,
+    'parallel': lambda f: parallel([f, f], any),
+    'concatenate': lambda f: f + f,
+    'star': lambda f: f.star(),
+    'times': lambda f: f.times(3),
+    'reversed': lambda f: f.reversed(),
+    'reduce': lambda f: f.reduce(),
+    'strings': lambda f: list(islice(f.strings(), len(f.states))),
+    'cardinality': _cardinality,
+    'from_fsm': from_fsm,
+}
+
+
+def size(f: FSM) -> int:
+    return sum(len(transitions) for transitions in f.map.values())
+
+
+def fit_exponent(points: List[Tuple[int, float]]) -> Optional[float]:
+    """The slope of the least squares line through `(log size, log seconds)`, or None with
+    fewer than two distinct sizes"""
+    points = [(math.log(n), math.log(t)) for n, t in points if n > 0 and t > 0]
+    if len({x for x, y in points}) < 2:
+        return None
+    mean_x = statistics.fmean(x for x, y in points)
+    mean_y = statistics.fmean(y for x, y in points)
+    covariance = sum((x - mean_x) * (y - mean_y) for x, y in points)
+    variance = sum((x - mean_x) ** 2 for x, y in points)
+    return covariance / variance
+
+
+class _Timeout(Exception):
+    pass
+
+
+def _raise_timeout(signum, frame):
+    raise _Timeout
+
+
+def _timed(primitive: Callable[[FSM], object], f: FSM, timeout: float) -> float:
+    """Seconds `primitive(f)` took. Where there is SIGALRM, it is given up on after
+    `timeout` seconds by raising `_Timeout`."""
+    if not hasattr(signal, 'SIGALRM'):
+        begin = time.perf_counter()
+        primitive(f)
+        return time.perf_counter() - begin
+    previous = signal.signal(signal.SIGALRM, _raise_timeout)
+    signal.setitimer(signal.ITIMER_REAL, timeout)
+    try:
+        begin = time.perf_counter()
+        primitive(f)
+        return time.perf_counter() - begin
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, previous)
+
+
+def curve(family: Callable[[int, int], FSM], primitive: Callable[[FSM], object], start: int = 16,
+          limit: int = 1 << 16, budget: float = 1.0, repeat: int = 3, floor: float = 1e-4,
+          seed: int = 0) -> List[Tuple[int, float]]:
+    """Times `primitive` on members of `family` of doubling size, from `start` to `limit`
+    transitions, taking the median of `repeat` runs. Stops after the first size that
+    takes longer than `budget` seconds, or that fails (e.g. by hitting the recursion
+    limit). A run taking longer than 10 times the budget is given up on, as that size
+    would add little to the fit. Sizes faster than `floor` seconds are too noisy to fit
+    and are dropped."""
+    points = []
+    seen = set()
+    n = start
+    while n <= limit:
+        f = family(n, seed)
+        actual = size(f)
+        if actual not in seen:
+            seen.add(actual)
+            try:
+                samples = [_timed(primitive, f, budget * 10) for _ in range(repeat)]
+            except (RecursionError, _Timeout):
+                break
+            seconds = statistics.median(samples)
+            if seconds >= floor:
+                points.append((actual, seconds))
+            if seconds > budget:
+                break
+        n *= 2
+    return points
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.scaling",
+                                     description="Fit growth exponents of FSM primitives.")
+    parser.add_argument("--family", action="append", choices=sorted(FAMILIES),
+                        help="FSM family, may be repeated (default: all)")
+    parser.add_argument("--primitive", action="append", choices=sorted(PRIMITIVES),
+                        help="primitive, may be repeated (default: all)")
+    parser.add_argument("--budget", type=float, default=0.5,
+                        help="stop doubling after a size takes this many seconds (default: %(default)s)")
+    parser.add_argument("--limit", type=int, default=1 << 16,
+                        help="largest size in transitions (default: %(default)s)")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per size (default: %(default)s)")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the random family (default: %(default)s)")
+    parser.add_argument("--max-exponent", type=float, default=1.25,
+                        help="flag curves growing faster than size ** this (default: %(default)s)")
+    parser.add_argument("--output", metavar="FILE", help="save the curves and exponents to FILE as JSON")
+    parser.add_argument("--baseline", metavar="FILE",
+                        help="also flag exponents more than --tolerance above those in FILE")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="(default: %(default)s)")
+    args = parser.parse_args(argv)
+
+    baseline = {}
+    if args.baseline is not None:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+    results = {}
+    flagged = []
+    print(f"{'family':<13} {'primitive':<12} {'sizes':>13} {'exponent':>8}")
+    for family in args.family or FAMILIES:
+        for primitive in args.primitive or PRIMITIVES:
+            points = curve(FAMILIES[family], PRIMITIVES[primitive], limit=args.limit, budget=args.budget,
+                           repeat=args.repeat, seed=args.seed)
+            exponent = fit_exponent(points)
+            key = f"{family}/{primitive}"
+            results[key] = {'points': points, 'exponent': exponent}
+            reasons = []
+            if exponent is not None and exponent > args.max_exponent:
+                reasons.append("super-linear")
+            before = baseline.get(key, {}).get('exponent')
+            if exponent is not None and before is not None and exponent > before + args.tolerance:
+                reasons.append(f"was {before:.2f}")
+            if reasons:
+                flagged.append(key)
+            sizes = f"{points[0][0]}-{points[-1][0]}" if points else "-"
+            shown = f"{exponent:.2f}" if exponent is not None else "-"
+            print(f"{family:<13} {primitive:<12} {sizes:>13} {shown:>8}  {', '.join(reasons)}", flush=True)
+
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    if flagged:
+        print(f"{len(flagged)} curves flagged: {', '.join(flagged)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
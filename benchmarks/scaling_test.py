@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+
+if __name__ == "__main__":
+	raise Exception("Test files can't be run directly. Use `python -m pytest benchmarks`")
+
+import time
+
+import pytest
+
+from benchmarks.scaling import chain, curve, fit_exponent, size
+
+def test_fit_exponent():
+	sizes = [16, 32, 64, 128]
+	assert fit_exponent([(n, n * 1e-6) for n in sizes]) == pytest.approx(1)
+	assert fit_exponent([(n, n ** 2 * 1e-9) for n in sizes]) == pytest.approx(2)
+	assert fit_exponent([(16, 0.1)]) is None
+	assert fit_exponent([(16, 0.1), (16, 0.2)]) is None
+	assert fit_exponent([]) is None
+	# Points which have no logarithm are skipped
+	assert fit_exponent([(0, 0.1), (16, 0.0), (16, 16e-6), (64, 64e-6)]) == pytest.approx(1)
+	assert fit_exponent([(-1, 0.1), (16, -1.0), (16, 0.1)]) is None
+
+def test_curve_budget():
+	# The first size over budget is kept, and nothing after it is timed
+	timed = []
+	def primitive(f):
+		timed.append(size(f))
+		if size(f) >= 64:
+			time.sleep(0.02)
+	points = curve(chain, primitive, start=16, limit=1024, budget=0.01, repeat=1, floor=0)
+	assert [n for n, t in points] == [16, 32, 64]
+	assert points[-1][1] > 0.01
+	assert timed == [16, 32, 64]
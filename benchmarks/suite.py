@@ -0,0 +1,185 @@
+"""
+Timing and memory measurement of the operations of the pipeline, and comparison
+of the results against a baseline.
+"""
+import gc
+import statistics
+import time
+import tracemalloc
+from typing import Callable, Dict, List, Optional
+
+from greenery.fsm import FSM, anything_else
+from greenery.lego import from_fsm
+from pattern_parser import parse_pattern, compare_patterns, clear_fsm_caches, SymbolClasses, Pattern
+
+
+class Prepared:
+    """The inputs of every operation for one corpus, computed once and untimed. Regexes
+    which fail at some step are left out of all operations, and listed in `errors`."""
+
+    def __init__(self, corpus):
+        self.errors: List[str] = []
+        parsed = []
+        for name, regex in corpus:
+            try:
+                parsed.append((name, regex, parse_pattern(regex)))
+            except Exception as e:
+                self.errors.append(f"{name}: parse: {type(e).__name__}: {e}")
+        classes = SymbolClasses(*(p for name, regex, p in parsed))
+        self.alphabet = classes.alphabet
+        self.regexes: List[str] = []
+        self.patterns: List[Pattern] = []
+        self.fsms: List[FSM] = []
+        self.reduced: List[FSM] = []
+        self.char_fsms: List[FSM] = []
+        for name, regex, p in parsed:
+            try:
+                f = p.to_fsm(self.alphabet)
+                reduced = f.reduce()
+            except Exception as e:
+                self.errors.append(f"{name}: to_fsm: {type(e).__name__}: {e}")
+                continue
+            self.regexes.append(regex)
+            self.patterns.append(p)
+            self.fsms.append(f)
+            self.reduced.append(reduced)
+            self.char_fsms.append(_over_chars(reduced, classes.classes))
+
+    def reset(self):
+        """Parses the patterns again and clears the FSM caches, so that operations can't
+        reuse the FSMs cached by earlier runs, on the patterns or on the nodes they share"""
+        clear_fsm_caches()
+        self.patterns = [parse_pattern(regex) for regex in self.regexes]
+
+
+def _over_chars(f: FSM, chars) -> FSM:
+    """The same FSM over plain chars instead of symbol classes, as `lego.from_fsm` needs"""
+    map = {}
+    for state, transitions in f.map.items():
+        map[state] = {}
+        for symbol, next in transitions.items():
+            if symbol is anything_else:
+                map[state][anything_else] = next
+            else:
+                for char in symbol:
+                    map[state][char] = next
+    return FSM(alphabet=set(chars) | {anything_else}, states=f.states, initial=f.initial, finals=f.finals, map=map)
+
+
+def _parse(data: Prepared):
+    return [parse_pattern(regex) for regex in data.regexes]
+
+
+def _to_fsm(data: Prepared):
+    return [p.to_fsm(data.alphabet) for p in data.patterns]
+
+
+def _reduce(data: Prepared):
+    return [f.reduce() for f in data.fsms]
+
+
+def _product(data: Prepared):
+    # Each FSM with the next one, which keeps this linear in the size of the corpus
+    return [a & b for a, b in zip(data.reduced, data.reduced[1:] + data.reduced[:1])]
+
+
+def _from_fsm(data: Prepared):
+    return [from_fsm(f) for f in data.char_fsms]
+
+
+def _compare(data: Prepared):
+    return list(compare_patterns(*data.patterns))
+
+
+OPERATIONS: Dict[str, Callable[[Prepared], object]] = {
+    'parse': _parse,
+    'to_fsm': _to_fsm,
+    'reduce': _reduce,
+    'product': _product,
+    'from_fsm': _from_fsm,
+    'compare': _compare,
+}
+
+
+def _percentile(ordered: List[float], q: float) -> float:
+    """The `q`th quantile of sorted samples, interpolating linearly between them"""
+    position = (len(ordered) - 1) * q
+    low = int(position)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (position - low)
+
+
+def summarize(samples: List[float]) -> Dict[str, float]:
+    ordered = sorted(samples)
+    return {
+        'median': statistics.median(ordered),
+        'p10': _percentile(ordered, 0.1),
+        'p90': _percentile(ordered, 0.9),
+        'min': ordered[0],
+        'max': ordered[-1],
+    }
+
+
+def measure(operation: Callable[[Prepared], object], data: Prepared, repeat: int) -> Dict:
+    """Times `repeat` runs of `operation`, then measures the peak memory of one more run.
+    That one is separate because tracemalloc slows everything down. Every run gets freshly
+    parsed patterns."""
+    samples = []
+    for _ in range(repeat):
+        data.reset()
+        gc.collect()
+        start = time.perf_counter()
+        operation(data)
+        samples.append(time.perf_counter() - start)
+    data.reset()
+    gc.collect()
+    tracemalloc.start()
+    try:
+        operation(data)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    result = summarize(samples)
+    result['peak_bytes'] = peak
+    result['samples'] = samples
+    return result
+
+
+def run(corpora: Dict[str, List], operations: List[str], repeat: int = 5,
+        progress: Optional[Callable[[str, str, Dict], None]] = None) -> Dict:
+    """Measures every operation over every corpus. Returns `{"results": {corpus: {operation:
+    measurement}}, "errors": {corpus: [...]}, "sizes": {corpus: count}}`, and calls
+    `progress(corpus, operation, measurement)` after each measurement."""
+    results, errors, sizes = {}, {}, {}
+    for corpus, regexes in corpora.items():
+        data = Prepared(regexes)
+        errors[corpus] = data.errors
+        sizes[corpus] = len(data.regexes)
+        results[corpus] = {}
+        for operation in operations:
+            measurement = measure(OPERATIONS[operation], data, repeat)
+            results[corpus][operation] = measurement
+            if progress is not None:
+                progress(corpus, operation, measurement)
+    return {'results': results, 'errors': errors, 'sizes': sizes}
+
+
+def regressions(results: Dict, baseline: Dict, threshold: float) -> List[Dict]:
+    """Every measurement whose median took more than `1 + threshold` times as long as in
+    `baseline`. Measurements missing from either side are ignored."""
+    found = []
+    for corpus, operations in results['results'].items():
+        for operation, measurement in operations.items():
+            before = baseline.get('results', {}).get(corpus, {}).get(operation)
+            if before is None or before['median'] <= 0:
+                continue
+            ratio = measurement['median'] / before['median']
+            if ratio > 1 + threshold:
+                found.append({
+                    'corpus': corpus,
+                    'operation': operation,
+                    'baseline': before['median'],
+                    'median': measurement['median'],
+                    'ratio': ratio,
+                })
+    return found
@@ -0,0 +1,26 @@
+# -*- coding: utf-8 -*-
+
+if __name__ == "__main__":
+	raise Exception("Test files can't be run directly. Use `python -m pytest benchmarks`")
+
+from benchmarks.suite import regressions
+
+def results(**medians):
+	return {"results": {"corpus": {operation: {"median": median} for operation, median in medians.items()}}}
+
+def test_regressions():
+	baseline = results(parse=1.0, compare=2.0)
+	# 25% slower is over a threshold of 10%, 5% slower is under it
+	found = regressions(results(parse=1.25, compare=2.1), baseline, 0.1)
+	assert found == [{"corpus": "corpus", "operation": "parse", "baseline": 1.0, "median": 1.25, "ratio": 1.25}]
+	assert regressions(results(parse=1.25, compare=2.1), baseline, 0.3) == []
+	# Faster is never a regression
+	assert regressions(results(parse=0.5), baseline, 0.1) == []
+
+def test_regressions_missing():
+	# Measurements the baseline doesn't have are ignored, however slow
+	baseline = results(parse=1.0)
+	assert regressions(results(parse=1.0, to_fsm=100.0), baseline, 0.1) == []
+	assert regressions(results(parse=100.0), {}, 0.1) == []
+	other = {"results": {"other": {"parse": {"median": 0.001}}}}
+	assert regressions(results(parse=100.0), other, 0.1) == []
@@ -0,0 +1,147 @@
+from __future__ import annotations
+
+import pickle
+from typing import Dict, Set, Tuple, Iterable, Optional
+
+from greenery.fsm import FSM, anything_else
+from pattern_parser import Pattern, SymbolClasses, common_padding
+
+
+class CollisionIndex:
+    """Keeps track of which of a set of named patterns can match the same string, for a
+    set that changes a little at a time. Every pattern is compiled once, over its own
+    alphabet, and every pair is compared once: adding or replacing a pattern compares it
+    with the n others, instead of redoing all n² pairs as `compare_patterns` does.
+
+    Like `compare_patterns`, all patterns are compiled with the padding they have in
+    common (see `common_padding`), so both give the same answers. Should a change to the
+    patterns change that padding, all pairs are compared again. Patterns using something
+    `to_fsm` doesn't implement collide with nothing, and are listed in `unsupported`.
+
+    The index can be saved to disk and loaded again, so that it survives between runs."""
+
+    VERSION = 3
+
+    def __init__(self):
+        self.patterns: Dict[str, Pattern] = {}
+        self.prefix_postfix: Tuple[int, int] = (0, 0)
+        self.unsupported: Dict[str, str] = {}
+        self._fsms: Dict[str, Optional[FSM]] = {}
+        self._collisions: Dict[str, Set[str]] = {}
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.patterns
+
+    def __len__(self) -> int:
+        return len(self.patterns)
+
+    def _fsm(self, name: str) -> Optional[FSM]:
+        """The pattern's FSM, padded by `prefix_postfix`, or None if it is unsupported. Its
+        alphabet only has the pattern's own chars, which `fsm.parallel` reconciles with
+        any other through `anything_else`."""
+        if name not in self._fsms:
+            pattern = self.patterns[name]
+            alphabet = set(SymbolClasses(pattern).classes) | {anything_else}
+            try:
+                self._fsms[name] = pattern.to_fsm(alphabet, self.prefix_postfix).reduce()
+            except NotImplementedError as e:
+                self._fsms[name] = None
+                self.unsupported[name] = str(e)
+        return self._fsms[name]
+
+    def _collide(self, a: str, b: str) -> bool:
+        fa, fb = self._fsm(a), self._fsm(b)
+        return fa is not None and fb is not None and not fa.isdisjoint(fb)
+
+    def _compare(self, name: str):
+        """Compares `name` with all the patterns before it"""
+        self._collisions[name] = set()
+        if self._fsm(name) is None:
+            return
+        for other in self.patterns:
+            if other == name:
+                break
+            if self._collide(name, other):
+                self._collisions[name].add(other)
+                self._collisions[other].add(name)
+
+    def _repad(self) -> bool:
+        """Recompiles and recompares everything if the padding the patterns have in common
+        changed. Returns whether it did."""
+        prefix_postfix = common_padding(self.patterns.values()) if self.patterns else (0, 0)
+        if prefix_postfix == self.prefix_postfix:
+            return False
+        self.prefix_postfix = prefix_postfix
+        self._fsms.clear()
+        self.unsupported.clear()
+        for name in self.patterns:
+            self._compare(name)
+        return True
+
+    def add(self, name: str, pattern: Pattern):
+        """Adds a pattern, or replaces the one called `name`. Does nothing if it is unchanged."""
+        if self.patterns.get(name) == pattern:
+            return
+        # Only repad once the new pattern is in: should the old one set the padding, and the
+        # new one too, repadding in between would recompare every pair twice for nothing
+        if name in self.patterns:
+            self._drop(name)
+        self.patterns[name] = pattern
+        if not self._repad():
+            self._compare(name)
+
+    def _drop(self, name: str):
+        """Forgets everything about `name`, without repadding the rest"""
+        del self.patterns[name]
+        for other in self._collisions.pop(name):
+            self._collisions[other].discard(name)
+        self._fsms.pop(name, None)
+        self.unsupported.pop(name, None)
+
+    def remove(self, name: str):
+        self._drop(name)
+        self._repad()
+
+    def update(self, patterns: Dict[str, Pattern]):
+        """Makes the index hold exactly `patterns`, only recomparing what changed"""
+        for name in [name for name in self.patterns if name not in patterns]:
+            self.remove(name)
+        for name, pattern in patterns.items():
+            self.add(name, pattern)
+
+    def collisions_of(self, name: str) -> Set[str]:
+        """The names of the patterns which can match a string that `name` matches"""
+        return set(self._collisions[name])
+
+    def collisions(self) -> Iterable[Tuple[str, str]]:
+        """Every colliding pair of names, each once, in the order the names were added"""
+        names = list(self.patterns)
+        order = {name: i for i, name in enumerate(names)}
+        for a in names:
+            for b in sorted(self._collisions[a], key=order.__getitem__):
+                if order[a] < order[b]:
+                    yield a, b
+
+    def save(self, path: str):
+        with open(path, 'wb') as f:
+            pickle.dump((self.VERSION, self.patterns, self.prefix_postfix, self.unsupported, self._fsms,
+                         self._collisions), f)
+
+    @classmethod
+    def load(cls, path: str, missing_ok: bool = False) -> CollisionIndex:
+        """Loads an index written by `save`. With `missing_ok`, a missing or outdated file
+        gives an empty index instead of an error."""
+        index = cls()
+        try:
+            with open(path, 'rb') as f:
+                version, *state = pickle.load(f)
+        except FileNotFoundError:
+            if missing_ok:
+                return index
+            raise
+        if version != cls.VERSION:
+            if missing_ok:
+                return index
+            raise ValueError(f"{path} holds a version {version} index, expected {cls.VERSION}")
+        index.patterns, index.prefix_postfix, index.unsupported, index._fsms, index._collisions = state
+        return index
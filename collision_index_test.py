@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+
+if __name__ == "__main__":
+	raise Exception("Test files can't be run directly. Use `python -m pytest`")
+
+from collision_index import CollisionIndex
+from pattern_parser import compare_patterns, parse_pattern
+
+def expected(patterns):
+	names = {id(pattern): name for name, pattern in patterns.items()}
+	return {frozenset((names[id(a)], names[id(b)])) for a, b in compare_patterns(*patterns.values())}
+
+def found(index):
+	return {frozenset(pair) for pair in index.collisions()}
+
+def parse_all(regexes):
+	return {name: parse_pattern(regex) for name, regex in regexes.items()}
+
+def test_incremental():
+	regexes = {"end": "a$", "a": "a", "ab": "ab", "word": "[a-z]+"}
+	index = CollisionIndex()
+	patterns = {}
+	for name, regex in regexes.items():
+		patterns[name] = parse_pattern(regex)
+		index.add(name, patterns[name])
+		assert found(index) == expected(patterns)
+
+	# Each of these changes the padding the patterns have in common
+	for name, regex in [("la", "b(?=cc)"), ("lb", "(?<=x)a"), ("a", "a(?!b)")]:
+		patterns[name] = parse_pattern(regex)
+		index.add(name, patterns[name])
+		assert found(index) == expected(patterns)
+	assert index.prefix_postfix == (1, 2)
+
+	for name in ["la", "end", "lb"]:
+		del patterns[name]
+		index.remove(name)
+		assert found(index) == expected(patterns)
+	assert index.prefix_postfix == (0, 1)
+
+def test_collisions_of():
+	index = CollisionIndex()
+	index.update(parse_all({"a": "a", "end": "a$", "lb": "(?<=x)a", "b": "b"}))
+	assert index.collisions_of("a") == {"end", "lb"}
+	assert index.collisions_of("b") == set()
+	assert list(index.collisions()) == [("a", "end"), ("a", "lb"), ("end", "lb")]
+
+def test_update():
+	index = CollisionIndex()
+	index.update(parse_all({"a": "a+", "b": "b+", "ab": "[ab]"}))
+	assert found(index) == {frozenset("a ab".split()), frozenset("b ab".split())}
+	patterns = parse_all({"a": "a+", "ab": "c", "c": "c(?=d)"})
+	index.update(patterns)
+	assert found(index) == expected(patterns) == {frozenset("ab c".split())}
+
+def test_replace_padding(monkeypatch):
+	# Replacing the one pattern which sets the padding, by another which sets the
+	# same padding, compares the new pattern with the others and nothing more
+	patterns = parse_all({name: name + "+" for name in "abcdefgh"})
+	patterns["s"] = parse_pattern('"[^"]*"(?!"")')
+	index = CollisionIndex()
+	index.update(patterns)
+	calls = []
+	collide = CollisionIndex._collide
+	monkeypatch.setattr(CollisionIndex, "_collide", lambda self, a, b: calls.append((a, b)) or collide(self, a, b))
+	patterns["s"] = parse_pattern('"[^"]+"(?!"")')
+	index.add("s", patterns["s"])
+	assert len(calls) == len(patterns) - 1
+	assert found(index) == expected(patterns)
+
+def test_save_load(tmp_path):
+	path = str(tmp_path / "test.collisions.pickle")
+	assert list(CollisionIndex.load(path, missing_ok=True).collisions()) == []
+	patterns = parse_all({"a": "a", "end": "a$", "la": "b(?=cc)", "lb": "(?<=x)a"})
+	index = CollisionIndex()
+	index.update(patterns)
+	index.save(path)
+	loaded = CollisionIndex.load(path)
+	assert loaded.prefix_postfix == index.prefix_postfix
+	assert list(loaded.collisions()) == list(index.collisions())
+	loaded.add("b", parse_pattern("b"))
+	patterns["b"] = loaded.patterns["b"]
+	assert found(loaded) == expected(patterns)
+
+def test_unsupported():
+	patterns = parse_all({"a": "a", "bad": "(?:a(?=b))*", "ab": "[ab]"})
+	index = CollisionIndex()
+	index.update(patterns)
+	assert list(index.unsupported) == ["bad"]
+	assert found(index) == expected(patterns) == {frozenset("a ab".split())}
+	index.remove("bad")
+	assert index.unsupported == {}
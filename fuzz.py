@@ -0,0 +1,391 @@
+"""
+Differential fuzzing of `pattern_parser` (or `greenery.lego`) against Python's `re`.
+
+Regexes come from `regex_generator.corpus`, so a run is reproducible from its
+seed. Each regex is compiled to an FSM and with `re`, then a batch of strings is
+checked against both: strings sampled from the FSM by random walks through its
+live states, which it should accept, and mutations of these, which mostly it
+should not. `re.fullmatch` is the reference. Every disagreement is minimized,
+first the string and then the regex, and reported as a JSON line.
+
+With `--mode compare`, the regexes are taken two at a time and what
+`compare_patterns` says of each pair is checked instead. Both are compiled the way
+it compiles them, padded for their lookarounds, and `re` matches them inside the
+context the padding stands for. If they collide, strings sampled from both FSMs at
+once have to match both regexes; if not, no string matched by one may match the other.
+
+Run it with e.g. `python fuzz.py --count 500 --size 5,10 --workers 4`.
+"""
+import argparse
+import json
+import random
+import re
+import sys
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+from typing import Callable, Dict, List, Optional, Tuple
+
+from greenery.fsm import FSM, anything_else
+from greenery.lego import parse
+from pattern_parser import parse_pattern, SymbolClasses, common_padding, compare_patterns
+from regex_generator import Features, corpus
+
+ENGINES = ("pattern_parser", "lego")
+MODES = ("fsm", "compare")
+
+# `re` and the FSMs disagree on purpose outside ASCII (e.g. Unicode `\w`) and on
+# `\s` for control chars like \x1c, so strings are made of these only.
+POOL = [chr(i) for i in range(0x20, 0x7f)] + ['\t', '\n', '\r', '\v', '\f']
+
+# Before Python 3.14, `re` never matches `\B` in an empty string, so those aren't checked
+_EMPTY_NOT_BOUNDARY = sys.version_info < (3, 14)
+
+
+class Compiled:
+    """A regex compiled by one of `ENGINES`. `chars[symbol]` lists the chars of `POOL`
+    which `symbol` of the FSM's alphabet stands for.
+
+    With `prefix_postfix`, the FSM is padded as `compare_patterns` pads it: the strings
+    it accepts start and end with that many chars of context, which lookarounds and
+    anchors can see but the match doesn't include. `classes` gives the alphabet shared
+    with the regexes it is compared with."""
+
+    def __init__(self, regex: str, engine: str, prefix_postfix: Tuple[int, int] = (0, 0),
+                 classes: SymbolClasses = None):
+        self.prefix_postfix = prefix_postfix
+        if engine == "pattern_parser":
+            pattern = parse_pattern(regex)
+            classes = classes if classes is not None else SymbolClasses(pattern)
+            # Without padding, lookarounds see exactly what `re.fullmatch` lets them see
+            self.fsm: FSM = pattern.to_fsm(classes.alphabet, prefix_postfix)
+            self.normalize: Callable[[str], List] = classes.normalize
+            # Ends where the context after the match starts, and sees all of it
+            self.reference = re.compile(f"(?:{regex})(?=(?s:.){{{prefix_postfix[1]}}}\\Z)")
+        elif engine == "lego":
+            if prefix_postfix != (0, 0):
+                raise ValueError("lego has no lookarounds to pad for")
+            self.fsm = parse(regex).to_fsm()
+            alphabet = self.fsm.alphabet
+            self.normalize = lambda string: [c if c in alphabet else anything_else for c in string]
+            # In lego, "." matches newlines too
+            self.reference = re.compile(f"(?:{regex})\\Z", re.DOTALL)
+        else:
+            raise ValueError(f"Unknown engine {engine!r}, expected one of {', '.join(ENGINES)}")
+        self.chars = _chars(self.normalize)
+        self.skip_empty = _EMPTY_NOT_BOUNDARY and re.search(r"(?<!\\)(?:\\\\)*\\B", regex) is not None
+
+    def accepts(self, string: str) -> bool:
+        return self.fsm.accepts(self.normalize(string))
+
+    def matches(self, string: str) -> bool:
+        prefix, postfix = self.prefix_postfix
+        if len(string) < prefix + postfix:
+            return False
+        return self.reference.match(string, prefix) is not None
+
+    def accepts_all(self, strings: List[str]) -> Dict[str, bool]:
+        """Whether the FSM accepts each of `strings`. They are walked in sorted order, so
+        a prefix they share is only walked once."""
+        f = self.fsm
+        symbols = {}
+        accepted = {}
+        previous, path = "", [f.initial]
+        for string in sorted(set(strings)):
+            # path[i] is the state after the first i chars of `previous`, until it's None
+            shared = 0
+            limit = min(len(previous), len(string), len(path) - 1)
+            while shared < limit and previous[shared] == string[shared]:
+                shared += 1
+            del path[shared + 1:]
+            state = path[-1]
+            for c in string[shared:]:
+                if state is None:
+                    break
+                if c not in symbols:
+                    symbols[c] = self.normalize(c)[0]
+                state = f.map.get(state, {}).get(symbols[c])
+                path.append(state)
+            accepted[string] = state in f.finals
+            previous = string
+        return accepted
+
+    def matches_all(self, strings: List[str]) -> Dict[str, bool]:
+        """Whether `re` matches each of `strings`, each one once"""
+        prefix, postfix = self.prefix_postfix
+        matched = dict.fromkeys(strings, False)
+        candidates = [string for string in matched if len(string) >= prefix + postfix]
+        for string, match in zip(candidates, map(self.reference.match, candidates, repeat(prefix))):
+            matched[string] = match is not None
+        return matched
+
+
+def _chars(normalize: Callable[[str], List]) -> Dict:
+    """The chars of `POOL` each symbol stands for"""
+    chars = {}
+    for c in POOL:
+        chars.setdefault(normalize(c)[0], []).append(c)
+    return chars
+
+
+def _live(f: FSM) -> set:
+    """All states from which a final state can be reached, in one backwards search"""
+    incoming = {}
+    for state, transitions in f.map.items():
+        for next in transitions.values():
+            incoming.setdefault(next, set()).add(state)
+    live = set(f.finals)
+    pending = list(f.finals)
+    while pending:
+        for state in incoming.get(pending.pop(), ()):
+            if state not in live:
+                live.add(state)
+                pending.append(state)
+    return live
+
+
+def positives(compiled: Compiled, rng: random.Random, count: int, max_length: int) -> List[str]:
+    """Up to `count` strings the FSM accepts, by random walks that only enter live states"""
+    return _walks(compiled.fsm, compiled.chars, rng, count, max_length)
+
+
+def _walks(f: FSM, chars: Dict, rng: random.Random, count: int, max_length: int) -> List[str]:
+    live = _live(f)
+    if f.initial not in live:
+        return []
+    found = []
+    for _ in range(count):
+        state, string = f.initial, []
+        while True:
+            options = [
+                (symbol, next) for symbol, next in f.map.get(state, {}).items()
+                if next in live and symbol in chars
+            ]
+            if state in f.finals and (not options or len(string) >= max_length or rng.random() < 0.3):
+                found.append("".join(string))
+                break
+            if not options or len(string) >= max_length * 2:
+                break
+            symbol, state = rng.choice(options)
+            string.append(rng.choice(chars[symbol]))
+    return found
+
+
+def mutations(strings: List[str], rng: random.Random, count: int) -> List[str]:
+    """`count` strings made by deleting, inserting or replacing a char of one of `strings`,
+    or drawn at random if there are none"""
+    found = []
+    for _ in range(count):
+        if not strings:
+            found.append("".join(rng.choice(POOL) for _ in range(rng.randrange(6))))
+            continue
+        string = rng.choice(strings)
+        i = rng.randrange(len(string) + 1)
+        kind = rng.choice(("delete", "insert", "replace")) if string else "insert"
+        if kind == "insert":
+            string = string[:i] + rng.choice(POOL) + string[i:]
+        elif i < len(string):
+            string = string[:i] + (rng.choice(POOL) if kind == "replace" else "") + string[i + 1:]
+        found.append(string)
+    return found
+
+
+def disagreement(compiled: Compiled, strings: List[str]) -> Optional[str]:
+    """The first of `strings` on which the FSM and `re` disagree, or None. Both check the
+    whole batch at once."""
+    if compiled.skip_empty:
+        strings = [string for string in strings if string]
+    accepted = compiled.accepts_all(strings)
+    matched = compiled.matches_all(strings)
+    for string in strings:
+        if accepted[string] != matched[string]:
+            return string
+    return None
+
+
+def _fails(regex: str, string: str, engine: str) -> bool:
+    try:
+        compiled = Compiled(regex, engine)
+    except Exception:
+        return False
+    return compiled.accepts(string) != compiled.matches(string)
+
+
+def _shrink(text: str, still_fails: Callable[[str], bool]) -> str:
+    """Deletes chunks of `text`, halving their size down to single chars, as long as the
+    result still fails"""
+    size = max(1, len(text) // 2)
+    while True:
+        i = 0
+        while i < len(text):
+            candidate = text[:i] + text[i + size:]
+            if still_fails(candidate):
+                text = candidate
+            else:
+                i += size
+        if size == 1:
+            return text
+        size //= 2
+
+
+def minimize(regex: str, string: str, engine: str) -> Tuple[str, str]:
+    """A smaller regex and string on which the FSM and `re` still disagree"""
+    while True:
+        string = _shrink(string, lambda s: _fails(regex, s, engine))
+        smaller = _shrink(regex, lambda r: _fails(r, string, engine))
+        if smaller == regex:
+            return regex, string
+        regex = smaller
+
+
+def check(item: Dict, engine: str = "pattern_parser", samples: int = 50, max_length: int = 12,
+          shrink: bool = True) -> Dict:
+    """Fuzzes one item of `regex_generator.corpus`. The result has a "status" of "ok",
+    "skipped" (some engine can't compile the regex, see "error") or "failed", in which
+    case it has the "string" and the verdict of `re` on it, minimized if `shrink`."""
+    result = {'id': item['id'], 'regex': item['regex']}
+    try:
+        compiled = Compiled(item['regex'], engine)
+    except Exception as e:
+        result.update(status="skipped", error=f"{type(e).__name__}: {e}")
+        return result
+    rng = random.Random(item['seed'])
+    accepted = positives(compiled, rng, samples // 2, max_length)
+    strings = accepted + mutations(accepted, rng, samples - len(accepted))
+    string = disagreement(compiled, strings)
+    result['positives'] = len(accepted)
+    if string is None:
+        result['status'] = "ok"
+        return result
+    result.update(status="failed", string=string, re=compiled.matches(string))
+    if shrink:
+        regex, string = minimize(item['regex'], string, engine)
+        result.update(minimal_regex=regex, minimal_string=string, minimal_re=Compiled(regex, engine).matches(string))
+    return result
+
+
+def check_pair(a: Dict, b: Dict, samples: int = 50, max_length: int = 12) -> Dict:
+    """Fuzzes what `compare_patterns` says of two items of `regex_generator.corpus`. The
+    result has a "status" like `check`'s and a "verdict" of "collide" or "disjoint". It
+    fails on a "string" `re` disagrees on, with the context it matched in ("context"
+    chars on either side): one both match although they are disjoint, one they should
+    both match as they collide, or one a padded FSM gets wrong."""
+    result = {'id': [a['id'], b['id']], 'regex': [a['regex'], b['regex']]}
+    try:
+        patterns = parse_pattern(a['regex']), parse_pattern(b['regex'])
+        collide = any(True for _ in compare_patterns(*patterns))
+        classes = SymbolClasses(*patterns)
+        prefix_postfix = common_padding(patterns)
+        compiled = [Compiled(item['regex'], "pattern_parser", prefix_postfix, classes) for item in (a, b)]
+    except Exception as e:
+        result.update(status="skipped", error=f"{type(e).__name__}: {e}")
+        return result
+    result.update(verdict="collide" if collide else "disjoint", context=list(prefix_postfix))
+    rng = random.Random(f"{a['seed']}|{b['seed']}")
+    strings = []
+    for one in compiled:
+        accepted = positives(one, rng, samples // 4, max_length)
+        strings += accepted + mutations(accepted, rng, samples // 2 - len(accepted))
+    skip_empty = any(one.skip_empty for one in compiled)
+    if skip_empty:
+        strings = [string for string in strings if string]
+    matched = [one.matches_all(strings) for one in compiled]
+    for one, matches in zip(compiled, matched):
+        accepted = one.accepts_all(strings)
+        string = next((string for string in strings if accepted[string] != matches[string]), None)
+        if string is not None:
+            result.update(status="failed", string=string, re=matches[string])
+            return result
+    if collide:
+        # Strings both FSMs accept, as the witness `compare_patterns` has for them
+        both = FSM.intersection(compiled[0].fsm, compiled[1].fsm)
+        shared = _walks(both, _chars(classes.normalize), rng, samples // 2, max_length)
+        if skip_empty:
+            shared = [string for string in shared if string]
+        matched = [one.matches_all(shared) for one in compiled]
+        string = next((string for string in shared if not (matched[0][string] and matched[1][string])), None)
+    else:
+        string = next((string for string in strings if matched[0][string] and matched[1][string]), None)
+    if string is not None:
+        result.update(status="failed", string=string, re=[matches[string] for matches in matched])
+        return result
+    result['status'] = "ok"
+    return result
+
+
+def _check(job):
+    item, engine, samples, max_length, shrink = job
+    return check(item, engine, samples, max_length, shrink)
+
+
+def _check_pair(job):
+    a, b, samples, max_length = job
+    return check_pair(a, b, samples, max_length)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Fuzz regex to FSM compilation against Python's re.")
+    parser.add_argument("--engine", choices=ENGINES, default="pattern_parser")
+    parser.add_argument("--mode", choices=MODES, default="fsm",
+                        help="check the FSM of each regex, or compare_patterns on pairs of them "
+                             "(pattern_parser only) (default: %(default)s)")
+    parser.add_argument("--seed", type=int, default=0, help="(default: %(default)s)")
+    parser.add_argument("--size", default="5,10", help="comma-separated node counts (default: %(default)s)")
+    parser.add_argument("--count", type=int, default=100, help="regexes per size (default: %(default)s)")
+    parser.add_argument("--samples", type=int, default=50, help="strings per regex (default: %(default)s)")
+    parser.add_argument("--max-length", type=int, default=12,
+                        help="usual length of sampled strings (default: %(default)s)")
+    parser.add_argument("--workers", type=int, default=None, help="number of worker processes")
+    parser.add_argument("--no-minimize", dest="minimize", action="store_false",
+                        help="report failures as found")
+    parser.add_argument("--output", metavar="FILE", help="write failures to FILE as JSON Lines")
+    args = parser.parse_args(argv)
+    if args.mode == "compare" and args.engine != "pattern_parser":
+        parser.error("--mode compare only works with the pattern_parser engine")
+
+    features = Features(lookbehinds=True, anchors=True)
+    if args.engine == "lego":
+        # Syntax lego doesn't have
+        features = Features(lookaheads=False, flags=False, lazy_repeats=False)
+    sizes = [int(size) for size in args.size.split(",") if size]
+    items = list(corpus(args.seed, sizes, args.count, features))
+    if args.mode == "compare":
+        function = _check_pair
+        jobs = [(a, b, args.samples, args.max_length) for a, b in zip(items[::2], items[1::2])]
+    else:
+        function = _check
+        jobs = [(item, args.engine, args.samples, args.max_length, args.minimize) for item in items]
+
+    if args.workers is None or args.workers <= 1:
+        results = map(function, jobs)
+        executor = None
+    else:
+        executor = ProcessPoolExecutor(args.workers)
+        results = executor.map(function, jobs, chunksize=max(1, len(jobs) // (args.workers * 4)))
+
+    counts = {"ok": 0, "skipped": 0, "failed": 0}
+    errors = Counter()
+    output = open(args.output, 'w') if args.output is not None else None
+    try:
+        for result in results:
+            counts[result['status']] += 1
+            if result['status'] == "skipped":
+                errors[result['error']] += 1
+            if result['status'] == "failed":
+                print(json.dumps(result), flush=True)
+                if output is not None:
+                    output.write(json.dumps(result) + "\n")
+    finally:
+        if executor is not None:
+            executor.shutdown()
+        if output is not None:
+            output.close()
+    for error, count in errors.most_common():
+        print(f"{count:>6} skipped: {error}", file=sys.stderr)
+    print(f"{counts['ok']} ok, {counts['failed']} failed, {counts['skipped']} skipped", file=sys.stderr)
+    if counts['failed']:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
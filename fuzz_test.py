@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+
+if __name__ == "__main__":
+	raise Exception("Test files can't be run directly. Use `python -m pytest`")
+
+import random
+
+from fuzz import Compiled, check, check_pair, disagreement, mutations, positives
+from pattern_parser import SymbolClasses, parse_pattern
+from regex_generator import Features, corpus
+
+def items(size, count, features=Features(lookbehinds=True, anchors=True)):
+	return list(corpus(0, [size], count, features))
+
+def test_check():
+	results = [check(item) for item in items(6, 40)]
+	assert [result for result in results if result["status"] == "failed"] == []
+	assert sum(result["status"] == "ok" for result in results) >= 30
+	lego = Features(lookaheads=False, flags=False, lazy_repeats=False)
+	assert all(check(item, "lego")["status"] == "ok" for item in items(6, 10, lego))
+
+def test_check_pair():
+	corpus_items = items(4, 40)
+	results = [check_pair(a, b) for a, b in zip(corpus_items[::2], corpus_items[1::2])]
+	assert [result for result in results if result["status"] == "failed"] == []
+	assert {result.get("verdict") for result in results} >= {"collide", "disjoint"}
+
+	def pair(a, b):
+		result = check_pair({"id": "a", "regex": a, "seed": 0}, {"id": "b", "regex": b, "seed": 0})
+		assert result["status"] == "ok", result
+		return result["verdict"], result["context"]
+
+	assert pair("a(?=b)", "a") == ("collide", [0, 1])
+	assert pair("a(?=b)", "ab") == ("disjoint", [0, 1])
+	assert pair("(?<=x)a", "a") == ("collide", [1, 0])
+	assert pair("a$", "a") == ("collide", [0, 0])
+	assert pair(r"\ba", r"\Ba") == ("disjoint", [0, 0])
+	assert pair("a$", "a(?=b)") == ("disjoint", [0, 1])
+
+def test_padded():
+	# re matches inside the context the padding stands for
+	compiled = Compiled("a(?=b)", "pattern_parser", (1, 1))
+	assert compiled.matches("xab") and compiled.accepts("xab")
+	assert not compiled.matches("ab") and not compiled.accepts("ab")
+	assert not compiled.matches("xac")
+	anchored = Compiled("^a", "pattern_parser", (1, 0))
+	assert not anchored.matches("\na") and not anchored.accepts("\na")
+
+def test_batches():
+	compiled = Compiled(r"(?:ab|a\d)+c?", "pattern_parser")
+	rng = random.Random(0)
+	accepted = positives(compiled, rng, 20, 10)
+	strings = accepted + mutations(accepted, rng, 40) + ["", "a", "ab", "abc", "abcc"]
+	assert not all(compiled.accepts_all(strings).values())
+	assert compiled.accepts_all(strings) == {string: compiled.accepts(string) for string in strings}
+	assert compiled.matches_all(strings) == {string: compiled.matches(string) for string in strings}
+	assert disagreement(compiled, strings) is None
+
+	# A wrong FSM is caught
+	classes = SymbolClasses(parse_pattern("a(?=b)"), parse_pattern("a"))
+	wrong = Compiled("a(?=b)", "pattern_parser", (0, 1), classes)
+	wrong.fsm = Compiled("a", "pattern_parser", (0, 1), classes).fsm
+	assert disagreement(wrong, ["ab", "ac", "b"]) == "ac"
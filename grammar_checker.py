@@ -1,20 +1,103 @@
+import argparse
+import os
 import time
+from collections import defaultdict
+from itertools import combinations
 
 from lark import Lark
+from lark.common import ParserConf
+from lark.parsers.lalr_analysis import LALR_Analyzer
 
-from pattern_parser import parse_pattern, compare_patterns
-
-start = time.time()
-grammar = Lark(open("grammar.lark"), parser='lalr', start='file_input')
-grammar.lexer = grammar._build_lexer()
-terminals = [(term.pattern.type, term.name, term.pattern.to_regexp()) for term in grammar.lexer.terminals]
-with open('terminals.pydata', 'w') as f:
-    print(repr(terminals), file=f)
-patterns = [(term, parse_pattern(term.pattern.to_regexp())) for term in grammar.lexer.terminals if
-            term.pattern.type == 're']
-print(len(patterns))
-pat_term_map = {p: t for t, p in patterns}
-for a, b in compare_patterns(*pat_term_map.keys()):
-    print(f"Collision between {pat_term_map[a]} and {pat_term_map[b]}")
-end = time.time()
-print(f"Total time: {end - start}")
+from collision_index import CollisionIndex
+from pattern_parser import parse_pattern, compare_patterns, witness, match_literals
+
+def terminal_states(grammar: Lark):
+    """Maps every LALR parser state to the names of the terminals the contextual lexer
+    accepts in it: those with an action in the parse table, plus the ignored ones. The
+    table is built again from the grammar's rules, the way Lark builds its own."""
+    analyzer = LALR_Analyzer(ParserConf(grammar.rules, None, grammar.options.start))
+    analyzer.compute_lalr()
+    parse_table = analyzer.parse_table
+    always = set(grammar.ignore_tokens)
+    always |= set(getattr(grammar.options.postlex, 'always_accept', ()))
+    return {state: set(actions) | always for state, actions in parse_table.states.items()}
+
+
+def contextual_collisions(grammar: Lark, patterns, unsupported=None, stats=None):
+    """Yields `(a, b, witness, states)` for every two terminals in `patterns` (a dict of
+    name to pattern) which can match the same string and which the contextual lexer
+    has to tell apart in some parser `states`. Pairs never acceptable in the same
+    state are not compared at all. If given, `unsupported` gets the names of the
+    terminals `compare_patterns` couldn't compare, and why, and `stats` gets the number
+    of "pairs" there are, of those which are "shared" by a state, and of the "products"
+    it took to compare these."""
+    names = list(patterns)
+    numbers = {name: i for i, name in enumerate(names)}
+    shared = defaultdict(list)
+    for state, accepted in terminal_states(grammar).items():
+        indices = sorted(numbers[name] for name in accepted if name in numbers)
+        for pair in combinations(indices, 2):
+            shared[pair].append(state)
+    counts = {}
+    # compare_patterns yields the very objects it was given, so they map back to their index
+    by_identity = {id(p): i for i, p in enumerate(patterns.values())}
+    failed = {}
+    found = [(by_identity[id(p)], by_identity[id(q)])
+             for p, q in compare_patterns(*patterns.values(), pairs=sorted(shared), stats=counts, unsupported=failed)]
+    if unsupported is not None:
+        unsupported.update((names[i], reason) for i, reason in failed.items())
+    if stats is not None:
+        stats.update(pairs=len(names) * (len(names) - 1) // 2, shared=len(shared),
+                     products=counts.get("products", 0))
+    for i, j in sorted(found):
+        a, b = names[i], names[j]
+        yield a, b, witness(patterns[a], patterns[b]), shared[i, j]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Find regex terminals of a Lark grammar which collide.")
+    parser.add_argument("grammar", nargs="?", default="grammar.lark")
+    parser.add_argument("--start", default="file_input")
+    parser.add_argument("--contextual", action="store_true",
+                        help="only compare terminals the contextual lexer sees in the same parser state")
+    parser.add_argument("--index", help="where to keep the collisions found between runs, "
+                                        "by default GRAMMAR.collisions.pickle next to the grammar")
+    args = parser.parse_args(argv)
+
+    start = time.time()
+    with open(args.grammar) as f:
+        grammar = Lark(f, parser='lalr', start=args.start)
+    grammar.lexer = grammar._build_lexer()
+    terminals = [(term.pattern.type, term.name, term.pattern.to_regexp()) for term in grammar.lexer.terminals]
+    with open('terminals.pydata', 'w') as f:
+        print(repr(terminals), file=f)
+    patterns = {term.name: parse_pattern(term.pattern.to_regexp()) for term in grammar.lexer.terminals if
+                term.pattern.type == 're'}
+    print(len(patterns))
+    unsupported = {}
+    if args.contextual:
+        stats = {}
+        for a, b, string, states in contextual_collisions(grammar, patterns, unsupported, stats):
+            print(f"Collision between {a} and {b} on {string!r} in states {', '.join(map(str, states))}")
+        print(f"{stats['shared']} of {stats['pairs']} pairs share a parser state, "
+              f"{stats['products']} needed a product")
+    else:
+        # Only terminals which changed since the last run get compared again
+        index_file = args.index or os.path.splitext(args.grammar)[0] + ".collisions.pickle"
+        index = CollisionIndex.load(index_file, missing_ok=True)
+        index.update(patterns)
+        index.save(index_file)
+        for a, b in index.collisions():
+            print(f"Collision between {a} and {b}")
+        unsupported.update(index.unsupported)
+    literals = {term.name: term.pattern.value for term in grammar.lexer.terminals if term.pattern.type == 'str'}
+    for name, matched in match_literals(patterns, literals, unsupported).items():
+        print(f"String {name} ({literals[name]!r}) is also matched by {', '.join(matched)}")
+    for name, reason in unsupported.items():
+        print(f"Could not check {name}: {reason}")
+    end = time.time()
+    print(f"Total time: {end - start}")
+
+
+if __name__ == "__main__":
+    main()
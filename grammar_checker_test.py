@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+
+if __name__ == "__main__":
+	raise Exception("Test files can't be run directly. Use `python -m pytest`")
+
+import os
+
+import pytest
+
+lark = pytest.importorskip("lark")
+
+from grammar_checker import contextual_collisions, main, terminal_states
+from pattern_parser import parse_pattern
+
+GRAMMAR = r'''
+start: "let" NAME "=" NUMBER | "say" WORD | "say" NUMBER
+NAME: /[a-z]+/
+NUMBER: /[0-9]+/
+WORD: /[a-z0-9]+/
+%ignore " "
+'''
+
+@pytest.fixture
+def grammar():
+	return lark.Lark(GRAMMAR, parser="lalr")
+
+def patterns_of(grammar):
+	return {term.name: parse_pattern(term.pattern.to_regexp()) for term in grammar.terminals
+		if term.pattern.type == "re"}
+
+def test_terminal_states(grammar):
+	states = terminal_states(grammar)
+	# The same states Lark's own parser has
+	assert len(states) == len(grammar.parser.parser._parse_table.states)
+	ignore, = grammar.ignore_tokens
+	assert all(ignore in accepted for accepted in states.values())
+	assert {"WORD", "NUMBER", ignore} in [accepted for accepted in states.values()]
+	assert not any({"NAME", "WORD"} <= accepted for accepted in states.values())
+
+def test_contextual_collisions(grammar, capsys):
+	# NAME and WORD both match "a", but are never expected in the same state
+	stats = {}
+	found = [(a, b, string) for a, b, string, _ in contextual_collisions(grammar, patterns_of(grammar), stats=stats)]
+	assert found == [("NUMBER", "WORD", "0")]
+	assert stats == {"pairs": 3, "shared": 1, "products": 1}
+	assert capsys.readouterr().out == ""
+
+def test_main(tmp_path, monkeypatch, capsys):
+	monkeypatch.chdir(tmp_path)
+	(tmp_path / "test.lark").write_text(GRAMMAR)
+	main(["test.lark", "--start", "start"])
+	out = capsys.readouterr().out
+	assert "Collision between WORD and NAME" in out
+	assert "Collision between WORD and NUMBER" in out
+	assert os.path.exists("test.collisions.pickle")
+	main(["test.lark", "--start", "start", "--contextual", "--index", "other.pickle"])
+	out = capsys.readouterr().out
+	assert "Collision between WORD and NAME" not in out
+	assert "Collision between WORD and NUMBER on '0'" in out
+	assert "1 of 3 pairs share a parser state, 1 needed a product" in out
+
+def test_unsupported(tmp_path, monkeypatch, capsys):
+	monkeypatch.chdir(tmp_path)
+	(tmp_path / "test.lark").write_text(GRAMMAR.replace("| \"say\" NUMBER", "| \"say\" NUMBER | ODD") + "ODD: /(?:x(?=y))+y/\n")
+	for options in ([], ["--contextual"]):
+		main(["test.lark", "--start", "start"] + options)
+		out = capsys.readouterr().out
+		assert "Could not check ODD: lookarounds reaching out of a repetition are not implemented" in out
+		assert "Collision between WORD and NUMBER" in out
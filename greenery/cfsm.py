@@ -0,0 +1,472 @@
+# -*- coding: utf-8 -*-
+
+"""
+	Counting finite state machines: automata extended with bounded counters,
+	so that a repetition like "[^\\n]{0,65535}" needs one counter instead of
+	65536 states.
+"""
+from greenery.fsm import FSM, anything_else, crawl, OblivionError, traced
+
+# Repetitions whose bounds exceed this are compiled to a counter by
+# `lego.to_cfsm()` and `pattern_parser`; smaller ones are expanded as usual.
+COUNTING_THRESHOLD = 64
+
+
+def _satisfies(counters, guard):
+    """Check the counter values against a guard, see `CFSM`."""
+    for i, lo, hi in guard:
+        value = counters[i]
+        if value < lo or (hi is not None and value > hi):
+            return False
+    return True
+
+
+def _holds_initially(guard):
+    """Check a guard against counters which are all zero."""
+    return all(lo <= 0 for (i, lo, hi) in guard)
+
+
+def _moved(transition, tag, offset=0, guard=()):
+    """
+        Tag the target state of a transition and renumber its counters by
+        `offset`, optionally prepending a further `guard`. This is how the
+        states and counters of several CFSMs are kept apart when combining them.
+    """
+    next, conditions, incs, resets = transition
+    return (
+        (tag, next),
+        guard + _shift_guard(conditions, offset),
+        tuple(i + offset for i in incs),
+        tuple(i + offset for i in resets),
+    )
+
+
+def _shift_guard(guard, offset):
+    return tuple((i + offset, lo, hi) for (i, lo, hi) in guard)
+
+
+def _build(alphabet, initial, finals, map, bounds):
+    """Number the states of a freshly composed CFSM 0, 1, 2..."""
+    names = {initial: 0}
+    for state in map:
+        names.setdefault(state, len(names))
+    for state in finals:
+        names.setdefault(state, len(names))
+    for transitions in map.values():
+        for options in transitions.values():
+            for option in options:
+                names.setdefault(option[0], len(names))
+    return CFSM(
+        alphabet=alphabet,
+        states=range(len(names)),
+        initial=0,
+        finals={names[state]: guards for state, guards in finals.items()},
+        map={
+            names[state]: {
+                symbol: tuple((names[option[0]],) + option[1:] for option in options)
+                for symbol, options in transitions.items()
+            }
+            for state, transitions in map.items()
+        },
+        bounds=bounds,
+    )
+
+
+class CFSM:
+    """
+        A counting finite state machine is a nondeterministic FSM with a
+        tuple of bounded counters. At any given moment, it is in a set of
+        configurations, each being a state plus the current value of every
+        counter. Counters start at zero.
+
+        `map[state][symbol]` is a tuple of transitions. A transition is a
+        tuple `(next, guard, incs, resets)`: it can only be taken if its
+        guard holds, and taking it first sets the counters listed in
+        `resets` to zero, then increments the counters listed in `incs`.
+        A guard is a tuple of `(counter, lo, hi)` conditions, all of which
+        must hold: `lo <= value <= hi`, where `hi` may be None for no upper
+        limit. Counter `i` saturates at `bounds[i]`.
+
+        `finals[state]` is a tuple of guards; a configuration is accepting
+        if any one of them holds. An unconditionally final state therefore
+        maps to `((),)`.
+
+        Matching, emptiness, intersection and conversion to a classic `FSM`
+        are all decidable since every counter is bounded. Only conversion to
+        an `FSM` expands the counters into states.
+    """
+
+    def __init__(self, alphabet, states, initial, finals, map, bounds=()):
+        self.alphabet = set(alphabet)
+        self.states = set(states)
+        self.initial = initial
+        self.finals = finals
+        self.map = map
+        self.bounds = tuple(bounds)
+
+    @classmethod
+    def from_fsm(cls, f):
+        """
+            Wrap a classic FSM. No counters are needed. Dead states are left out,
+            since a nondeterministic machine would otherwise carry them around in
+            every one of its configurations.
+        """
+        incoming = {}
+        for state, transitions in f.map.items():
+            for next in transitions.values():
+                incoming.setdefault(next, set()).add(state)
+        live = set(f.finals)
+        queue = list(f.finals)
+        while queue:
+            for prev in incoming.get(queue.pop(), ()):
+                if prev not in live:
+                    live.add(prev)
+                    queue.append(prev)
+
+        return cls(
+            alphabet=f.alphabet,
+            states=f.states,
+            initial=f.initial,
+            finals={state: ((),) for state in f.finals},
+            map={
+                state: {
+                    symbol: ((next, (), (), ()),)
+                    for symbol, next in transitions.items()
+                    if next in live
+                }
+                for state, transitions in f.map.items()
+                if state in live
+            },
+        )
+
+    def __repr__(self):
+        string = "CFSM("
+        string += "alphabet = " + repr(self.alphabet)
+        string += ", states = " + repr(self.states)
+        string += ", initial = " + repr(self.initial)
+        string += ", finals = " + repr(self.finals)
+        string += ", map = " + repr(self.map)
+        string += ", bounds = " + repr(self.bounds)
+        string += ")"
+        return string
+
+    def _symbol(self, symbol):
+        if symbol not in self.alphabet and anything_else in self.alphabet:
+            return anything_else
+        return symbol
+
+    def _initial_configuration(self):
+        return self.initial, (0,) * len(self.bounds)
+
+    def _accepting(self, configuration):
+        state, counters = configuration
+        return any(_satisfies(counters, guard) for guard in self.finals.get(state, ()))
+
+    def _follow(self, configuration, transitions):
+        """Yield every configuration reachable from this one using `transitions`."""
+        state, counters = configuration
+        bounds = self.bounds
+        for next, guard, incs, resets in transitions:
+            if not _satisfies(counters, guard):
+                continue
+            if incs or resets:
+                new = list(counters)
+                for i in resets:
+                    new[i] = 0
+                for i in incs:
+                    if new[i] < bounds[i]:
+                        new[i] += 1
+                yield next, tuple(new)
+            else:
+                yield next, counters
+
+    def _step(self, configurations, symbol):
+        next = set()
+        for configuration in configurations:
+            state = configuration[0]
+            if state in self.map and symbol in self.map[state]:
+                next.update(self._follow(configuration, self.map[state][symbol]))
+        return next
+
+    def accepts(self, input):
+        """
+            Test whether the present CFSM accepts the supplied string (iterable
+            of symbols). Unknown symbols are converted to `fsm.anything_else` if
+            that is in the alphabet.
+        """
+        configurations = {self._initial_configuration()}
+        for symbol in input:
+            configurations = self._step(configurations, self._symbol(symbol))
+            if not configurations:
+                return False
+        return any(self._accepting(configuration) for configuration in configurations)
+
+    def __contains__(self, string):
+        return self.accepts(string)
+
+    def witness(self):
+        """
+            Return a shortest string (list of symbols) accepted by the present
+            CFSM, or None if it accepts nothing. This is a breadth-first search
+            over configurations which stops as soon as an accepting one is found.
+        """
+        initial = self._initial_configuration()
+        parents = {initial: None}
+        queue = [initial]
+        i = 0
+        while i < len(queue):
+            configuration = queue[i]
+            if self._accepting(configuration):
+                string = []
+                while parents[configuration] is not None:
+                    configuration, symbol = parents[configuration]
+                    string.append(symbol)
+                return string[::-1]
+            state = configuration[0]
+            for symbol, transitions in self.map.get(state, {}).items():
+                for next in self._follow(configuration, transitions):
+                    if next not in parents:
+                        parents[next] = (configuration, symbol)
+                        queue.append(next)
+            i += 1
+        return None
+
+    def empty(self):
+        """
+            A CFSM is empty if no accepting configuration is reachable from the
+            initial one.
+        """
+        return self.witness() is None
+
+    @traced("cfsm.to_fsm")
+    def to_fsm(self):
+        """
+            Expand the counters and return a classic (deterministic) FSM accepting
+            the same strings. This can be very large: that's why CFSMs exist.
+        """
+        initial = frozenset({self._initial_configuration()})
+
+        def follow(current, symbol):
+            next = self._step(current, symbol)
+            if not next:
+                raise OblivionError
+            return frozenset(next)
+
+        def final(state):
+            return any(self._accepting(configuration) for configuration in state)
+
+        return crawl(self.alphabet, initial, final, follow)
+
+    def _initial_transitions(self):
+        """
+            Transitions out of the initial state whose guards hold when every
+            counter is zero, which is always the case when this CFSM is entered
+            from another one.
+        """
+        return {
+            symbol: tuple(option for option in options if _holds_initially(option[1]))
+            for symbol, options in self.map.get(self.initial, {}).items()
+        }
+
+    def _accepts_empty(self):
+        return any(_holds_initially(guard) for guard in self.finals.get(self.initial, ()))
+
+    @traced("cfsm.concatenate")
+    def concatenate(*cfsms):
+        """
+            Concatenate arbitrarily many CFSMs together. No metastates are needed
+            because CFSMs are nondeterministic anyway.
+        """
+        cfsms = list(cfsms)
+        result = cfsms.pop()
+        while cfsms:
+            result = cfsms.pop()._concatenate(result)
+        return result
+
+    def _concatenate(self, other):
+        offset = len(self.bounds)
+        entry = other._initial_transitions()
+        other_accepts_empty = other._accepts_empty()
+
+        map = {}
+        finals = {}
+        for state in self.states:
+            transitions = {
+                symbol: tuple(_moved(option, 0) for option in options)
+                for symbol, options in self.map.get(state, {}).items()
+            }
+            for guard in self.finals.get(state, ()):
+                # Finishing here lets us carry straight on into `other`
+                for symbol, options in entry.items():
+                    transitions[symbol] = transitions.get(symbol, ()) + tuple(
+                        _moved(option, 1, offset, guard) for option in options
+                    )
+                if other_accepts_empty:
+                    finals[(0, state)] = finals.get((0, state), ()) + (guard,)
+            map[(0, state)] = transitions
+        for state in other.states:
+            map[(1, state)] = {
+                symbol: tuple(_moved(option, 1, offset) for option in options)
+                for symbol, options in other.map.get(state, {}).items()
+            }
+            if state in other.finals:
+                finals[(1, state)] = tuple(_shift_guard(guard, offset) for guard in other.finals[state])
+
+        return _build(
+            self.alphabet | other.alphabet,
+            (0, self.initial),
+            finals,
+            map,
+            self.bounds + other.bounds,
+        )
+
+    def __add__(self, other):
+        return self.concatenate(other)
+
+    @traced("cfsm.union")
+    def union(*cfsms):
+        """
+            Return a CFSM accepting any string accepted by any of the inputs.
+            A new initial state starts all of them off at once.
+        """
+        map = {"initial": {}}
+        finals = {}
+        bounds = ()
+        for n, c in enumerate(cfsms):
+            offset = len(bounds)
+            bounds += c.bounds
+            for state in c.states:
+                map[(n, state)] = {
+                    symbol: tuple(_moved(option, n, offset) for option in options)
+                    for symbol, options in c.map.get(state, {}).items()
+                }
+                if state in c.finals:
+                    finals[(n, state)] = tuple(_shift_guard(guard, offset) for guard in c.finals[state])
+            for symbol, options in c._initial_transitions().items():
+                map["initial"][symbol] = map["initial"].get(symbol, ()) + tuple(
+                    _moved(option, n, offset) for option in options
+                )
+            if c._accepts_empty():
+                finals["initial"] = ((),)
+
+        alphabet = set().union(*[c.alphabet for c in cfsms])
+        return _build(alphabet, "initial", finals, map, bounds)
+
+    def __or__(self, other):
+        return self.union(other)
+
+    @traced("cfsm.times")
+    def times(self, min, max):
+        """
+            Return a CFSM accepting between `min` and `max` repetitions of the
+            present one; `max` may be None for no upper limit. A single new
+            counter keeps track of the number of completed repetitions, so the
+            size of the result does not depend on the bounds at all.
+        """
+        if max is not None and min > max:
+            raise Exception("Invalid repetition bounds: " + repr((min, max)))
+        if max == 0:
+            return CFSM(self.alphabet, {0}, 0, {0: ((),)}, {})
+        if self._accepts_empty():
+            # X{m,n} is the same as X{0,n} if X matches the empty string.
+            min = 0
+
+        counter = len(self.bounds)
+        inner = tuple(range(counter))
+        if max is None:
+            bound = min - 1 if min > 1 else 0
+            more = ()
+            done = ((counter, bound, None),) if min > 1 else ()
+        else:
+            bound = max - 1
+            more = ((counter, 0, max - 2),)
+            done = ((counter, min - 1 if min > 1 else 0, max - 1),)
+        entry = self._initial_transitions()
+
+        map = {"initial": {
+            symbol: tuple(_moved(option, 0) for option in options)
+            for symbol, options in entry.items()
+        }}
+        finals = {"initial": ((),)} if min == 0 else {}
+        for state in self.states:
+            transitions = {
+                symbol: tuple(_moved(option, 0) for option in options)
+                for symbol, options in self.map.get(state, {}).items()
+            }
+            guards = self.finals.get(state, ())
+            if guards:
+                finals[(0, state)] = tuple(guard + done for guard in guards)
+            if max is None or max > 1:
+                # Finish this repetition and start the next one at once
+                for guard in guards:
+                    for symbol, options in entry.items():
+                        transitions[symbol] = transitions.get(symbol, ()) + tuple(
+                            ((0, next), guard + more + conditions, incs + (counter,), resets + inner)
+                            for (next, conditions, incs, resets) in options
+                        )
+            map[(0, state)] = transitions
+
+        return _build(self.alphabet, "initial", finals, map, self.bounds + (bound,))
+
+    @traced("cfsm.intersection")
+    def intersection(*cfsms):
+        """
+            Return a CFSM accepting only the strings accepted by all of the
+            inputs. Only product states reachable from the initial state are
+            built; the counters of the inputs are simply put side by side.
+        """
+        alphabet = set().union(*[c.alphabet for c in cfsms])
+        offsets = []
+        bounds = ()
+        for c in cfsms:
+            offsets.append(len(bounds))
+            bounds += c.bounds
+
+        def combine(choices):
+            next = tuple(option[0] for option in choices)
+            guard = sum((_shift_guard(option[1], offset) for option, offset in zip(choices, offsets)), ())
+            incs = sum((tuple(i + offset for i in option[2]) for option, offset in zip(choices, offsets)), ())
+            resets = sum((tuple(i + offset for i in option[3]) for option, offset in zip(choices, offsets)), ())
+            return next, guard, incs, resets
+
+        def products(lists):
+            result = [()]
+            for options in lists:
+                result = [done + (option,) for done in result for option in options]
+            return result
+
+        initial = tuple(c.initial for c in cfsms)
+        map = {}
+        finals = {}
+        queue = [initial]
+        while queue:
+            state = queue.pop()
+            if state in map:
+                continue
+            map[state] = {}
+            for symbol in alphabet:
+                lists = []
+                for c, substate in zip(cfsms, state):
+                    actual = c._symbol(symbol)
+                    lists.append(c.map.get(substate, {}).get(actual, ()))
+                options = tuple(combine(choices) for choices in products(lists))
+                if options:
+                    map[state][symbol] = options
+                    queue.extend(option[0] for option in options)
+            guards = products([
+                [_shift_guard(guard, offset) for guard in c.finals.get(substate, ())]
+                for c, substate, offset in zip(cfsms, state, offsets)
+            ])
+            if guards:
+                finals[state] = tuple(sum(guard, ()) for guard in guards)
+
+        return _build(alphabet, initial, finals, map, bounds)
+
+    def __and__(self, other):
+        return self.intersection(other)
+
+    def isdisjoint(self, other):
+        """
+            Treat `self` and `other` as sets of strings and see if they are disjoint
+        """
+        return (self & other).empty()
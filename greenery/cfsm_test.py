@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+
+if __name__ == "__main__":
+	raise Exception("Test files can't be run directly. Use `python -m pytest greenery`")
+
+import itertools
+
+from greenery.cfsm import CFSM
+from greenery.fsm import anything_else
+from greenery.lego import parse
+
+alphabet = {"a", "b", anything_else}
+strings = ["".join(s) for n in range(8) for s in itertools.product("abc", repeat=n)]
+
+def counting(regex):
+	return CFSM.from_fsm(parse(regex).to_fsm(alphabet))
+
+def check(c, regex):
+	f = parse(regex).to_fsm(alphabet)
+	for string in strings:
+		assert c.accepts(string) == f.accepts(string), (regex, string)
+	assert c.to_fsm().equivalent(f)
+
+def test_times():
+	check(counting("a").times(2, 5), "a{2,5}")
+	check(counting("ab|b").times(0, 3), "(ab|b){0,3}")
+	check(counting("a*b").times(2, None), "(a*b){2,}")
+	check(counting("(ab)?").times(2, 4), "((ab)?){2,4}")
+	check(counting("a").times(0, 0), "")
+	check(counting("ab").times(3, 3), "(ab){3}")
+
+def test_nested_times():
+	check(counting("a|bb").times(1, 2).times(2, 3), "((a|bb){1,2}){2,3}")
+
+def test_combinations():
+	ab = counting("ab").times(1, 3)
+	check(ab + counting("b") + ab, "(ab){1,3}b(ab){1,3}")
+	check(ab | counting("ba"), "(ab){1,3}|ba")
+	check(ab & counting("a*b*"), "ab")
+
+def test_large_bounds():
+	big = counting("[^b]").times(0, 65535)
+	assert len(big.states) < 10
+	assert big.accepts("a" * 65535)
+	assert not big.accepts("a" * 65536)
+	assert big.isdisjoint(counting("a*b"))
+	assert (big & counting("b*a{3}")).witness() == ["a", "a", "a"]
+	assert (big & counting("b")).empty()
+
+def test_lego_to_cfsm():
+	regex = parse("abc[^\\n]{0,65535}def|x{100,}")
+	c = regex.to_cfsm()
+	assert regex.counted()
+	assert sorted(c.bounds) == [99, 65534]
+	assert c.accepts("abc" + "q" * 60000 + "def")
+	assert not c.accepts("x" * 99)
+	assert c.accepts("x" * 150)
+
+	# Below the threshold we get the usual FSM
+	small = parse("(ab){2,3}")
+	assert not small.counted()
+	assert small.to_cfsm().bounds == ()
+	assert parse("(ab){20,30}").to_cfsm(threshold=10).to_fsm().equivalent(parse("(ab){20,30}").to_fsm())
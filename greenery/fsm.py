@@ -3,7 +3,11 @@
 """
 	Finite state machine library.
 """
+import csv
 from collections import defaultdict
+from contextlib import contextmanager
+from functools import wraps
+from time import perf_counter
 from typing import Any, Set, Dict
 
 
@@ -22,17 +26,88 @@ class _AnythingElseCls:
     def __repr__(self):
         return "anything_else"
 
+    def __reduce__(self):
+        # Unpickle as the module's one instance, so `is` checks keep working
+        return "anything_else"
+
 
 # We use a class instance because that gives us control over how the special
 # value gets serialised. Otherwise this would just be `object()`.
 anything_else = _AnythingElseCls()
 
 
+# Placeholder for the (nonexistent) state of an FSM which has fallen into
+# oblivion while several FSMs are being crawled in parallel.
+_dead = object()
+
+
 def key(symbol):
     """Ensure `fsm.anything_else` always sorts last"""
     return symbol is anything_else, symbol
 
 
+def _show(char):
+    """Render a single character for a label, escaping the label's own syntax"""
+    if char in "-,\\":
+        return "\\" + char
+    if char.isprintable() and char != " ":
+        return char
+    if char == " ":
+        return "\\x20"
+    return repr(char)[1:-1]
+
+
+def label(symbols):
+    """
+        Describe a collection of symbols compactly, for writing out large FSMs.
+        Runs of consecutive single characters become ranges, e.g. "a-z", the
+        other symbols are listed after them (a frozenset of characters, as used
+        for symbol classes, in square brackets) and `anything_else` comes last.
+        Items are separated by commas; "-", "," and "\\" are escaped with a
+        backslash.
+    """
+    chars = sorted(ord(symbol) for symbol in symbols if isinstance(symbol, str) and len(symbol) == 1)
+    others = sorted(
+        ("[" + label(symbol) + "]" if isinstance(symbol, frozenset) else repr(symbol)
+         for symbol in symbols
+         if symbol is not anything_else and not (isinstance(symbol, str) and len(symbol) == 1)),
+    )
+    items = []
+    i = 0
+    while i < len(chars):
+        j = i
+        while j + 1 < len(chars) and chars[j + 1] == chars[j] + 1:
+            j += 1
+        if j - i >= 2:
+            items.append(_show(chr(chars[i])) + "-" + _show(chr(chars[j])))
+        else:
+            items.extend(_show(chr(c)) for c in chars[i:j + 1])
+        i = j + 1
+    items.extend(others)
+    if anything_else in symbols:
+        items.append(str(anything_else))
+    return ",".join(items)
+
+
+def _by_target(transitions):
+    """
+        Group the transitions out of one state by destination, giving
+        `(label, next)` pairs in a stable order.
+    """
+    targets = {}
+    for symbol, next in transitions.items():
+        targets.setdefault(next, []).append(symbol)
+    return sorted(((label(symbols), next) for next, symbols in targets.items()), key=lambda pair: pair[0])
+
+
+def _ordered(states):
+    """Sort the states if they can be sorted"""
+    try:
+        return sorted(states)
+    except TypeError:
+        return list(states)
+
+
 class OblivionError(Exception):
     """
         This exception is thrown while `crawl()`ing an FSM if we transition to the
@@ -43,6 +118,196 @@ class OblivionError(Exception):
     pass
 
 
+class Tracer:
+    """
+        Receives notifications while FSMs are being built. Every traced
+        operation (`concatenate()`, `star()`, `times()`, `reversed()`,
+        `reduce()`, `parallel()`...) opens a span with `enter()` and closes it
+        with `exit()`; spans nest, so e.g. the two `reversed()` calls made by
+        `reduce()` appear inside the `reduce()` span. Every `crawl()` reports
+        its statistics with `crawled()`, which belong to the innermost open
+        span. This base class ignores everything and is installed by default.
+    """
+
+    def enter(self, name):
+        pass
+
+    def exit(self, name, seconds, states):
+        """
+            `seconds` is the wall time spent inside the span, `states` the number
+            of states of the resulting FSM (or None if the result was not an
+            FSM, or if the operation raised an exception).
+        """
+        pass
+
+    def crawled(self, states, follows, oblivions):
+        """
+            `states` metastates were explored by `crawl()`, making `follows`
+            calls to `follow()` of which `oblivions` raised an `OblivionError`.
+        """
+        pass
+
+
+class StatsTracer(Tracer):
+    """
+        A tracer which records every span in a tree (see `roots`) and
+        aggregates them by operation name (see `totals` and `report()`).
+        Crawl statistics are attributed to the innermost span only, so the
+        aggregated numbers never count the same crawl twice.
+    """
+
+    class Span:
+        def __init__(self, name):
+            self.name = name
+            self.seconds = 0.0
+            self.states = None
+            self.metastates = 0
+            self.follows = 0
+            self.oblivions = 0
+            self.children = []
+
+    class Total:
+        def __init__(self):
+            self.calls = 0
+            self.seconds = 0.0
+            self.max_seconds = 0.0
+            self.peak_states = 0
+            self.metastates = 0
+            self.follows = 0
+            self.oblivions = 0
+
+    def __init__(self):
+        self.roots = []
+        self.totals = defaultdict(StatsTracer.Total)
+        self._stack = []
+
+    def enter(self, name):
+        span = StatsTracer.Span(name)
+        if self._stack:
+            self._stack[-1].children.append(span)
+        else:
+            self.roots.append(span)
+        self._stack.append(span)
+
+    def exit(self, name, seconds, states):
+        span = self._stack.pop()
+        span.seconds = seconds
+        span.states = states
+
+        total = self.totals[name]
+        total.calls += 1
+        total.seconds += seconds
+        total.max_seconds = max(total.max_seconds, seconds)
+        if states is not None:
+            total.peak_states = max(total.peak_states, states)
+        total.metastates += span.metastates
+        total.follows += span.follows
+        total.oblivions += span.oblivions
+
+    def crawled(self, states, follows, oblivions):
+        if self._stack:
+            span = self._stack[-1]
+        else:
+            # A bare `crawl()` with no traced operation around it
+            span = StatsTracer.Span("crawl")
+            self.roots.append(span)
+            total = self.totals["crawl"]
+            total.calls += 1
+            total.peak_states = max(total.peak_states, states)
+            total.metastates += states
+            total.follows += follows
+            total.oblivions += oblivions
+        span.metastates += states
+        span.follows += follows
+        span.oblivions += oblivions
+
+    def report(self):
+        """
+            Return the aggregated statistics as a table, slowest operation first.
+        """
+        rows = [["operation", "calls", "seconds", "max", "peak", "metastates", "follows", "oblivions"]]
+        for name, total in sorted(self.totals.items(), key=lambda item: -item[1].seconds):
+            rows.append([
+                name,
+                str(total.calls),
+                "{0:.6f}".format(total.seconds),
+                "{0:.6f}".format(total.max_seconds),
+                str(total.peak_states),
+                str(total.metastates),
+                str(total.follows),
+                str(total.oblivions),
+            ])
+        colwidths = [max(len(row[x]) for row in rows) + 1 for x in range(len(rows[0]))]
+        rows.insert(1, ["-" * colwidth for colwidth in colwidths])
+        return "".join(
+            "".join(cell.ljust(colwidth) for cell, colwidth in zip(row, colwidths)).rstrip() + "\n"
+            for row in rows
+        )
+
+
+_tracer = Tracer()
+
+
+def get_tracer():
+    """Return the tracer currently receiving FSM construction events."""
+    return _tracer
+
+
+def set_tracer(tracer):
+    """
+        Install `tracer` to receive FSM construction events and return the
+        previously installed one. Pass `None` to go back to the no-op default.
+    """
+    global _tracer
+    previous = _tracer
+    _tracer = Tracer() if tracer is None else tracer
+    return previous
+
+
+@contextmanager
+def tracing(tracer=None):
+    """
+        Install a tracer for the duration of a `with` block, e.g.
+            with fsm.tracing() as stats:
+                ...
+            print(stats.report())
+        If no tracer is supplied, a fresh `StatsTracer` is used.
+    """
+    if tracer is None:
+        tracer = StatsTracer()
+    previous = set_tracer(tracer)
+    try:
+        yield tracer
+    finally:
+        set_tracer(previous)
+
+
+def traced(name):
+    """
+        Decorator which wraps every call to the decorated function in a span
+        called `name`. Can be used to trace operations outside this module too.
+    """
+
+    def decorate(function):
+        @wraps(function)
+        def new_function(*args, **kwargs):
+            tracer = _tracer
+            tracer.enter(name)
+            states = None
+            start = perf_counter()
+            try:
+                result = function(*args, **kwargs)
+                if isinstance(result, FSM):
+                    states = len(result.states)
+                return result
+            finally:
+                tracer.exit(name, perf_counter() - start, states)
+
+        return new_function
+
+    return decorate
+
+
 class FSM:
     """
         A Finite State Machine or FSM has an alphabet and a set of states. At any
@@ -121,6 +386,7 @@ class FSM:
         """
         return self.accepts(string)
 
+    @traced("reduce")
     def reduce(self):
         """
             A result by Brzozowski (1963) shows that a minimal finite state machine
@@ -142,10 +408,12 @@ class FSM:
     def __str__(self):
         rows = []
 
+        alphabet = sorted(self.alphabet, key=key)
+
         # top row
         row = ["", "name", "final?"]
         row.extend(str(symbol) if symbol not in ('\n','\t',' ','\r','\f') else repr(symbol)[1:-1] 
-                   for symbol in sorted(self.alphabet, key=key))
+                   for symbol in alphabet)
         rows.append(row)
 
         # other rows
@@ -160,7 +428,7 @@ class FSM:
                 row.append("True")
             else:
                 row.append("False")
-            for symbol in sorted(self.alphabet, key=key):
+            for symbol in alphabet:
                 if state in self.map and symbol in self.map[state]:
                     row.append(str(self.map[state][symbol]))
                 else:
@@ -182,6 +450,64 @@ class FSM:
 
         return "".join("".join(row) + "\n" for row in rows)
 
+    def write_table(self, file):
+        """
+            Write a transition table to a text file object, one line per state.
+            Unlike `str()` there is no column per symbol: each line lists the
+            state's transitions grouped by destination, with the symbols
+            collapsed into ranges (see `label()`), so this works for FSMs with
+            thousands of states and large alphabets. Only one line is held in
+            memory at a time.
+        """
+        width = max(len(str(state)) for state in self.states) + 1
+        for state in _ordered(self.states):
+            line = "*" if state == self.initial else " "
+            line += " " + str(state).ljust(width)
+            line += "final " if state in self.finals else "      "
+            line += " ".join(
+                "[" + symbols + "]->" + str(next)
+                for symbols, next in _by_target(self.map.get(state, {}))
+            )
+            file.write(line.rstrip() + "\n")
+
+    def write_dot(self, file, name="fsm"):
+        """
+            Write the FSM to a text file object in Graphviz DOT format, with one
+            edge per pair of connected states, labelled with the symbols which
+            lead from one to the other (see `label()`). Render it with e.g.
+            `dot -Tsvg`.
+        """
+        def quote(string):
+            return '"' + str(string).replace("\\", "\\\\").replace('"', '\\"') + '"'
+
+        file.write("digraph " + quote(name) + " {\n")
+        file.write("\trankdir=LR;\n")
+        file.write("\tnode [shape=circle];\n")
+        file.write("\t__initial [shape=point];\n")
+        file.write("\t__initial -> " + quote(self.initial) + ";\n")
+        for state in _ordered(self.states):
+            if state in self.finals:
+                file.write("\t" + quote(state) + " [shape=doublecircle];\n")
+            else:
+                file.write("\t" + quote(state) + ";\n")
+            for symbols, next in _by_target(self.map.get(state, {})):
+                file.write("\t" + quote(state) + " -> " + quote(next) + " [label=" + quote(symbols) + "];\n")
+        file.write("}\n")
+
+    def write_edges(self, file, delimiter=","):
+        """
+            Write the transitions to a text file object as a CSV edge list with
+            the columns "source", "target" and "symbols", one row per pair of
+            connected states. Use `delimiter="\\t"` for TSV. Open the file with
+            `newline=""`, as for any CSV file.
+        """
+        writer = csv.writer(file, delimiter=delimiter, lineterminator="\n")
+        writer.writerow(["source", "target", "symbols"])
+        for state in _ordered(self.states):
+            for symbols, next in _by_target(self.map.get(state, {})):
+                writer.writerow([state, next, symbols])
+
+    @traced("concatenate")
     def concatenate(*fsms):
         """
             Concatenate arbitrarily many finite state machines together.
@@ -246,6 +572,7 @@ class FSM:
         """
         return self.concatenate(other)
 
+    @traced("star")
     def star(self):
         """
             If the present FSM accepts X, returns an FSM accepting X* (i.e. 0 or
@@ -284,41 +611,92 @@ class FSM:
         base.initial = num_states
         return base
 
+    @traced("times")
     def times(self, multiplier):
         """
             Given an FSM and a multiplier, return the multiplied FSM.
+            Rather than crawling (state, iteration) pairs, which scales linearly
+            with the multiplier, we use exponentiation by squaring: the unit is
+            repeatedly concatenated with itself, minimising after every step, so
+            only O(log(multiplier)) concatenations take place.
         """
         if multiplier < 0:
             raise Exception("Can't multiply an FSM by " + repr(multiplier))
 
-        alphabet = self.alphabet
-
-        # metastate is a set of iterations+states
-        initial = {(self.initial, 0)}
+        if multiplier == 0:
+            return epsilon(self.alphabet)
+
+        unit = self.reduce()
+        if multiplier == 1:
+            return unit
+
+        chained = unit._chain(multiplier)
+        if chained is not None:
+            return chained
+
+        result = None
+        power = unit
+        while True:
+            if multiplier & 1:
+                result = power if result is None else (result + power).reduce()
+            multiplier >>= 1
+            if multiplier == 0:
+                return result
+            power = (power + power).reduce()
+
+    def _chain(self, multiplier):
+        """
+            Fast path for `times()`. If the FSM has a single "exit", i.e. one
+            final state with no outgoing transitions (which is the case for
+            every minimal FSM accepting strings of a fixed length, such as a
+            charclass), then concatenating copies of it never gives rise to
+            a metastate: we can simply identify the exit of each copy with the
+            initial state of the next. This also works if the initial state is
+            final, provided that it cannot be re-entered, as in "(ab)?".
+            Returns None if the FSM doesn't have this shape.
+        """
+        exits = self.finals - {self.initial}
+        if len(exits) != 1:
+            return None
+        (exit,) = exits
+        if self.map.get(exit):
+            return None
+        if self.initial in self.finals:
+            for transitions in self.map.values():
+                if self.initial in transitions.values():
+                    return None
+
+        # Number the states of one copy so that the initial state comes first
+        # and the exit comes last; the exit of copy `i` is then the initial
+        # state of copy `i + 1`.
+        others = [state for state in self.states if state not in {self.initial, exit}]
+        index = {self.initial: 0, exit: len(others) + 1}
+        for i, state in enumerate(others):
+            index[state] = i + 1
+        width = len(others) + 1
+
+        map = {}
+        for i in range(multiplier):
+            offset = i * width
+            for state, transitions in self.map.items():
+                if transitions:
+                    map[offset + index[state]] = {
+                        symbol: offset + index[next]
+                        for symbol, next in transitions.items()
+                    }
+
+        finals = {multiplier * width}
+        if self.initial in self.finals:
+            finals.update(i * width for i in range(multiplier))
 
-        def final(state):
-            """If the initial state is final then multiplying doesn't alter that"""
-            for (substate, iteration) in state:
-                if substate == self.initial \
-                        and (self.initial in self.finals or iteration == multiplier):
-                    return True
-            return False
-
-        def follow(current, symbol):
-            next = []
-            for (substate, iteration) in current:
-                if iteration < multiplier \
-                        and substate in self.map \
-                        and symbol in self.map[substate]:
-                    next.append((self.map[substate][symbol], iteration))
-                    # final of self? merge with initial on next iteration
-                    if self.map[substate][symbol] in self.finals:
-                        next.append((self.initial, iteration + 1))
-            if len(next) == 0:
-                raise OblivionError
-            return frozenset(next)
-
-        return crawl(alphabet, initial, final, follow)
+        return FSM(
+            alphabet=self.alphabet,
+            states=range(multiplier * width + 1),
+            initial=0,
+            finals=finals,
+            map=map,
+            __no_validation__=True,
+        )
 
     def __mul__(self, multiplier):
         """
@@ -378,6 +756,7 @@ class FSM:
         """
         return self.symmetric_difference(other)
 
+    @traced("everythingbut")
     def everythingbut(self):
         """
             Return a finite state machine which will accept any string NOT
@@ -401,6 +780,7 @@ class FSM:
 
         return crawl(alphabet, initial, final, follow)
 
+    @traced("reversed")
     def reversed(self):
         """
             Return a new FSM such that for every string that self accepts (e.g.
@@ -413,14 +793,20 @@ class FSM:
         # no other states get generated.
         initial = frozenset(self.finals)
 
+        # Index the transitions by where they lead, so that following a
+        # state-set doesn't look at every transition there is.
+        incoming = {}
+        for prev, transitions in self.map.items():
+            for symbol, state in transitions.items():
+                incoming.setdefault((state, symbol), []).append(prev)
+
         # Find every possible way to reach the current state-set
         # using this symbol.
         def follow(current, symbol):
             next = frozenset([
                 prev
-                for prev in self.map
                 for state in current
-                if symbol in self.map[prev] and self.map[prev][symbol] == state
+                for prev in incoming.get((state, symbol), ())
             ])
             if len(next) == 0:
                 raise OblivionError
@@ -746,6 +1132,7 @@ def epsilon(alphabet):
     )
 
 
+@traced("parallel")
 def parallel(fsms, test):
     """
         Crawl several FSMs in parallel, mapping the states of a larger meta-FSM.
@@ -754,34 +1141,62 @@ def parallel(fsms, test):
     """
     alphabet = set().union(*[fsm.alphabet for fsm in fsms])
 
-    initial = {i: fsm.initial for (i, fsm) in enumerate(fsms)}
+    # A metastate is a tuple of the current state of each FSM, with `_dead`
+    # standing in for any FSM which has already fallen into oblivion. Unlike a
+    # dict this is hashable, which lets `crawl()` look metastates up quickly.
+    initial = tuple(fsm.initial for fsm in fsms)
 
     # dedicated function accepts a "superset" and returns the next "superset"
     # obtained by following this transition in the new FSM
     def follow(current, symbol, fsm_range=tuple(enumerate(fsms))):
-        next = {}
+        next = []
+        alive = False
         for i, f in fsm_range:
             if symbol not in f.alphabet and anything_else in f.alphabet:
                 actual_symbol = anything_else
             else:
                 actual_symbol = symbol
-            if i in current \
-                    and current[i] in f.map \
-                    and actual_symbol in f.map[current[i]]:
-                next[i] = f.map[current[i]][actual_symbol]
-        if not next:
+            substate = current[i]
+            if substate in f.map and actual_symbol in f.map[substate]:
+                next.append(f.map[substate][actual_symbol])
+                alive = True
+            else:
+                next.append(_dead)
+        if not alive:
             raise OblivionError
-        return next
+        return tuple(next)
 
     # Determine the "is final?" condition of each substate, then pass it to the
     # test to determine finality of the overall FSM.
     def final(state, fsm_range=tuple(enumerate(fsms))):
-        accepts = [i in state and state[i] in fsm.finals for (i, fsm) in fsm_range]
+        accepts = [state[i] in fsm.finals for (i, fsm) in fsm_range]
         return test(accepts)
 
     return crawl(alphabet, initial, final, follow)
 
 
+def _index(states, indices, state):
+    """
+        Return the index of `state` in the list of `states` discovered by a crawl
+        so far, appending it if it is new. Hashable metastates are looked up in
+        `indices` in constant time; unhashable ones (such as the dicts used by
+        `everythingbut()`) fall back to a linear search.
+    """
+    try:
+        j = indices.get(state)
+    except TypeError:
+        try:
+            return states.index(state)
+        except ValueError:
+            states.append(state)
+            return len(states) - 1
+    if j is None:
+        j = len(states)
+        states.append(state)
+        indices[state] = j
+    return j
+
+
 def crawl_reduced(alphabet, initial, final, follow, cat):
     """
         Given the above conditions and instructions, crawl a new unknown FSM,
@@ -790,9 +1205,13 @@ def crawl_reduced(alphabet, initial, final, follow, cat):
         forever if you supply an evil version of follow().
     """
 
-    states = [initial]
+    states = []
+    indices = {}
+    _index(states, indices, initial)
     finals = set()
     map = {}
+    follows = 0
+    oblivions = 0
 
     # iterate over a growing list
     i = 0
@@ -807,23 +1226,23 @@ def crawl_reduced(alphabet, initial, final, follow, cat):
         map[i] = {}
         categories = cat(state)
         for base_symbol, others in categories:
+            follows += 1
             try:
                 next = follow(state, base_symbol)
             except OblivionError:
                 # Reached an oblivion state. Don't list it.
+                oblivions += 1
                 continue
             else:
-                try:
-                    j = states.index(next)
-                except ValueError:
-                    j = len(states)
-                    states.append(next)
+                j = _index(states, indices, next)
                 map[i][base_symbol] = j
                 for s in others:
                     map[i][s] = j
 
         i += 1
 
+    _tracer.crawled(len(states), follows, oblivions)
+
     return FSM(
         alphabet=alphabet,
         states=range(len(states)),
@@ -842,10 +1261,14 @@ def crawl(alphabet, initial, final, follow):
         forever if you supply an evil version of follow().
     """
 
-    states = [initial]
+    states = []
+    indices = {}
+    _index(states, indices, initial)
     finals = set()
     map = {}
     sorted_alphabet = sorted(alphabet, key=key)
+    follows = 0
+    oblivions = 0
 
     # iterate over a growing list
     i = 0
@@ -859,21 +1282,21 @@ def crawl(alphabet, initial, final, follow):
         # compute map for this state
         map[i] = {}
         for symbol in sorted_alphabet:
+            follows += 1
             try:
                 next = follow(state, symbol)
             except OblivionError:
                 # Reached an oblivion state. Don't list it.
+                oblivions += 1
                 continue
             else:
-                try:
-                    j = states.index(next)
-                except ValueError:
-                    j = len(states)
-                    states.append(next)
+                j = _index(states, indices, next)
                 map[i][symbol] = j
 
         i += 1
 
+    _tracer.crawled(len(states), follows, oblivions)
+
     return FSM(
         alphabet=alphabet,
         states=range(len(states)),
@@ -4,6 +4,7 @@ if __name__ == "__main__":
 	raise Exception("Test files can't be run directly. Use `python -m pytest greenery`")
 
 import pytest
+from greenery import fsm
 from greenery.fsm import FSM, null, epsilon, anything_else
 
 def test_addbug():
@@ -708,3 +709,109 @@ def test_bug_36():
 	assert etc2.accepts(["s"])
 	assert both.alphabet == {anything_else, "s"}
 	assert both.accepts(["s"])
+
+def test_tracing(a, b):
+	with fsm.tracing() as stats:
+		reduced = ((a | b) * 3).reduce()
+	assert fsm.get_tracer() is not stats
+	assert stats.totals["times"].calls == 1
+	# times() reduces its unit, then the result is reduced once more
+	assert stats.totals["reduce"].calls == 2
+	assert stats.totals["reversed"].calls == 4
+	assert stats.totals["reduce"].peak_states == len(reduced.states)
+	assert stats.totals["parallel"].metastates > 0
+	assert stats.totals["parallel"].follows >= stats.totals["parallel"].oblivions
+
+	# The reversals made by reduce() are nested inside its span, and so is the
+	# reduce() made by times()
+	(times, reduce) = stats.roots[-2:]
+	assert [span.name for span in reduce.children] == ["reversed", "reversed"]
+	assert [span.name for span in times.children] == ["reduce"]
+	assert "reduce" in stats.report()
+
+	# A unit without a single exit is repeated by squaring, which concatenates
+	# and reduces within the times() span
+	with fsm.tracing() as stats:
+		FSM.concatenate(a, b.star()) * 3
+	(times,) = [span for span in stats.roots if span.name == "times"]
+	names = [span.name for span in times.children]
+	assert "concatenate" in names
+	assert names.count("reduce") >= 2
+	# Every concatenation but the one making the unit happens inside times()
+	assert stats.totals["concatenate"].calls == 1 + names.count("concatenate")
+
+def test_times_large(a, b):
+	# Repetition counts are handled by repeated squaring
+	ab = FSM.concatenate(a, b)
+	big = ab * 1000
+	assert big.accepts("ab" * 1000)
+	assert not big.accepts("ab" * 999)
+	assert not big.accepts("ab" * 1001)
+	assert len(big.states) == 2001
+
+	# Units without a single exit can't just be chained together
+	astar_b = FSM.concatenate(a.star(), b)
+	assert (astar_b * 37).accepts("ab" * 30 + "aab" + "b" * 6)
+	assert not (astar_b * 37).accepts("ab" * 36)
+	optional = (epsilon({"a", "b"}) | ab) * 100
+	assert optional.accepts("")
+	assert optional.accepts("ab" * 100)
+	assert not optional.accepts("ab" * 101)
+	assert len(ab * 0) == 1
+
+def test_tracer_is_pluggable(a):
+	class Counter(fsm.Tracer):
+		def __init__(self):
+			self.names = []
+		def enter(self, name):
+			self.names.append(name)
+	counter = Counter()
+	previous = fsm.set_tracer(counter)
+	try:
+		a.star()
+	finally:
+		assert fsm.set_tracer(previous) is counter
+	assert counter.names == ["star"]
+
+def test_label():
+	assert fsm.label({"a", "b", "c", "d", "x", "z", "y"}) == "a-d,x-z"
+	assert fsm.label({"a", "b", anything_else}) == "a,b,anything_else"
+	assert fsm.label({"-", ",", "\n", " "}) == "\\n,\\x20,\\,,\\-"
+	assert fsm.label({frozenset("aA"), 1}) == "1,[A,a]"
+
+def test_writers():
+	import io
+	letters = FSM(
+		alphabet = set("abcdefxy") | {anything_else},
+		states   = {0, 1},
+		initial  = 0,
+		finals   = {1},
+		map      = {
+			0: dict([(c, 1) for c in "abcdef"] + [("x", 0)]),
+			1: {"y": 0, anything_else: 1},
+		},
+	)
+
+	table = io.StringIO()
+	letters.write_table(table)
+	assert table.getvalue() == (
+		"* 0       [a-f]->1 [x]->0\n"
+		"  1 final [anything_else]->1 [y]->0\n"
+	)
+
+	dot = io.StringIO()
+	letters.write_dot(dot, name="letters")
+	assert '"0" -> "1" [label="a-f"];' in dot.getvalue()
+	assert '"1" [shape=doublecircle];' in dot.getvalue()
+	assert dot.getvalue().startswith('digraph "letters" {')
+	assert dot.getvalue().endswith("}\n")
+
+	edges = io.StringIO()
+	letters.write_edges(edges, delimiter="\t")
+	assert edges.getvalue().splitlines() == [
+		"source\ttarget\tsymbols",
+		"0\t1\ta-f",
+		"0\t0\tx",
+		"1\t1\tanything_else",
+		"1\t0\ty",
+	]
@@ -0,0 +1,218 @@
+# -*- coding: utf-8 -*-
+
+"""
+	Sets of Unicode code points, stored as sorted tuples of ranges so that
+	classes like "[^a]" or "\\w" over the whole of Unicode stay small.
+"""
+from bisect import bisect_right
+from sys import maxunicode
+
+# Every code point lies in [0, MAX_CODE_POINT].
+MAX_CODE_POINT = maxunicode
+
+
+class IntervalSet:
+    """
+        An immutable set of code points. `ranges` is a sorted tuple of
+        inclusive `(first, last)` pairs; ranges never overlap or touch, so
+        two equal sets always have equal `ranges`. Every set operation is
+        linear in the number of ranges, regardless of how many code points
+        they cover. Members may be tested with either a code point or a
+        one-character string.
+    """
+    __slots__ = "ranges", "_firsts"
+
+    def __init__(self, ranges=()):
+        merged = []
+        for first, last in sorted(ranges):
+            if first > last:
+                raise Exception("Invalid range: " + repr((first, last)))
+            if merged and first <= merged[-1][1] + 1:
+                if last > merged[-1][1]:
+                    merged[-1] = (merged[-1][0], last)
+            else:
+                merged.append((first, last))
+        self._init(tuple(merged))
+
+    def _init(self, ranges):
+        object.__setattr__(self, "ranges", ranges)
+        object.__setattr__(self, "_firsts", None)
+
+    @classmethod
+    def _from_ranges(cls, ranges):
+        """For ranges which are already sorted and merged."""
+        result = cls.__new__(cls)
+        result._init(tuple(ranges))
+        return result
+
+    @classmethod
+    def from_chars(cls, chars):
+        """Build the set of the code points of some one-character strings."""
+        ranges = []
+        for i in sorted(set(map(ord, chars))):
+            if ranges and ranges[-1][1] + 1 == i:
+                ranges[-1][1] = i
+            else:
+                ranges.append([i, i])
+        return cls._from_ranges((first, last) for first, last in ranges)
+
+    def __setattr__(self, name, value):
+        raise Exception("This object is immutable.")
+
+    def __repr__(self):
+        return "IntervalSet(" + repr(list(self.ranges)) + ")"
+
+    def __eq__(self, other):
+        try:
+            return self.ranges == other.ranges
+        except AttributeError:
+            return False
+
+    def __hash__(self):
+        return hash(self.ranges)
+
+    def __bool__(self):
+        return len(self.ranges) > 0
+
+    def __len__(self):
+        """The number of code points in the set, not the number of ranges."""
+        return sum(last - first + 1 for first, last in self.ranges)
+
+    def __contains__(self, char):
+        if isinstance(char, str):
+            if len(char) != 1:
+                return False
+            char = ord(char)
+        if self._firsts is None:
+            object.__setattr__(self, "_firsts", [first for first, last in self.ranges])
+        i = bisect_right(self._firsts, char) - 1
+        return i >= 0 and char <= self.ranges[i][1]
+
+    def chars(self):
+        """Generate every member as a one-character string, in order."""
+        for first, last in self.ranges:
+            for i in range(first, last + 1):
+                yield chr(i)
+
+    def __iter__(self):
+        return self.chars()
+
+    def complement(self):
+        """Every code point not in the present set."""
+        result = []
+        next = 0
+        for first, last in self.ranges:
+            if first > next:
+                result.append((next, first - 1))
+            next = last + 1
+        if next <= MAX_CODE_POINT:
+            result.append((next, MAX_CODE_POINT))
+        return IntervalSet._from_ranges(result)
+
+    def __invert__(self):
+        return self.complement()
+
+    def union(self, other):
+        result = []
+        a, b = self.ranges, other.ranges
+        i = j = 0
+        while i < len(a) or j < len(b):
+            if j == len(b) or (i < len(a) and a[i][0] <= b[j][0]):
+                first, last = a[i]
+                i += 1
+            else:
+                first, last = b[j]
+                j += 1
+            if result and first <= result[-1][1] + 1:
+                if last > result[-1][1]:
+                    result[-1] = (result[-1][0], last)
+            else:
+                result.append((first, last))
+        return IntervalSet._from_ranges(result)
+
+    def __or__(self, other):
+        return self.union(other)
+
+    def intersection(self, other):
+        result = []
+        a, b = self.ranges, other.ranges
+        i = j = 0
+        while i < len(a) and j < len(b):
+            first = max(a[i][0], b[j][0])
+            last = min(a[i][1], b[j][1])
+            if first <= last:
+                result.append((first, last))
+            if a[i][1] < b[j][1]:
+                i += 1
+            else:
+                j += 1
+        return IntervalSet._from_ranges(result)
+
+    def __and__(self, other):
+        return self.intersection(other)
+
+    def difference(self, other):
+        return self.intersection(other.complement())
+
+    def __sub__(self, other):
+        return self.difference(other)
+
+    def symmetric_difference(self, other):
+        return (self - other) | (other - self)
+
+    def __xor__(self, other):
+        return self.symmetric_difference(other)
+
+    def isdisjoint(self, other):
+        return not self.intersection(other)
+
+    def issubset(self, other):
+        return not self.difference(other)
+
+    def __le__(self, other):
+        return self.issubset(other)
+
+
+# The empty set and the set of all code points
+empty = IntervalSet()
+full = IntervalSet._from_ranges(((0, MAX_CODE_POINT),))
+
+
+def minterms(*labellings):
+    """
+        Each argument is a collection of `(IntervalSet, label)` pairs whose sets
+        are pairwise disjoint, e.g. the outgoing transitions of one state of a
+        deterministic symbolic FSM. Split the code points into the coarsest
+        partition such that within each part, every labelling gives every code
+        point the same label (or no label, None). Yield `(part, labels)` pairs
+        where `labels` has one entry per argument. Parts where every label is
+        None are left out.
+
+        This is a single sweep over the range boundaries, so the cost depends
+        on the number of ranges, not on the number of code points.
+    """
+    events = []
+    for n, labelling in enumerate(labellings):
+        for charset, label in labelling:
+            for first, last in charset.ranges:
+                events.append((first, n, label))
+                events.append((last + 1, n, None))
+    events.sort(key=lambda event: (event[0], event[2] is not None))
+
+    parts = {}
+    current = [None] * len(labellings)
+    start = 0
+    i = 0
+    while i < len(events):
+        point = events[i][0]
+        if point > start and any(label is not None for label in current):
+            parts.setdefault(tuple(current), []).append((start, point - 1))
+        # Ends sort before starts at the same point, so that a range ending
+        # here and one starting here don't clobber each other.
+        while i < len(events) and events[i][0] == point:
+            current[events[i][1]] = events[i][2]
+            i += 1
+        start = point
+
+    for labels, ranges in parts.items():
+        yield IntervalSet(ranges), labels
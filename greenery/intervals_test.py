@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+
+if __name__ == "__main__":
+	raise Exception("Test files can't be run directly. Use `python -m pytest greenery`")
+
+from greenery.intervals import IntervalSet, MAX_CODE_POINT, empty, full, minterms
+
+def test_normalisation():
+	assert IntervalSet([(5, 9), (0, 2), (3, 4)]).ranges == ((0, 9),)
+	assert IntervalSet([(0, 5), (2, 3), (7, 7)]).ranges == ((0, 5), (7, 7))
+	assert IntervalSet.from_chars("cabex") == IntervalSet([(97, 99), (101, 101), (120, 120)])
+	assert IntervalSet.from_chars("") == empty
+
+def test_membership():
+	az = IntervalSet([(ord("a"), ord("z"))])
+	assert "a" in az
+	assert "q" in az
+	assert ord("z") in az
+	assert "A" not in az
+	assert "ab" not in az
+	assert len(az) == 26
+	assert "".join(az) == "abcdefghijklmnopqrstuvwxyz"
+
+def test_operations():
+	a = IntervalSet([(0, 10), (20, 30)])
+	b = IntervalSet([(5, 25)])
+	assert (a | b).ranges == ((0, 30),)
+	assert (a & b).ranges == ((5, 10), (20, 25))
+	assert (a - b).ranges == ((0, 4), (26, 30))
+	assert (a ^ b).ranges == ((0, 4), (11, 19), (26, 30))
+	assert (~a).ranges == ((11, 19), (31, MAX_CODE_POINT))
+	assert ~~a == a
+	assert ~empty == full
+	assert a.isdisjoint(IntervalSet([(11, 19)]))
+	assert IntervalSet([(22, 23)]) <= a
+
+def test_minterms():
+	digits = IntervalSet.from_chars("0123456789")
+	word = IntervalSet([(48, 57), (65, 90), (95, 95), (97, 122)])
+	parts = dict((labels, charset) for charset, labels in minterms([(digits, "d")], [(word, "w")]))
+	assert parts == {
+		("d", "w"): digits,
+		(None, "w"): word - digits,
+	}
+
+	# Adjacent ranges with different labels don't interfere
+	parts = dict((labels, charset) for charset, labels in minterms([(IntervalSet([(0, 4)]), 1), (IntervalSet([(5, 9)]), 2)]))
+	assert parts == {(1,): IntervalSet([(0, 4)]), (2,): IntervalSet([(5, 9)])}
@@ -32,7 +32,8 @@
 	pattern, these procedures can drastically simplify a regex structure for
 	readability. They're also pretty extensible.
 '''
-from greenery import fsm
+from greenery import fsm, cfsm
+from greenery.intervals import IntervalSet
 
 
 class nomatch(Exception):
@@ -79,11 +80,24 @@ def parse(string):
     return pattern.parse(string)
 
 
-def from_fsm(f):
+@fsm.traced("from_fsm")
+def from_fsm(f, order="depth"):
     '''
         Turn the supplied finite state machine into a `lego` object. This is
         accomplished using the Brzozowski algebraic method.
+
+        `order` decides which state is eliminated next, which can make a big
+        difference to the size of the intermediate expressions:
+        * "depth": the deepest state first, by breadth-first search from the
+          initial state. Cheap, and fine for small FSMs.
+        * "degree": the state whose elimination creates the fewest new terms,
+          i.e. the lowest (incoming x outgoing) transitions.
+        * "size": the state whose elimination adds the least to the combined
+          length of all the expressions.
     '''
+    if order not in ("depth", "degree", "size"):
+        raise Exception("Unknown elimination order " + repr(order))
+
     # Make sure the supplied alphabet is kosher. It must contain only single-
     # character strings or `fsm.anything_else`.
     for symbol in f.alphabet:
@@ -110,65 +124,130 @@ def from_fsm(f):
     # so that when we perform our back-substitutions, we can start with the
     # last (deepest) state and therefore finish with R_a.
     states = [f.initial]
+    seen = {f.initial}
     i = 0
     while i < len(states):
         current = states[i]
         if current in f.map:
             for symbol in sorted(f.map[current], key=fsm.key):
                 next = f.map[current][symbol]
-                if next not in states:
+                if next not in seen:
                     states.append(next)
+                    seen.add(next)
         i += 1
 
-    # Our system of equations is represented like so:
+    # R_i is nothing for a state i from which no final state can be reached,
+    # so such states are left out altogether.
+    incoming = {state: set() for state in states}
+    for a in states:
+        for b in f.map.get(a, {}).values():
+            incoming[b].add(a)
+    live = set(state for state in states if state in f.finals)
+    queue = list(live)
+    while queue:
+        for a in incoming[queue.pop()]:
+            if a not in live:
+                live.add(a)
+                queue.append(a)
+    if f.initial not in live:
+        return nothing
+
+    # Our system of equations is sparse: brz[a] only has an entry for each
+    # b which actually appears in R_a, and incoming[b] lists those a.
     brz = {}
-    for a in f.states:
-        brz[a] = {}
-        for b in f.states | {outside}:
-            brz[a][b] = nothing
+    incoming = {}
+    for a in states:
+        if a in live:
+            brz[a] = {}
+            incoming[a] = set()
 
     # Populate it with some initial data.
-    for a in f.map:
-        for symbol in f.map[a]:
+    for a in brz:
+        for symbol in f.map.get(a, {}):
             b = f.map[a][symbol]
+            if b not in brz:
+                continue
             if symbol == fsm.anything_else:
-                brz[a][b] |= ~charclass(f.alphabet - {fsm.anything_else})
+                term = ~charclass(f.alphabet - {fsm.anything_else})
             else:
-                brz[a][b] |= charclass({symbol})
+                term = charclass({symbol})
+            brz[a][b] = brz[a][b] | term if b in brz[a] else term
+            incoming[b].add(a)
         if a in f.finals:
-            brz[a][outside] |= emptystring
-
-    # Now perform our back-substitution
-    for i in reversed(range(len(states))):
-        a = states[i]
-
+            brz[a][outside] = emptystring
+
+    sizes = {}
+
+    def size(expr):
+        if expr not in sizes:
+            sizes[expr] = len(str(expr))
+        return sizes[expr]
+
+    def cost(a):
+        ins = incoming[a] - {a}
+        outs = [b for b in brz[a] if b != a]
+        if order == "degree":
+            return len(ins) * len(outs)
+        # The expressions going in and out of `a` get copied once for each
+        # expression on the other side, and the loop once for every pair.
+        loop = size(brz[a][a]) if a in brz[a] else 0
+        return sum(size(brz[b][a]) for b in ins) * (len(outs) - 1) \
+            + sum(size(brz[a][b]) for b in outs) * (len(ins) - 1) \
+            + loop * (len(ins) * len(outs) - 1)
+
+    def eliminate(a):
         # Before the equation for R_a can be substituted into the other
         # equations, we need to resolve the self-transition (if any).
         # e.g.    R_a = 0 R_a |   1 R_b |   2 R_c
         # becomes R_a =         0*1 R_b | 0*2 R_c
-        loop = brz[a][a] * star  # i.e. "0*"
-        del brz[a][a]
-
-        for right in brz[a]:
-            brz[a][right] = loop + brz[a][right]
-
-        # Note: even if we're down to our final equation, the above step still
-        # needs to be performed before anything is returned.
-
-        # Now we can substitute this equation into all of the previous ones.
-        for j in range(i):
-            b = states[j]
+        if a in brz[a]:
+            loop = brz[a].pop(a) * star  # i.e. "0*"
+            incoming[a].discard(a)
+            for right in brz[a]:
+                brz[a][right] = (loop + brz[a][right]).reduce()
 
+        # Now we can substitute this equation into all of the others which
+        # mention R_a.
+        for b in incoming.pop(a):
             # e.g. substituting R_a =  0*1 R_b |      0*2 R_c
             # into              R_b =    3 R_a |        4 R_c | 5 R_d
             # yields            R_b = 30*1 R_b | (30*2|4) R_c | 5 R_d
-            univ = brz[b][a]  # i.e. "3"
-            del brz[b][a]
-
+            univ = brz[b].pop(a)  # i.e. "3"
             for right in brz[a]:
-                brz[b][right] |= univ + brz[a][right]
+                term = univ + brz[a][right]
+                if right in brz[b]:
+                    term = brz[b][right] | term
+                brz[b][right] = term.reduce()
+                if right is not outside:
+                    incoming[right].add(b)
 
-    return brz[f.initial][outside].reduce()
+        for right in brz[a]:
+            if right is not outside:
+                incoming[right].discard(a)
+        del brz[a]
+
+    if order == "depth":
+        for a in reversed(states[1:]):
+            if a in brz:
+                eliminate(a)
+    else:
+        remaining = [a for a in states[1:] if a in brz]
+        while remaining:
+            # Ties go to the deepest state
+            i = min(reversed(range(len(remaining))), key=lambda i: cost(remaining[i]))
+            eliminate(remaining.pop(i))
+
+    # Note: even if we're down to our final equation, the self-transition
+    # still needs to be resolved before anything is returned.
+    result = brz[f.initial].get(outside, nothing)
+    if f.initial in brz[f.initial]:
+        loop = brz[f.initial].pop(f.initial) * star
+        result = loop + result
+
+    # Having reduced every expression as it was built, the empty string can be
+    # left as an option of the result, as in "|abc". Inside a conc, reduce()
+    # folds it into a multiplier, giving "(abc)?".
+    return (emptystring + result).reduce()
 
 
 def static(string, i, static):
@@ -223,6 +302,25 @@ class lego:
         '''
         raise NotImplementedError(f"Not implemented by {type(self)}")
 
+    def to_cfsm(self, alphabet=None, threshold=cfsm.COUNTING_THRESHOLD):
+        '''
+            Return the present lego piece in the form of a counting finite state
+            machine, as imported from the cfsm module. Repetitions with a bound
+            above `threshold` become counters instead of being expanded into
+            states; anything without such a repetition goes through to_fsm() as
+            usual. Call `to_fsm()` on the result to get a classic FSM back.
+        '''
+        if alphabet is None:
+            alphabet = self.alphabet()
+        return cfsm.CFSM.from_fsm(self.to_fsm(alphabet))
+
+    def counted(self, threshold=cfsm.COUNTING_THRESHOLD):
+        '''
+            Return True if the present lego piece contains a repetition with a
+            bound above `threshold`, which to_cfsm() would turn into a counter.
+        '''
+        return False
+
     def __repr__(self):
         '''
             Return a string approximating the instantiation line
@@ -477,31 +575,47 @@ class lego:
 
 class charclass(lego):
     '''
-        A charclass is basically a frozenset of symbols. The reason for the
-        charclass object instead of using frozenset directly is to allow us to
+        A charclass is basically a set of characters. The reason for the
+        charclass object instead of using a set directly is to allow us to
         set a "negated" flag. A charclass with the negation flag set is assumed
         to contain every symbol that is in the alphabet of all symbols but not
-        explicitly listed inside the frozenset. e.g. [^a]. This is very handy
+        explicitly listed inside the set. e.g. [^a]. This is very handy
         if the full alphabet is extremely large, but also requires dedicated
         combination functions.
+
+        The characters are stored as an `intervals.IntervalSet`, i.e. a sorted
+        tuple of code point ranges, so "[\x00-\uffff]" is one range rather
+        than 65536 characters and set operations are linear in the number of
+        ranges. `chars` is still available as a frozenset, built on demand.
     '''
 
     def __init__(self, chars=set(), negateMe=False):
-        chars = frozenset(chars)
-        # chars should consist only of chars
-        if fsm.anything_else in chars:
-            raise Exception("Can't put " + repr(fsm.anything_else) + " in a charclass")
-        self.__dict__["chars"] = chars
+        if not isinstance(chars, IntervalSet):
+            chars = frozenset(chars)
+            # chars should consist only of chars
+            if fsm.anything_else in chars:
+                raise Exception("Can't put " + repr(fsm.anything_else) + " in a charclass")
+            for char in chars:
+                if not (isinstance(char, str) and len(char) == 1):
+                    raise Exception("Symbol " + repr(char) + " is not a character")
+            chars = IntervalSet.from_chars(chars)
+        self.__dict__["ranges"] = chars
         self.__dict__["negated"] = negateMe
 
+    @property
+    def chars(self):
+        if "_chars" not in self.__dict__:
+            self.__dict__["_chars"] = frozenset(self.ranges.chars())
+        return self.__dict__["_chars"]
+
     def __eq__(self, other):
         try:
-            return self.chars == other.chars and self.negated == other.negated
+            return self.ranges == other.ranges and self.negated == other.negated
         except AttributeError:
             return False
 
     def __hash__(self):
-        return hash((self.chars, self.negated))
+        return hash((self.ranges, self.negated))
 
     def times(self, multiplier):
         # e.g. "a" * {0,1} = "a?"
@@ -541,9 +655,8 @@ class charclass(lego):
             return "[^" + self.escape() + "]"
 
         # single character, not contained inside square brackets.
-        if len(self.chars) == 1:
-            # Python lacks the Axiom of Choice
-            char = "".join(self.chars)
+        if len(self.ranges) == 1:
+            char = chr(self.ranges.ranges[0][0])
 
             # e.g. if char is "\t", return "\\t"
             if char in escapes.keys():
@@ -579,44 +692,23 @@ class charclass(lego):
 
             return char
 
-        def recordRange():
+        def recordRange(first, last):
+            # "a-b" or "a-c" or "a-d"
+            span = escapeChar(chr(first)) + "-" + escapeChar(chr(last))
+            # An escaped character is at most 4 long, so a range of more than
+            # 9 characters can't be written any shorter one by one.
+            if last - first >= len(span):
+                return span
             # there's no point in putting a range when the whole thing is
             # 3 characters or fewer. "abc" -> "abc" but "abcd" -> "a-d"
             strs = [
                 # "ab" or "abc" or "abcd"
-                "".join(escapeChar(char) for char in currentRange),
-                # "a-b" or "a-c" or "a-d"
-                escapeChar(currentRange[0]) + "-" + escapeChar(currentRange[-1]),
+                "".join(escapeChar(chr(i)) for i in range(first, last + 1)),
+                span,
             ]
             return sorted(strs, key=lambda str: len(str))[0]
 
-        output = ""
-
-        # use shorthand for known character ranges
-        # note the nested processing order. DO NOT process \d before processing
-        # \w. if more character class constants arise which do not nest nicely,
-        # a problem will arise because there is no clear ordering to use...
-
-        # look for ranges
-        currentRange = ""
-        for char in sorted(self.chars, key=ord):
-
-            # range is not empty: new char must fit after previous one
-            if len(currentRange) > 0:
-
-                i = ord(char)
-
-                # char doesn't fit old range: restart
-                if i != ord(currentRange[-1]) + 1:
-                    output += recordRange()
-                    currentRange = ""
-
-            currentRange += char
-
-        if len(currentRange) > 0:
-            output += recordRange()
-
-        return output
+        return "".join(recordRange(first, last) for first, last in self.ranges.ranges)
 
     def to_fsm(self, alphabet=None):
         if alphabet is None:
@@ -627,13 +719,25 @@ class charclass(lego):
         # If negated, make a singular FSM accepting any other characters
         if self.negated:
             map = {
-                0: dict([(symbol, 1) for symbol in alphabet - self.chars]),
+                0: dict([
+                    (symbol, 1) for symbol in alphabet
+                    if symbol is fsm.anything_else or symbol not in self.ranges
+                ]),
             }
 
-        # If normal, make a singular FSM accepting only these characters
+        # If normal, make a singular FSM accepting only these characters. A
+        # small class is walked range by range, a big one is filtered through
+        # the alphabet instead.
+        elif len(self.ranges) <= len(alphabet):
+            map = {
+                0: dict([(symbol, 1) for symbol in self.ranges.chars()]),
+            }
         else:
             map = {
-                0: dict([(symbol, 1) for symbol in self.chars]),
+                0: dict([
+                    (symbol, 1) for symbol in alphabet
+                    if symbol is not fsm.anything_else and symbol in self.ranges
+                ]),
             }
 
         return fsm.FSM(
@@ -649,8 +753,8 @@ class charclass(lego):
         if self.negated is True:
             string += "~"
         string += "charclass("
-        if len(self.chars) > 0:
-            string += repr("".join(str(char) for char in sorted(self.chars, key=str)))
+        if self.ranges:
+            string += repr("".join(self.ranges.chars()))
         string += ")"
         return string
 
@@ -663,10 +767,10 @@ class charclass(lego):
         return mult(self, one) + other
 
     def alphabet(self):
-        return {fsm.anything_else} | self.chars
+        return {fsm.anything_else} | set(self.ranges.chars())
 
     def empty(self):
-        return len(self.chars) == 0 and self.negated == False
+        return not self.ranges and self.negated == False
 
     @classmethod
     def match(cls, string, i=0):
@@ -735,7 +839,7 @@ class charclass(lego):
             # Attempt 1: shorthand e.g. "\w"
             for key in charclass.shorthand:
                 try:
-                    return key, static(string, i, charclass.shorthand[key])
+                    return IntervalSet.from_chars(key), static(string, i, charclass.shorthand[key])
                 except nomatch:
                     pass
 
@@ -752,22 +856,20 @@ class charclass(lego):
                 if firstIndex >= lastIndex:
                     raise nomatch("Range '" + first + "' to '" + last + "' not allowed")
 
-                chars = "".join([
-                    chr(i) for i in range(firstIndex, lastIndex + 1)
-                ])
-                return chars, k
+                return IntervalSet([(firstIndex, lastIndex)]), k
             except nomatch:
                 pass
 
             # Attempt 3: just a character on its own
-            return matchInternalChar(string, i)
+            char, j = matchInternalChar(string, i)
+            return IntervalSet.from_chars(char), j
 
         def matchClassInterior(string, i):
-            internals = ""
+            internals = IntervalSet()
             try:
                 while True:
                     internal, i = matchClassInterior1(string, i)
-                    internals += internal
+                    internals |= internal
             except nomatch:
                 pass
             return internals, i
@@ -838,7 +940,7 @@ class charclass(lego):
             Negate the current charclass. e.g. [ab] becomes [^ab]. Call
             using "charclass2 = ~charclass1"
         '''
-        return charclass(self.chars, negateMe=not self.negated)
+        return charclass(self.ranges, negateMe=not self.negated)
 
     def __invert__(self):
         return self.negate()
@@ -851,11 +953,11 @@ class charclass(lego):
             # A OR B
             if self.negated:
                 if other.negated:
-                    return ~charclass(self.chars & other.chars)
-                return ~charclass(self.chars - other.chars)
+                    return ~charclass(self.ranges & other.ranges)
+                return ~charclass(self.ranges - other.ranges)
             if other.negated:
-                return ~charclass(other.chars - self.chars)
-            return charclass(self.chars | other.chars)
+                return ~charclass(other.ranges - self.ranges)
+            return charclass(self.ranges | other.ranges)
 
         # "other" lacks attribute "negated" or "chars"
         # "other" is not a charclass
@@ -871,11 +973,11 @@ class charclass(lego):
             # A AND B
             if self.negated:
                 if other.negated:
-                    return ~charclass(self.chars | other.chars)
-                return charclass(other.chars - self.chars)
+                    return ~charclass(self.ranges | other.ranges)
+                return charclass(other.ranges - self.ranges)
             if other.negated:
-                return charclass(self.chars - other.chars)
-            return charclass(self.chars & other.chars)
+                return charclass(self.ranges - other.ranges)
+            return charclass(self.ranges & other.ranges)
 
         # "other" lacks attribute "negated" or "chars"
         # "other" is not a charclass
@@ -887,7 +989,7 @@ class charclass(lego):
         return self
 
     def copy(self):
-        return charclass(self.chars.copy(), negateMe=self.negated)
+        return charclass(self.ranges, negateMe=self.negated)
 
 
 class bound:
@@ -1378,6 +1480,19 @@ class mult(lego):
 
         return mandatory + optional
 
+    def counted(self, threshold=cfsm.COUNTING_THRESHOLD):
+        return self.multiplier.min.v > threshold \
+               or (self.multiplier.max != inf and self.multiplier.max.v > threshold) \
+               or self.multiplicand.counted(threshold)
+
+    def to_cfsm(self, alphabet=None, threshold=cfsm.COUNTING_THRESHOLD):
+        if alphabet is None:
+            alphabet = self.alphabet()
+        if not self.counted(threshold):
+            return lego.to_cfsm(self, alphabet)
+        unit = self.multiplicand.to_cfsm(alphabet, threshold)
+        return unit.times(self.multiplier.min.v, self.multiplier.max.v)
+
     @classmethod
     def match(cls, string, i=0):
 
@@ -1538,6 +1653,16 @@ class conc(lego):
             fsm1 += m.to_fsm(alphabet)
         return fsm1
 
+    def counted(self, threshold=cfsm.COUNTING_THRESHOLD):
+        return any(m.counted(threshold) for m in self.mults)
+
+    def to_cfsm(self, alphabet=None, threshold=cfsm.COUNTING_THRESHOLD):
+        if alphabet is None:
+            alphabet = self.alphabet()
+        if not self.counted(threshold):
+            return lego.to_cfsm(self, alphabet)
+        return cfsm.CFSM.concatenate(*[m.to_cfsm(alphabet, threshold) for m in self.mults])
+
     def alphabet(self):
         return {fsm.anything_else}.union(*[m.alphabet() for m in self.mults])
 
@@ -1911,6 +2036,16 @@ class pattern(lego):
             fsm1 |= c.to_fsm(alphabet)
         return fsm1
 
+    def counted(self, threshold=cfsm.COUNTING_THRESHOLD):
+        return any(c.counted(threshold) for c in self.concs)
+
+    def to_cfsm(self, alphabet=None, threshold=cfsm.COUNTING_THRESHOLD):
+        if alphabet is None:
+            alphabet = self.alphabet()
+        if not self.counted(threshold):
+            return lego.to_cfsm(self, alphabet)
+        return cfsm.CFSM.union(*[c.to_cfsm(alphabet, threshold) for c in self.concs])
+
     def reversed(self):
         return pattern(*(reversed(c) for c in self.concs))
 
@@ -3,6 +3,7 @@
 if __name__ == "__main__":
 	raise Exception("Test files can't be run directly. Use `python -m pytest greenery`")
 
+import pytest
 from greenery.lego import conc, mult, charclass, one, emptystring, star, plus, nothing, pattern, qm, d, multiplier, bound, w, s, W, D, S, dot, nomatch, inf, zero, parse, from_fsm
 from greenery import fsm
 
@@ -76,6 +77,17 @@ def test_charclass_ranges():
 	assert parse("[z{|}~]") == parse("[z-~]")
 	assert parse("[\w:;<=>?@\\[\\\\\]\\^`]") == parse("[0-z]")
 
+def test_charclass_large_ranges():
+	# Stored as code point ranges, not one character at a time
+	everything = charclass.parse("[\x00-\uffff]")
+	assert everything.ranges.ranges == ((0, 0xffff),)
+	assert str(everything) == "[\\x00-\uffff]"
+	assert str(everything & ~charclass("b")) == "[\\x00-a" + "c-\uffff]"
+	assert str(charclass("abcd") | charclass("fg")) == "[a-dfg]"
+	assert (everything | charclass("\U00010000")).ranges.ranges == ((0, 0x10000),)
+	assert everything.to_fsm({"a", "\U00010000", fsm.anything_else}).accepts("a")
+	assert not everything.to_fsm({"a", "\U00010000", fsm.anything_else}).accepts("\U00010000")
+
 def test_hex_escapes():
 	# Should be able to parse e.g. "\\x40"
 	assert parse("\\x00") == parse("\x00")
@@ -698,6 +710,28 @@ def test_base_N():
 		assert int(a, base) + N == int(b, base)
 		a = b
 
+def test_from_fsm_orders():
+	for regex in ["(ab|c)*d", "(0|1(01*0)*1)*", "(a|b)*a(a|b){2}", "x[^y]?|[yz]*"]:
+		f = parse(regex).to_fsm()
+		for order in ["depth", "degree", "size"]:
+			assert from_fsm(f, order=order).to_fsm().equivalent(f)
+	with pytest.raises(Exception, match="Unknown elimination order"):
+		from_fsm(parse("a").to_fsm(), order="random")
+
+def test_from_fsm_optional():
+	# Every expression is reduced as soon as it's built, but an empty option
+	# left over at the top still gets folded into a "?"
+	assert str(from_fsm(parse("abc|").to_fsm())) == "(abc)?"
+	assert str(from_fsm(parse("a|").to_fsm())) == "a?"
+	assert str(from_fsm(parse("").to_fsm())) == ""
+	assert str(parse("[bc]*[ab]*") & parse("[ab]*[bc]*")) == "(b*a(b*a)*b*|b+(c(b*c)*b*)?|c(b*c)*b*)?"
+	assert str(parse(".*") & parse("[ab]*a?b*|[ab]*b?a*")) == "b*(a(b*a)*b*)?"
+
+def test_from_fsm_dead_states():
+	# States from which no final state is reachable are dropped
+	assert str(from_fsm(parse("a(bc|d[^\\n]*x)").to_fsm() - parse("ad.*").to_fsm())) == "abc"
+	assert from_fsm(parse("a").to_fsm() & parse("b").to_fsm()) == nothing
+
 def test_bad_alphabet():
 	# You can use anything you like in your FSM alphabet, but if you try to
 	# convert it to a `lego` object then the only acceptable symbols are single
@@ -0,0 +1,324 @@
+# -*- coding: utf-8 -*-
+
+"""
+	Symbolic finite state machines: deterministic FSMs whose transitions are
+	labelled with sets of code points rather than with individual symbols.
+"""
+from greenery.fsm import FSM, anything_else, traced
+from greenery.intervals import IntervalSet, empty, full, minterms
+
+
+class SFSM:
+    """
+        A symbolic FSM works just like an `fsm.FSM`, except that its alphabet
+        is the whole of Unicode and `map[state]` is a tuple of
+        `(IntervalSet, next)` pairs rather than a dict of symbols. The sets
+        leaving any one state are disjoint, which keeps the machine
+        deterministic. As with `FSM`, `map` may be sparse: code points not
+        covered by any transition lead to a non-final "oblivion" state.
+
+        Products are crawled one minterm at a time (see
+        `intervals.minterms()`), so their cost depends on the number of
+        distinct ranges in play, not on the number of characters. `\\w` over
+        Unicode costs as much as `[a-z]`.
+    """
+
+    def __init__(self, states, initial, finals, map):
+        self.states = set(states)
+        self.initial = initial
+        self.finals = set(finals)
+        self.map = map
+
+    @classmethod
+    def from_fsm(cls, f):
+        """
+            Convert a classic FSM whose symbols are one-character strings or
+            `fsm.anything_else`. `anything_else` stands for every code point
+            not in the FSM's alphabet.
+        """
+        chars = set()
+        for symbol in f.alphabet:
+            if symbol is anything_else:
+                continue
+            if not (isinstance(symbol, str) and len(symbol) == 1):
+                raise Exception("Symbol " + repr(symbol) + " is not a character")
+            chars.add(symbol)
+        others = IntervalSet.from_chars(chars).complement()
+
+        map = {}
+        for state, transitions in f.map.items():
+            targets = {}
+            for symbol, next in transitions.items():
+                targets.setdefault(next, []).append(symbol)
+            map[state] = tuple(
+                (
+                    IntervalSet.from_chars(s for s in symbols if s is not anything_else)
+                    | (others if anything_else in symbols else empty),
+                    next,
+                )
+                for next, symbols in targets.items()
+            )
+        return cls(f.states, f.initial, f.finals, map)
+
+    def to_fsm(self, alphabet=None):
+        """
+            Convert back to a classic FSM. Since an `FSM` needs a finite alphabet,
+            the code points are split into the parts where all transitions agree,
+            and the largest of these becomes `fsm.anything_else`; the others are
+            listed character by character. Alternatively supply an `alphabet` of
+            your own, in which case every code point outside it must behave the
+            same way as `anything_else`.
+        """
+        if alphabet is None:
+            parts = [charset for charset, labels in minterms(*self.map.values())]
+            rest = full
+            for charset in parts:
+                rest -= charset
+            if rest:
+                parts.append(rest)
+            largest = max(parts, key=len)
+            alphabet = {anything_else}
+            for charset in parts:
+                if charset is not largest:
+                    alphabet.update(charset.chars())
+
+        chars = IntervalSet.from_chars(symbol for symbol in alphabet if symbol is not anything_else)
+        others = chars.complement()
+        map = {}
+        for state, transitions in self.map.items():
+            map[state] = {}
+            for charset, next in transitions:
+                for char in (charset & chars).chars():
+                    map[state][char] = next
+                if anything_else in alphabet and others and others <= charset:
+                    map[state][anything_else] = next
+        return FSM(
+            alphabet=alphabet,
+            states=self.states,
+            initial=self.initial,
+            finals=self.finals,
+            map=map,
+        )
+
+    def __repr__(self):
+        string = "SFSM("
+        string += "states = " + repr(self.states)
+        string += ", initial = " + repr(self.initial)
+        string += ", finals = " + repr(self.finals)
+        string += ", map = " + repr(self.map)
+        string += ")"
+        return string
+
+    def _next(self, state, char):
+        for charset, next in self.map.get(state, ()):
+            if char in charset:
+                return next
+        return None
+
+    def accepts(self, input):
+        """
+            Test whether the present SFSM accepts the supplied string (iterable
+            of characters).
+        """
+        state = self.initial
+        for char in input:
+            state = self._next(state, char)
+            if state is None:
+                return False
+        return state in self.finals
+
+    def __contains__(self, string):
+        return self.accepts(string)
+
+    def islive(self, state):
+        """A state is "live" if a final state can be reached from it."""
+        seen = {state}
+        reachable = [state]
+        i = 0
+        while i < len(reachable):
+            current = reachable[i]
+            if current in self.finals:
+                return True
+            for charset, next in self.map.get(current, ()):
+                if next not in seen and charset:
+                    reachable.append(next)
+                    seen.add(next)
+            i += 1
+        return False
+
+    def empty(self):
+        """An SFSM is empty if it recognises no strings."""
+        return not self.islive(self.initial)
+
+    @traced("sfsm.everythingbut")
+    def everythingbut(self):
+        """
+            Return an SFSM which will accept any string NOT accepted by self.
+            The oblivion state has to be reified for this.
+        """
+        dead = object()
+
+        def follow(state):
+            if state is dead:
+                return ((full, dead),)
+            transitions = self.map.get(state, ())
+            covered = empty
+            for charset, next in transitions:
+                covered |= charset
+            if covered == full:
+                return transitions
+            return transitions + ((covered.complement(), dead),)
+
+        def final(state):
+            return state is dead or state not in self.finals
+
+        return crawl(self.initial, final, follow)
+
+    @traced("sfsm.reduce")
+    def reduce(self):
+        """
+            Return an equivalent SFSM with a minimal number of states, by
+            partition refinement: states are split apart until all states in a
+            block have the same finality and send the same characters to the
+            same blocks. Dead states are dropped altogether.
+        """
+        incoming = {}
+        for state, transitions in self.map.items():
+            for charset, next in transitions:
+                if charset:
+                    incoming.setdefault(next, set()).add(state)
+        live = set(self.finals)
+        queue = list(self.finals)
+        while queue:
+            for prev in incoming.get(queue.pop(), ()):
+                if prev not in live:
+                    live.add(prev)
+                    queue.append(prev)
+        if self.initial not in live:
+            return SFSM({0}, 0, set(), {})
+
+        def transitions(state, blocks):
+            targets = {}
+            for charset, next in self.map.get(state, ()):
+                if next in live:
+                    block = blocks[next]
+                    targets[block] = targets.get(block, empty) | charset
+            return tuple((charset, block) for block, charset in sorted(targets.items()))
+
+        blocks = {state: int(state in self.finals) for state in live}
+        count = len(set(blocks.values()))
+        while True:
+            signatures = {state: (blocks[state], transitions(state, blocks)) for state in live}
+            numbers = {}
+            for state in sorted(live, key=lambda state: state != self.initial):
+                numbers.setdefault(signatures[state], len(numbers))
+            blocks = {state: numbers[signatures[state]] for state in live}
+            if len(numbers) == count:
+                break
+            count = len(numbers)
+
+        map = {}
+        finals = set()
+        for state in live:
+            block = blocks[state]
+            if state in self.finals:
+                finals.add(block)
+            if block not in map:
+                map[block] = transitions(state, blocks)
+        return SFSM(range(count), blocks[self.initial], finals, map)
+
+    def equivalent(self, other):
+        """Two SFSMs are equivalent if they recognise the same strings."""
+        return (self ^ other).empty()
+
+    def __eq__(self, other):
+        return self.equivalent(other)
+
+    def __ne__(self, other):
+        return not self.equivalent(other)
+
+    def union(*sfsms):
+        return parallel(sfsms, any)
+
+    def __or__(self, other):
+        return self.union(other)
+
+    def intersection(*sfsms):
+        return parallel(sfsms, all)
+
+    def __and__(self, other):
+        return self.intersection(other)
+
+    def difference(*sfsms):
+        return parallel(sfsms, lambda accepts: accepts[0] and not any(accepts[1:]))
+
+    def __sub__(self, other):
+        return self.difference(other)
+
+    def symmetric_difference(*sfsms):
+        return parallel(sfsms, lambda accepts: (accepts.count(True) % 2) == 1)
+
+    def __xor__(self, other):
+        return self.symmetric_difference(other)
+
+    def isdisjoint(self, other):
+        return (self & other).empty()
+
+    def issubset(self, other):
+        return (self - other).empty()
+
+    def __le__(self, other):
+        return self.issubset(other)
+
+
+@traced("sfsm.parallel")
+def parallel(sfsms, test):
+    """
+        Crawl several SFSMs in parallel, like `fsm.parallel()`. The outgoing
+        transitions of a product state are the minterms of the transitions of
+        its component states.
+    """
+    initial = tuple(s.initial for s in sfsms)
+
+    def follow(state):
+        labellings = [
+            sfsm.map.get(substate, ()) if substate is not None else ()
+            for sfsm, substate in zip(sfsms, state)
+        ]
+        return tuple(minterms(*labellings))
+
+    def final(state):
+        return test([
+            substate is not None and substate in sfsm.finals
+            for sfsm, substate in zip(sfsms, state)
+        ])
+
+    return crawl(initial, final, follow)
+
+
+def crawl(initial, final, follow):
+    """
+        Symbolic version of `fsm.crawl()`. `follow(state)` returns the
+        `(IntervalSet, next)` pairs leaving a (meta)state, where the sets are
+        disjoint and every `next` is hashable.
+    """
+    states = [initial]
+    indices = {initial: 0}
+    finals = set()
+    map = {}
+
+    i = 0
+    while i < len(states):
+        state = states[i]
+        if final(state):
+            finals.add(i)
+        transitions = []
+        for charset, next in follow(state):
+            if next not in indices:
+                indices[next] = len(states)
+                states.append(next)
+            transitions.append((charset, indices[next]))
+        map[i] = tuple(transitions)
+        i += 1
+
+    return SFSM(range(len(states)), 0, finals, map)
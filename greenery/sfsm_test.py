@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+
+if __name__ == "__main__":
+	raise Exception("Test files can't be run directly. Use `python -m pytest greenery`")
+
+import itertools
+
+from greenery.intervals import IntervalSet, full
+from greenery.lego import parse
+from greenery.sfsm import SFSM
+
+strings = ["".join(s) for n in range(4) for s in itertools.product("abcé", repeat=n)]
+regexes = ["a*b", "[^a]*", "(ab|c)*", "[^b]c?", "a|[^a]{2}", ""]
+
+def symbolic(regex):
+	return SFSM.from_fsm(parse(regex).to_fsm())
+
+def test_round_trip():
+	for regex in regexes:
+		f = parse(regex).to_fsm()
+		s = symbolic(regex)
+		for string in strings:
+			assert s.accepts(string) == f.accepts(string)
+			assert s.reduce().accepts(string) == f.accepts(string)
+			assert s.everythingbut().accepts(string) != f.accepts(string)
+		assert s.to_fsm().equivalent(f)
+
+def test_boolean_operations():
+	for r1, r2 in itertools.product(regexes, repeat=2):
+		f1, f2 = parse(r1).to_fsm(), parse(r2).to_fsm()
+		s1, s2 = symbolic(r1), symbolic(r2)
+		for string in strings:
+			assert (s1 & s2).accepts(string) == (f1 & f2).accepts(string)
+			assert (s1 | s2).accepts(string) == (f1 | f2).accepts(string)
+			assert (s1 - s2).accepts(string) == (f1 - f2).accepts(string)
+			assert (s1 ^ s2).accepts(string) == (f1 ^ f2).accepts(string)
+		assert (s1 == s2) == (f1 == f2)
+
+def test_unicode_classes():
+	# \w+ and \d+, over a lot more than ASCII
+	letters = IntervalSet([(0x41, 0x5a), (0x61, 0x7a), (0xc0, 0x2fff)])
+	digits = IntervalSet([(0x30, 0x39), (0x660, 0x669)])
+	w = SFSM({0, 1}, 0, {1}, {0: ((letters | digits, 1),), 1: ((letters | digits, 1),)})
+	d = SFSM({0, 1}, 0, {1}, {0: ((digits, 1),), 1: ((digits, 1),)})
+	assert d <= w
+	assert not w <= d
+	assert (w & d).reduce().accepts("١٢")
+	assert len((w | d).reduce().states) == 2
+	assert (w - d).accepts("ab١")
+	assert not (w - d).accepts("12")
+	assert len(w.everythingbut().reduce().states) == 3
+	assert SFSM({0}, 0, {0}, {0: ((full, 0),)}).everythingbut().empty()
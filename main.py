@@ -1,27 +1,248 @@
+import argparse
+import json
 import sys
-from greenery.lego import lego, parse
+from concurrent.futures import ProcessPoolExecutor
+from itertools import combinations
+from time import perf_counter
+
+from greenery.lego import lego, parse, from_fsm
 from greenery.fsm import FSM
 
-regexes = list(sys.argv[1:])
-
-if len(regexes) == 0:
-    from ast import literal_eval
-    while True:
-        reg = input("regex|")
-        if not reg:
-            break
-        if reg[0] in '\'"' or reg[:2] in ('r"',"r'"):
-            reg = literal_eval(reg)
-        regexes.append(reg)
-
-if len(regexes) < 2:
-    print("Please supply several regexes to compute their intersection, union and concatenation.")
-    print("E.g. \"19.*\" \"\\d{4}-\\d{2}-\\d{2}\"")
-
-else:
-    regexes = [parse(regex) for regex in regexes]
-    fsms = [regex.to_fsm() for regex in regexes]
-    print(f"Have Intersection: {not FSM.intersection(*fsms).empty()}")
-    print("Intersection:  %s" % (lego.intersection(*regexes).reduce()))
-    print("Union:         %s" % (lego.union(*regexes).reduce()))
-    print("Concatenation: %s" % (lego.concatenate(*regexes).reduce()))
+OPERATIONS = ("intersection", "disjoint", "subset", "equivalent", "cardinality")
+
+
+def interactive(regexes):
+    if len(regexes) == 0:
+        from ast import literal_eval
+        while True:
+            reg = input("regex|")
+            if not reg:
+                break
+            if reg[0] in '\'"' or reg[:2] in ('r"', "r'"):
+                reg = literal_eval(reg)
+            regexes.append(reg)
+
+    if len(regexes) < 2:
+        print("Please supply several regexes to compute their intersection, union and concatenation.")
+        print("E.g. \"19.*\" \"\\d{4}-\\d{2}-\\d{2}\"")
+
+    else:
+        regexes = [parse(regex) for regex in regexes]
+        fsms = [regex.to_fsm() for regex in regexes]
+        print(f"Have Intersection: {not FSM.intersection(*fsms).empty()}")
+        print("Intersection:  %s" % (lego.intersection(*regexes).reduce()))
+        print("Union:         %s" % (lego.union(*regexes).reduce()))
+        print("Concatenation: %s" % (lego.concatenate(*regexes).reduce()))
+
+
+def read_items(file, jsonl=False):
+    """
+        Yields `(id, regex)` pairs from a file with one regex per line, taken
+        as is. With `jsonl`, every line is JSON instead: either a string, or an
+        object with a "regex" and optionally an "id". Blank lines are skipped.
+        Ids default to the line number. A JSON line which isn't one of those
+        yields `(number, error)` instead, with the exception in place of the
+        regex, so that one bad line doesn't abort the rest.
+    """
+    for number, line in enumerate(file, 1):
+        line = line.rstrip("\r\n")
+        if not line.strip():
+            continue
+        if not jsonl:
+            yield number, line
+            continue
+        try:
+            item = json.loads(line)
+        except ValueError as e:
+            yield number, e
+            continue
+        if isinstance(item, str):
+            yield number, item
+        elif isinstance(item, dict) and isinstance(item.get("regex"), str):
+            yield item.get("id", number), item["regex"]
+        else:
+            yield number, ValueError("Expected a string or an object with a \"regex\" string")
+
+
+def compile_all(regexes):
+    """
+        Compiles every regex over one shared alphabet. Returns an `(fsm,
+        seconds)` pair per regex, or `(None, error)` for those which can't be
+        compiled. A regex may already be an exception, from `read_items()`.
+    """
+    parsed = []
+    for regex in regexes:
+        if isinstance(regex, Exception):
+            parsed.append(regex)
+            continue
+        try:
+            parsed.append(parse(regex))
+        except Exception as e:
+            parsed.append(e)
+    alphabet = set().union(*(p.alphabet() for p in parsed if not isinstance(p, Exception)))
+    compiled = []
+    for p in parsed:
+        if isinstance(p, Exception):
+            compiled.append((None, f"{type(p).__name__}: {p}"))
+            continue
+        start = perf_counter()
+        try:
+            f = p.to_fsm(alphabet).reduce()
+        except Exception as e:
+            compiled.append((None, f"{type(e).__name__}: {e}"))
+            continue
+        compiled.append((f, perf_counter() - start))
+    return compiled
+
+
+# The FSMs compiled by `compile_all()`, which jobs refer to by index. Workers
+# get them from the parent process.
+_fsms = None
+
+
+def _init(fsms):
+    global _fsms
+    _fsms = fsms
+
+
+def _run(job):
+    op, indices = job
+    start = perf_counter()
+    # Compiling happened in `compile_all()`, this just reports on it
+    if op == "compile":
+        (i,) = indices
+        f, seconds = _fsms[i]
+        if f is None:
+            return {"error": seconds}
+        return {"states": len(f.states), "seconds": seconds}
+    if op == "cardinality":
+        (i,) = indices
+        f = _fsms[i][0]
+        try:
+            result = f.cardinality()
+        except OverflowError:
+            result = "infinite"
+        return {"result": result, "states": len(f.states), "seconds": perf_counter() - start}
+
+    a, b = (_fsms[i][0] for i in indices)
+    if op == "intersection":
+        product = (a & b).reduce()
+        result = None if product.empty() else str(from_fsm(product, order="size"))
+    elif op == "disjoint":
+        product = a & b
+        result = product.empty()
+    elif op == "subset":
+        product = a - b
+        result = {"a<=b": product.empty(), "b<=a": (b - a).empty()}
+    elif op == "equivalent":
+        product = a ^ b
+        result = product.empty()
+    else:
+        raise Exception("Unknown operation " + repr(op))
+    return {"result": result, "states": len(product.states), "seconds": perf_counter() - start}
+
+
+def batch(file, operations, output, workers=None, jsonl=False):
+    """
+        Compile every regex in `file` (see `read_items()`), then write one JSON
+        line per regex and operation to `output`: first a "compile" record for
+        each regex, then "cardinality" for each regex and the pairwise
+        operations for each pair of regexes, if requested. Every record has the
+        number of states involved and the seconds it took. A regex which can't
+        be compiled gets a compile record with an "error" instead, and no other
+        records; so does a JSON line which can't be read, without a "regex". The order of the output does not depend on `workers`.
+    """
+    items = list(read_items(file, jsonl))
+    ids = [id for id, regex in items]
+    regexes = [regex for id, regex in items]
+    fsms = compile_all(regexes)
+    ok = [i for i, (f, _) in enumerate(fsms) if f is not None]
+
+    jobs = [("compile", (i,)) for i in range(len(items))]
+    if "cardinality" in operations:
+        jobs.extend(("cardinality", (i,)) for i in ok)
+    for op in OPERATIONS:
+        if op in operations and op != "cardinality":
+            jobs.extend((op, pair) for pair in combinations(ok, 2))
+
+    if workers is None or workers <= 1:
+        _init(fsms)
+        results = map(_run, jobs)
+        executor = None
+    else:
+        executor = ProcessPoolExecutor(workers, initializer=_init, initargs=(fsms,))
+        results = executor.map(_run, jobs, chunksize=max(1, len(jobs) // (workers * 4)))
+
+    try:
+        for (op, indices), record in zip(jobs, results):
+            if len(indices) == 1:
+                line = {"op": op, "id": ids[indices[0]]}
+                if not isinstance(regexes[indices[0]], Exception):
+                    line["regex"] = regexes[indices[0]]
+            else:
+                line = {"op": op, "a": ids[indices[0]], "b": ids[indices[1]]}
+            line.update(record)
+            output.write(json.dumps(line) + "\n")
+            output.flush()
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+
+def _in_order(argv, regexes, dashed):
+    """
+        Merges the regexes argparse took as positionals with those it left
+        over for starting with "-", back into their order in `argv`.
+    """
+    regexes, dashed, merged = list(regexes), list(dashed), []
+    for arg in argv:
+        if regexes and arg == regexes[0]:
+            merged.append(regexes.pop(0))
+        elif dashed and arg == dashed[0]:
+            merged.append(dashed.pop(0))
+    return merged + regexes + dashed
+
+
+def main(argv=None):
+    # Regexes may start with "-", like "-?[0-9]+", so options can't be
+    # abbreviated, and anything else starting with "-" is a regex too
+    parser = argparse.ArgumentParser(
+        description="Compute the intersection, union and concatenation of some regexes, "
+                    "or compare a whole file of them with --batch.",
+        epilog="Regexes starting with \"-\" are taken as they are, unless they are one of "
+               "the options above; put them after \"--\" to be sure.",
+        allow_abbrev=False)
+    parser.add_argument("regexes", nargs="*")
+    parser.add_argument("--batch", metavar="FILE",
+                        help="read regexes from FILE (one per line; - for stdin) "
+                             "and write JSON Lines results to stdout")
+    parser.add_argument("--jsonl", action="store_true",
+                        help="read --batch FILE as JSON Lines: strings, or objects with a \"regex\" "
+                             "and an optional \"id\"")
+    parser.add_argument("--ops", default=",".join(OPERATIONS),
+                        help="comma-separated operations for --batch (default: %(default)s)")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="number of worker processes for --batch")
+    if argv is None:
+        argv = sys.argv[1:]
+    args, dashed = parser.parse_known_args(argv)
+
+    if args.batch is None:
+        interactive(_in_order(argv, args.regexes, dashed))
+        return
+    if dashed:
+        parser.error("unrecognized arguments: " + " ".join(dashed))
+
+    operations = [op for op in args.ops.split(",") if op]
+    for op in operations:
+        if op not in OPERATIONS:
+            parser.error(f"unknown operation {op!r}, expected some of {', '.join(OPERATIONS)}")
+    if args.batch == "-":
+        batch(sys.stdin, operations, sys.stdout, args.workers, args.jsonl)
+    else:
+        with open(args.batch) as file:
+            batch(file, operations, sys.stdout, args.workers, args.jsonl)
+
+
+if __name__ == "__main__":
+    main()
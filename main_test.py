@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+
+if __name__ == "__main__":
+	raise Exception("Test files can't be run directly. Use `python -m pytest`")
+
+import io
+import json
+
+import pytest
+
+from main import batch, main, read_items
+
+def run(text, operations, **kwargs):
+	output = io.StringIO()
+	batch(io.StringIO(text), operations, output, **kwargs)
+	records = [json.loads(line) for line in output.getvalue().splitlines()]
+	for record in records:
+		record.pop("seconds", None)
+	return records
+
+def test_read_items():
+	# Lines are regexes as they are, even if they look like JSON
+	text = '"[^"]*"\n\n{a}\n'
+	assert list(read_items(io.StringIO(text))) == [(1, '"[^"]*"'), (3, "{a}")]
+	text = '"a+"\n{"id": "x", "regex": "ab"}\n{"regex": "b"}\n'
+	assert list(read_items(io.StringIO(text), jsonl=True)) == [(1, "a+"), ("x", "ab"), (3, "b")]
+
+def test_batch_bad_lines():
+	# A JSON line which can't be read gets an error record with its line
+	# number, and the lines after it still run
+	text = '"a"\n{"regex": \n{"id": "x"}\n5\n["b"]\n{"id": "y", "regex": "[ab]"}\n'
+	records = run(text, ["intersection"], jsonl=True)
+	assert [record["op"] for record in records] == ["compile"] * 6 + ["intersection"]
+	assert [record["id"] for record in records[:6]] == [1, 2, 3, 4, 5, "y"]
+	for record in records[1:5]:
+		assert "error" in record and "regex" not in record
+	assert records[6] == {"op": "intersection", "a": 1, "b": "y", "result": "a", "states": 2}
+
+def test_main_dashed(capsys):
+	# A regex starting with "-" is still a regex, in its place
+	main(["-?[0-9]+", "[0-9]"])
+	assert "Concatenation: -?\\d{2,}" in capsys.readouterr().out
+	main(["[0-9]", "--", "-?[0-9]"])
+	assert "Concatenation: \\d-?\\d" in capsys.readouterr().out
+	with pytest.raises(SystemExit):
+		main(["--batch", "-", "-?[0-9]+"])
+
+def test_batch():
+	records = run('"[^"]*"\nab*\n', ["disjoint", "cardinality"])
+	assert [record["op"] for record in records] == ["compile", "compile", "cardinality", "cardinality", "disjoint"]
+	assert records[0]["regex"] == '"[^"]*"'
+	assert records[2]["result"] == "infinite"
+	assert records[4] == {"op": "disjoint", "a": 1, "b": 2, "result": True, "states": 4}
+
+def test_batch_errors():
+	# A regex which doesn't parse gets an error record, and is left out of the
+	# other operations, rather than aborting the whole batch
+	records = run("a\na(\n[ab]\n", ["intersection"])
+	assert [record["op"] for record in records] == ["compile", "compile", "compile", "intersection"]
+	assert "error" in records[1] and "states" not in records[1]
+	assert records[3]["a"] == 1 and records[3]["b"] == 3
+	assert records[3]["result"] == "a"
+
+def test_batch_workers():
+	text = "a\na(\n[ab]*\nb+\n"
+	operations = ["intersection", "disjoint", "subset", "equivalent", "cardinality"]
+	assert run(text, operations, workers=2) == run(text, operations)
@@ -1,13 +1,19 @@
 from __future__ import annotations
 
 from abc import abstractmethod, ABC
-from dataclasses import dataclass
+from array import array
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dataclasses import dataclass, fields
 from enum import Flag, auto
+from functools import lru_cache, wraps
 from itertools import combinations
 from textwrap import indent
-from typing import Iterable, FrozenSet, Optional, Tuple, List, Union, Any
+from typing import Iterable, FrozenSet, Optional, Tuple, List, Union, Any, Dict, Set
+from weakref import WeakValueDictionary
 
-from greenery.fsm import FSM, anything_else, epsilon, null
+from greenery.cfsm import CFSM, COUNTING_THRESHOLD
+from greenery.fsm import FSM, OblivionError, anything_else, crawl, epsilon, null, traced
 from simple_parser import SimpleParser, nomatch
 
 
@@ -38,22 +44,183 @@ def _combine_flags(base: _REFlags, added: _REFlags, removed: _REFlags):
     return base
 
 
+def _case_fold(chars: FrozenSet[str]) -> FrozenSet[str]:
+    """All the chars that match one of `chars` when ignoring case"""
+    return frozenset(v for c in chars for v in (c, c.lower(), c.upper()) if len(v) == 1)
+
+
+def _symbol_matches(symbol, chars: FrozenSet[str]) -> bool:
+    """Whether an alphabet symbol, either a single char or a symbol class, is one of `chars`"""
+    if isinstance(symbol, frozenset):
+        return not chars.isdisjoint(symbol)
+    return symbol in chars
+
+
+@dataclass(frozen=True)
+class _CharSet:
+    """A set of chars which may be infinite: with `negated`, every char except `chars`"""
+    chars: FrozenSet[str]
+    negated: bool = False
+
+    def union(self, other: _CharSet) -> _CharSet:
+        if not self.negated and not other.negated:
+            return _CharSet(self.chars | other.chars)
+        if self.negated and other.negated:
+            return _CharSet(self.chars & other.chars, True)
+        if self.negated:
+            return _CharSet(self.chars - other.chars, True)
+        return _CharSet(other.chars - self.chars, True)
+
+    def complement(self) -> _CharSet:
+        return _CharSet(self.chars, not self.negated)
+
+    def isdisjoint(self, other: _CharSet) -> bool:
+        if not self.negated and not other.negated:
+            return self.chars.isdisjoint(other.chars)
+        if self.negated and other.negated:
+            return False
+        if self.negated:
+            return other.chars <= self.chars
+        return self.chars <= other.chars
+
+    def issuperset(self, chars: FrozenSet[str]) -> bool:
+        if self.negated:
+            return self.chars.isdisjoint(chars)
+        return chars <= self.chars
+
+
+_NO_CHARS = _CharSet(frozenset())
+_ANY_CHAR = _CharSet(frozenset(), True)
+
+
+@dataclass(frozen=True)
+class _Signature:
+    """Cheap facts about the strings a pattern matches, used to rule out collisions
+    without building FSMs. `first` and `last` hold the chars a non-empty match can
+    start and end with, `chars` those that can appear anywhere in a match, and
+    `required` the chars that every match contains. All but `required` may be too
+    large, but never too small."""
+    first: _CharSet
+    last: _CharSet
+    chars: _CharSet
+    required: FrozenSet[str]
+
+    @classmethod
+    def of_chars(cls, chars: _CharSet) -> _Signature:
+        single = not chars.negated and len(chars.chars) == 1
+        return cls(chars, chars, chars, chars.chars if single else frozenset())
+
+    def padded(self, prefix_postfix: Tuple[int, int], nullable: bool) -> _Signature:
+        """The signature after padding with `prefix_postfix` dots, as `to_fsm` does"""
+        pre, post = prefix_postfix
+        if pre == post == 0:
+            return self
+        return _Signature(
+            _ANY_CHAR if pre or nullable else self.first,
+            _ANY_CHAR if post or nullable else self.last,
+            _ANY_CHAR,
+            self.required,
+        )
+
+
+_EMPTY_SIGNATURE = _Signature(_NO_CHARS, _NO_CHARS, _NO_CHARS, frozenset())
+
+
+class SymbolClasses:
+    """Partitions the chars used by some patterns into classes which none of the patterns
+    tell apart, e.g. `a` and `A` if every pattern mentioning them is case insensitive.
+    The FSMs are built over these classes (frozensets of chars, plus `anything_else`), so
+    a `(?i)` pattern costs one symbol per letter instead of two. Strings have to be passed
+    through `normalize` before being fed to such an FSM."""
+
+    def __init__(self, *patterns: _BasePattern, flags: _REFlags = None):
+        membership = defaultdict(list)
+        char_sets = {s for p in patterns for s in p._get_char_sets(flags)}
+        for i, chars in enumerate(char_sets):
+            for c in chars:
+                membership[c].append(i)
+        groups = defaultdict(set)
+        for c, signature in membership.items():
+            groups[tuple(signature)].add(c)
+        self.classes: Dict[str, FrozenSet[str]] = {}
+        for group in groups.values():
+            group = frozenset(group)
+            for c in group:
+                self.classes[c] = group
+
+    @property
+    def alphabet(self) -> FrozenSet:
+        return frozenset(self.classes.values()) | {anything_else}
+
+    def normalize(self, string: Iterable[str]) -> List:
+        """Maps each char of `string` to its symbol in `alphabet`"""
+        return [self.classes.get(c, anything_else) for c in string]
+
+
+# Part of the key of every cached FSM, so that bumping it forgets them all
+_fsm_cache_generation = 0
+
+
+def clear_fsm_caches():
+    """Forgets every FSM `to_fsm` has cached, e.g. to time it from a cold start"""
+    global _fsm_cache_generation
+    _fsm_cache_generation += 1
+    _char_group_fsm.cache_clear()
+
+
+def _cached_fsm(to_fsm):
+    """Caches the FSMs `to_fsm` builds for a node by alphabet, padding and flags. Only weak
+    references are kept, so an FSM is built again once nothing uses it anymore."""
+
+    @wraps(to_fsm)
+    def cached(self, alphabet=None, prefix_postfix=None, flags=None) -> FSM:
+        if alphabet is None:
+            alphabet = self.alphabet
+        elif not isinstance(alphabet, frozenset):
+            alphabet = frozenset(alphabet)
+        if prefix_postfix is None:
+            prefix_postfix = self.prefix_postfix
+        key = alphabet, prefix_postfix, flags if flags is not None else _REFlags(0), _fsm_cache_generation
+        if not hasattr(self, '_fsm_cache'):
+            object.__setattr__(self, '_fsm_cache', WeakValueDictionary())
+        result = self._fsm_cache.get(key)
+        if result is None:
+            result = to_fsm(self, alphabet, prefix_postfix, flags)
+            self._fsm_cache[key] = result
+        return result
+
+    return cached
+
+
 @dataclass(frozen=True)
 class _BasePattern(ABC):
-    __slots__ = '_alphabet_cache', '_prefix_cache', '_lengths_cache'
+    __slots__ = '_alphabet_cache', '_prefix_cache', '_reach_cache', '_lengths_cache', '_fsm_cache'
+
+    def __reduce__(self):
+        # Frozen, partly slotted dataclasses can't be unpickled attribute by attribute
+        return self.__class__, tuple(getattr(self, f.name) for f in fields(self))
 
     @abstractmethod
     def to_fsm(self, alphabet=None, prefix_postfix=None, flags=None) -> FSM:
         raise NotImplementedError
 
+    def to_cfsm(self, alphabet=None, prefix_postfix=None, flags=None, threshold=COUNTING_THRESHOLD) -> CFSM:
+        """Like `to_fsm`, but repetitions with bounds above `threshold` are compiled to counters"""
+        return CFSM.from_fsm(self.to_fsm(alphabet, prefix_postfix, flags))
+
+    def counted(self, threshold=COUNTING_THRESHOLD) -> bool:
+        """Returns whether `to_cfsm` would compile some repetition in this pattern to a counter"""
+        return False
+
     @abstractmethod
-    def _get_alphabet(self) -> Iterable:
+    def _get_char_sets(self, flags: _REFlags = None) -> Iterable[FrozenSet[str]]:
+        """Yields the sets of chars this pattern has to tell apart from all others"""
         raise NotImplementedError
 
     @property
     def alphabet(self) -> FrozenSet:
         if not hasattr(self, '_alphabet_cache'):
-            super(_BasePattern, self).__setattr__('_alphabet_cache', frozenset(self._get_alphabet()))
+            super(_BasePattern, self).__setattr__('_alphabet_cache', SymbolClasses(self).alphabet)
         return self._alphabet_cache
 
     @abstractmethod
@@ -67,6 +234,18 @@ class _BasePattern(ABC):
             super(_BasePattern, self).__setattr__('_prefix_cache', self._get_prefix_postfix())
         return self._prefix_cache
 
+    def _get_reach(self) -> Tuple[int, int]:
+        return 0, 0
+
+    @property
+    def reach(self) -> Tuple[int, int]:
+        """Returns how many chars before/after a match lookarounds and anchors may look at. Unlike
+        `prefix_postfix`, this counts anchors, which look at the padding if there is one, but
+        don't ask for any"""
+        if not hasattr(self, '_reach_cache'):
+            super(_BasePattern, self).__setattr__('_reach_cache', self._get_reach())
+        return self._reach_cache
+
     @abstractmethod
     def _get_lengths(self) -> Tuple[int, Optional[int]]:
         raise NotImplementedError
@@ -79,6 +258,11 @@ class _BasePattern(ABC):
             super(_BasePattern, self).__setattr__('_lengths_cache', self._get_lengths())
         return self._lengths_cache
 
+    @abstractmethod
+    def _get_signature(self, flags: _REFlags = None) -> _Signature:
+        """Returns the `_Signature` of this pattern, used by `compare_patterns` to skip pairs"""
+        raise NotImplementedError
+
 
 class _Repeatable(_BasePattern, ABC):
     pass
@@ -92,10 +276,15 @@ class _CharGroup(_Repeatable):
     negated: bool
     __slots__ = 'chars', 'negated'
 
-    def _get_alphabet(self, alphabet=None) -> Iterable:
-        yield from (c.lower() for c in self.chars)
-        yield from (c.upper() for c in self.chars)
-        yield anything_else
+    def _get_chars(self, flags: _REFlags = None) -> FrozenSet[str]:
+        if flags is not None and flags & _REFlags.CASE_INSENSITIVE:
+            return _case_fold(self.chars)
+        return self.chars
+
+    def _get_char_sets(self, flags: _REFlags = None) -> Iterable[FrozenSet[str]]:
+        chars = self._get_chars(flags)
+        if chars:
+            yield chars
 
     def _get_prefix_postfix(self) -> Tuple[int, Optional[int]]:
         return 0, 0
@@ -103,6 +292,10 @@ class _CharGroup(_Repeatable):
     def _get_lengths(self) -> Tuple[int, Optional[int]]:
         return 1, 1
 
+    def _get_signature(self, flags: _REFlags = None) -> _Signature:
+        return _Signature.of_chars(_CharSet(self._get_chars(flags), self.negated))
+
+    @_cached_fsm
     def to_fsm(self, alphabet=None, prefix_postfix=None, flags=None) -> FSM:
         if alphabet is None:
             alphabet = self.alphabet
@@ -110,39 +303,44 @@ class _CharGroup(_Repeatable):
             prefix_postfix = self.prefix_postfix
         if prefix_postfix != (0, 0):
             raise ValueError("Can not have prefix/postfix on CharGroup-level")
-        insensitive = False
+        chars = self._get_chars(flags)
         if flags is not None:
-            insensitive = flags & _REFlags.CASE_INSENSITIVE
             flags &= ~_REFlags.CASE_INSENSITIVE
             flags &= ~_REFlags.SINGLE_LINE
+            flags &= ~_REFlags.MULTILINE
             if flags:
                 raise NotImplementedError(flags)
-        if insensitive:
-            chars = frozenset({*(c.lower() for c in self.chars), *(c.upper() for c in self.chars)})
-        else:
-            chars = self.chars
 
-        # 0 is initial, 1 is final
+        return _char_group_fsm(chars, self.negated, alphabet)
 
-        # If negated, make a singular FSM accepting any other characters
-        if self.negated:
-            mapping = {
-                0: dict([(symbol, 1) for symbol in alphabet - chars]),
-            }
 
-        # If normal, make a singular FSM accepting only these characters
-        else:
-            mapping = {
-                0: dict([(symbol, 1) for symbol in chars]),
-            }
+@lru_cache(maxsize=1024)
+def _char_group_fsm(chars: FrozenSet[str], negated: bool, alphabet: FrozenSet) -> FSM:
+    """The FSM of a `_CharGroup`. Kept for a while, as the same few groups, like `\\w` or the
+    dots padding lookarounds, are built over and over for the same alphabet."""
+    # 0 is initial, 1 is final
 
-        return FSM(
-            alphabet=alphabet,
-            states={0, 1},
-            initial=0,
-            finals={1},
-            map=mapping,
-        )
+    # If negated, make a singular FSM accepting any other symbols
+    if negated:
+        mapping = {
+            0: dict([(symbol, 1) for symbol in alphabet
+                     if symbol is anything_else or not _symbol_matches(symbol, chars)]),
+        }
+
+    # If normal, make a singular FSM accepting only these symbols
+    else:
+        mapping = {
+            0: dict([(symbol, 1) for symbol in alphabet
+                     if symbol is not anything_else and _symbol_matches(symbol, chars)]),
+        }
+
+    return FSM(
+        alphabet=alphabet,
+        states={0, 1},
+        initial=0,
+        finals={1},
+        map=mapping,
+    )
 
 
 @dataclass(frozen=True)
@@ -152,10 +350,9 @@ class _CompositeCharGroup(_Repeatable):
     groups: Tuple[_CharGroup, ...]
     negate: bool
 
-    def _get_alphabet(self) -> Iterable:
+    def _get_char_sets(self, flags: _REFlags = None) -> Iterable[FrozenSet[str]]:
         for g in self.groups:
-            yield from g.alphabet
-        yield anything_else
+            yield from g._get_char_sets(flags)
 
     def _get_prefix_postfix(self) -> Tuple[int, Optional[int]]:
         return 0, 0
@@ -163,6 +360,13 @@ class _CompositeCharGroup(_Repeatable):
     def _get_lengths(self) -> Tuple[int, Optional[int]]:
         return 1, 1
 
+    def _get_signature(self, flags: _REFlags = None) -> _Signature:
+        chars = _NO_CHARS
+        for g in self.groups:
+            chars = chars.union(g._get_signature(flags).chars)
+        return _Signature.of_chars(chars.complement() if self.negate else chars)
+
+    @_cached_fsm
     def to_fsm(self, alphabet=None, prefix_postfix=None, flags=None) -> FSM:
         if alphabet is None:
             alphabet = self.alphabet
@@ -181,24 +385,24 @@ class _CompositeCharGroup(_Repeatable):
 @dataclass(frozen=True)
 class __DotCls(_Repeatable):
 
+    @_cached_fsm
     def to_fsm(self, alphabet=None, prefix_postfix=None, flags=None) -> FSM:
         if alphabet is None:
             alphabet = self.alphabet
         if flags is None or not flags & _REFlags.SINGLE_LINE:
-            chars = alphabet - {'\n'}
+            symbols = [symbol for symbol in alphabet if not _symbol_matches(symbol, _NEWLINE)]
         else:
-            chars = alphabet
+            symbols = alphabet
         return FSM(
             alphabet=alphabet,
             states={0, 1},
             initial=0,
             finals={1},
-            map={0: {symbol: 1 for symbol in chars}},
+            map={0: {symbol: 1 for symbol in symbols}},
         )
 
-    def _get_alphabet(self) -> Iterable:
-        yield '\n'
-        yield anything_else
+    def _get_char_sets(self, flags: _REFlags = None) -> Iterable[FrozenSet[str]]:
+        yield _NEWLINE
 
     def _get_prefix_postfix(self) -> Tuple[int, Optional[int]]:
         return 0, 0
@@ -206,17 +410,23 @@ class __DotCls(_Repeatable):
     def _get_lengths(self) -> Tuple[int, Optional[int]]:
         return 1, 1
 
+    def _get_signature(self, flags: _REFlags = None) -> _Signature:
+        if flags is None or not flags & _REFlags.SINGLE_LINE:
+            return _Signature.of_chars(_CharSet(_NEWLINE, True))
+        return _Signature.of_chars(_ANY_CHAR)
+
 
 @dataclass(frozen=True)
 class __EmptyCls(_BasePattern):
 
+    @_cached_fsm
     def to_fsm(self, alphabet=None, prefix_postfix=None, flags=None) -> FSM:
         if alphabet is None:
             alphabet = self.alphabet
         return epsilon(alphabet)
 
-    def _get_alphabet(self) -> Iterable:
-        yield anything_else
+    def _get_char_sets(self, flags: _REFlags = None) -> Iterable[FrozenSet[str]]:
+        return ()
 
     def _get_prefix_postfix(self) -> Tuple[int, Optional[int]]:
         return 0, 0
@@ -224,7 +434,11 @@ class __EmptyCls(_BasePattern):
     def _get_lengths(self) -> Tuple[int, Optional[int]]:
         return 0, 0
 
+    def _get_signature(self, flags: _REFlags = None) -> _Signature:
+        return _EMPTY_SIGNATURE
+
 
+_NEWLINE = frozenset('\n')
 _DOT = __DotCls()
 _EMPTY = __EmptyCls()
 _NONE = _CharGroup(frozenset(""), False)
@@ -259,21 +473,45 @@ class _Repeated(_BasePattern):
         return f"Repeated[{self.min}:{self.max if self.max is not None else ''}]:\n" \
             f"{indent(str(self.base), '    ')}"
 
-    def _get_alphabet(self) -> Iterable:
-        return self.base.alphabet
+    def _get_char_sets(self, flags: _REFlags = None) -> Iterable[FrozenSet[str]]:
+        return self.base._get_char_sets(flags)
 
     def _get_prefix_postfix(self) -> Tuple[int, Optional[int]]:
         return self.base.prefix_postfix
 
+    def _get_reach(self) -> Tuple[int, int]:
+        return self.base.reach
+
     def _get_lengths(self) -> Tuple[int, Optional[int]]:
         l, h = self.base.lengths
         return l * self.min, (h * self.max if None not in (h, self.max) else None)
 
+    def _get_signature(self, flags: _REFlags = None) -> _Signature:
+        if self.max == 0:
+            return _EMPTY_SIGNATURE
+        base = self.base._get_signature(flags)
+        if self.min == 0:
+            return _Signature(base.first, base.last, base.chars, frozenset())
+        return base
+
+    @_cached_fsm
     def to_fsm(self, alphabet=None, prefix_postfix=None, flags=None) -> FSM:
         if alphabet is None:
             alphabet = self.alphabet
         if prefix_postfix is None:
             prefix_postfix = self.prefix_postfix
+        if self.base.reach != (0, 0):
+            if self.max is None or self.max > 1:
+                # Each repetition would be built on its own, blind to the next one
+                raise NotImplementedError("lookarounds reaching out of a repetition are not implemented")
+            # At most once, so the lookarounds see the same padding as `base` on its own would
+            skipped = _ALL.to_fsm(alphabet).times(sum(prefix_postfix))
+            if self.max == 0:
+                return skipped
+            result = self.base.to_fsm(alphabet, prefix_postfix, flags=flags)
+            if self.min == 0:
+                result |= skipped
+            return result
         if prefix_postfix != (0, 0):
             raise ValueError("Can not have prefix/postfix on CharGroup-level")
 
@@ -282,11 +520,28 @@ class _Repeated(_BasePattern):
         if self.max is None:
             optional = unit.star()
         else:
-            optional = unit.copy()
-            optional.finals.add(optional.initial)
+            optional = epsilon(alphabet) | unit
             optional *= (self.max - self.min)
         return mandatory + optional
 
+    def counted(self, threshold=COUNTING_THRESHOLD) -> bool:
+        return self.min > threshold or (self.max is not None and self.max > threshold) \
+            or self.base.counted(threshold)
+
+    def to_cfsm(self, alphabet=None, prefix_postfix=None, flags=None, threshold=COUNTING_THRESHOLD) -> CFSM:
+        # Each count of a counter is the same FSM, blind to the counts either side, so a base
+        # with lookarounds or anchors looking out of it goes through `to_fsm`, which checks it
+        if self.base.reach != (0, 0) or not self.counted(threshold):
+            return super(_Repeated, self).to_cfsm(alphabet, prefix_postfix, flags)
+        if alphabet is None:
+            alphabet = self.alphabet
+        if prefix_postfix is None:
+            prefix_postfix = self.prefix_postfix
+        if prefix_postfix != (0, 0):
+            raise ValueError("Can not have prefix/postfix on CharGroup-level")
+        unit = self.base.to_cfsm(alphabet, (0, 0), flags, threshold)
+        return unit.times(self.min, self.max)
+
 
 _ALL_STAR = _Repeated(_ALL, 0, None)
 
@@ -300,42 +555,112 @@ class _NonCapturing:
     negate: bool
     __slots__ = 'inner', 'backwards', 'negate'
 
+    def __reduce__(self):
+        return self.__class__, (self.inner, self.backwards, self.negate)
+
     @property
     def alphabet(self):
         return self.inner.alphabet
 
+    def _get_char_sets(self, flags: _REFlags = None) -> Iterable[FrozenSet[str]]:
+        return self.inner._get_char_sets(flags)
+
+
+_NOT_NEWLINE = _CharGroup(_NEWLINE, True)
+
+
+@dataclass(frozen=True)
+class _Anchor:
+    """Represents `^`, `$`, `\\A`, `\\Z`, `\\b` or `\\B`, given as `kind`. Like a lookaround of one char,
+    but needs no padding: at the ends of a pattern, it sees the padding if there is any, and
+    the start or end of the string otherwise. Only valid inside a `_Concatenation`"""
+    kind: str
+    __slots__ = 'kind',
+
+    def __reduce__(self):
+        return self.__class__, (self.kind,)
+
+    def _get_char_sets(self, flags: _REFlags = None) -> Iterable[FrozenSet[str]]:
+        if self.kind in 'bB':
+            yield _CHAR_GROUPS['w'].chars
+        elif self.kind in '^$':
+            yield _NEWLINE
+
+    @property
+    def reach(self) -> Tuple[int, int]:
+        if self.kind in 'bB':
+            return 1, 1
+        if self.kind in '^A':
+            return 1, 0
+        # Without MULTILINE, `$` looks two chars ahead
+        return 0, 2 if self.kind == '$' else 1
+
+    def lookaround(self, flags: _REFlags = None) -> Optional[_NonCapturing]:
+        """The lookaround this anchor stands for under `flags`, None for word boundaries"""
+        multiline = flags is not None and flags & _REFlags.MULTILINE
+        if self.kind == 'A' or (self.kind == '^' and not multiline):
+            return _NonCapturing(_ALL, True, True)
+        if self.kind == '^':
+            return _NonCapturing(_NOT_NEWLINE, True, True)
+        if self.kind == 'Z':
+            return _NonCapturing(_ALL, False, True)
+        if self.kind == '$' and not multiline:
+            # Before a newline ending the string, too
+            return _NonCapturing(_NOT_END, False, True)
+        if self.kind == '$':
+            return _NonCapturing(_NOT_NEWLINE, False, True)
+        return None
+
+
+_ZERO_WIDTH = (_NonCapturing, _Anchor)
+
 
 @dataclass(frozen=True)
 class _Concatenation(_BasePattern):
-    """Represents multiple Patterns that have to be match in a row. Can contain `_NonCapturing`"""
-    parts: Tuple[Union[_BasePattern, _NonCapturing], ...]
+    """Represents multiple Patterns that have to be match in a row. Can contain `_NonCapturing`
+    and `_Anchor`"""
+    parts: Tuple[Union[_BasePattern, _NonCapturing, _Anchor], ...]
     __slots__ = 'parts',
 
     def __str__(self):
         return "Concatenation:\n" + "\n".join(indent(str(p), '  ') for p in self.parts)
 
-    def _get_alphabet(self) -> Iterable:
+    def _get_char_sets(self, flags: _REFlags = None) -> Iterable[FrozenSet[str]]:
         for p in self.parts:
-            yield from p.alphabet
-        yield anything_else
+            yield from p._get_char_sets(flags)
 
     def _get_prefix_postfix(self) -> Tuple[int, Optional[int]]:
+        return self._sticking_out(anchors=False)
+
+    def _get_reach(self) -> Tuple[int, int]:
+        return self._sticking_out(anchors=True)
+
+    def _sticking_out(self, anchors: bool) -> Tuple[int, int]:
+        """How far lookarounds, and `anchors` if set, may look over the beginning and the end"""
         pre = 0  # What is the longest a lookback could stick out over the beginning?
         off = 0  # How many chars have been consumed, e.g what is the minimum length?
         for p in self.parts:
-            if not isinstance(p, _NonCapturing):
+            if isinstance(p, _Anchor):
+                req = p.reach[0] - off if anchors else 0
+            elif not isinstance(p, _NonCapturing):
+                req = (p.reach if anchors else p.prefix_postfix)[0] - off
                 off += p.lengths[0]
             elif p.backwards:
                 a, b = p.inner.lengths
                 if a != b:
                     raise ValueError(f"lookbacks have to have fixed length {(a, b)}")
                 req = a - off
-                if req > pre:
-                    pre = req
+            else:
+                continue
+            if req > pre:
+                pre = req
         post = 0
         off = 0
         for p in reversed(self.parts):
-            if not isinstance(p, _NonCapturing):
+            if isinstance(p, _Anchor):
+                req = p.reach[1] - off if anchors else 0
+            elif not isinstance(p, _NonCapturing):
+                req = (p.reach if anchors else p.prefix_postfix)[1] - off
                 off += p.lengths[0]
             elif not p.backwards:
                 a, b = p.inner.lengths
@@ -343,19 +668,59 @@ class _Concatenation(_BasePattern):
                     req = a - off  # TODO: is this correct?
                 else:
                     req = b - off
-                if req > post:
-                    post = req
+            else:
+                continue
+            if req > post:
+                post = req
         return pre, post
 
     def _get_lengths(self) -> Tuple[int, Optional[int]]:
         l, h = 0, 0
         for p in self.parts:
-            if not isinstance(p, _NonCapturing):
+            if not isinstance(p, _ZERO_WIDTH):
                 pl, ph = p.lengths
                 l += pl
                 h = h + ph if None not in (h, ph) else None
         return l, h
 
+    def _get_signature(self, flags: _REFlags = None) -> _Signature:
+        # Lookarounds and anchors only ever remove matches, so leaving them out is safe
+        parts = [p for p in self.parts if not isinstance(p, _ZERO_WIDTH)]
+        signatures = [p._get_signature(flags) for p in parts]
+        first = last = chars = _NO_CHARS
+        required = frozenset()
+        for p, s in zip(parts, signatures):
+            first = first.union(s.first)
+            if p.lengths[0] > 0:
+                break
+        for p, s in zip(reversed(parts), reversed(signatures)):
+            last = last.union(s.last)
+            if p.lengths[0] > 0:
+                break
+        for s in signatures:
+            chars = chars.union(s.chars)
+            required |= s.required
+        return _Signature(first, last, chars, required)
+
+    def counted(self, threshold=COUNTING_THRESHOLD) -> bool:
+        return any(not isinstance(p, _ZERO_WIDTH) and p.counted(threshold) for p in self.parts)
+
+    def to_cfsm(self, alphabet=None, prefix_postfix=None, flags=None, threshold=COUNTING_THRESHOLD) -> CFSM:
+        if alphabet is None:
+            alphabet = self.alphabet
+        if prefix_postfix is None:
+            prefix_postfix = self.prefix_postfix
+        # Lookarounds and anchors need the complete FSM, so they don't get counters, nor do
+        # parts whose lookarounds or anchors look at their neighbours.
+        if prefix_postfix != (0, 0) or any(isinstance(p, _ZERO_WIDTH) or p.reach != (0, 0) for p in self.parts) \
+                or not self.counted(threshold):
+            return super(_Concatenation, self).to_cfsm(alphabet, prefix_postfix, flags)
+        return CFSM.concatenate(
+            CFSM.from_fsm(epsilon(alphabet)),
+            *(p.to_cfsm(alphabet, (0, 0), flags, threshold) for p in self.parts)
+        )
+
+    @_cached_fsm
     def to_fsm(self, alphabet=None, prefix_postfix=None, flags=None) -> FSM:
         if alphabet is None:
             alphabet = self.alphabet
@@ -363,14 +728,55 @@ class _Concatenation(_BasePattern):
             prefix_postfix = self.prefix_postfix
 
         all = _ALL.to_fsm(alphabet)
-        all_star = all.star()
+        for i, part in enumerate(self.parts):
+            if isinstance(part, _Repeated) and part.max is not None and part.max <= 1 \
+                    and not self._at_ends(i, part.reach):
+                # Repeated at most once, a group is either left out or there once, like an
+                # option of a group. That group then gets inlined below.
+                group = part.base
+                if part.max == 0:
+                    replacement = ()
+                else:
+                    options = group.options + ((_Concatenation(()),) if part.min == 0 else ())
+                    replacement = (Pattern(options, group.added_flags, group.removed_flags),)
+                return _Concatenation(self.parts[:i] + replacement + self.parts[i + 1:]) \
+                    .to_fsm(alphabet, prefix_postfix, flags)
+            if isinstance(part, Pattern) and not self._at_ends(i, part.reach):
+                # A group whose lookarounds or anchors look at its neighbours gets inlined
+                return FSM.union(*(
+                    _Concatenation(self.parts[:i] + _inline(o, part, flags) + self.parts[i + 1:])
+                    .to_fsm(alphabet, prefix_postfix, flags)
+                    for o in part.options
+                ))
+
         fsm_parts = []
         current = [all.times(prefix_postfix[0])]
-        for part in self.parts:
+        consumed = 0  # How long `current` is at least
+        for i, part in enumerate(self.parts):
+            if isinstance(part, _Anchor):
+                if part.kind in 'bB':
+                    return self._apply_lookaheads(
+                        self._word_boundary(i, current, consumed, bool(fsm_parts), alphabet, prefix_postfix, flags),
+                        fsm_parts)
+                part = part.lookaround(flags)
             if isinstance(part, _NonCapturing):
+                if part.inner.reach != (0, 0):
+                    # `inner` would see the end of the string around it, not what's there
+                    raise NotImplementedError("lookarounds and anchors reaching out of lookarounds are not implemented")
                 inner = part.inner.to_fsm(alphabet, (0, 0), flags)
                 if part.backwards:
-                    raise NotImplementedError("lookbacks are not implemented")
+                    if fsm_parts and consumed < part.inner.lengths[0]:
+                        # The prefix isn't a single FSM anymore once split by a lookahead
+                        raise NotImplementedError("lookbacks reaching back over lookaheads are not implemented")
+                    # Mirrors the lookaheads: everything so far has to end with `inner`. After a
+                    # lookahead, that is what came after it, if it is long enough.
+                    prefix = FSM.concatenate(*current)
+                    all_star = all.star()
+                    if part.negate:
+                        prefix = prefix.difference(all_star + inner)
+                    else:
+                        prefix = prefix.intersection(all_star + inner)
+                    current = [prefix]
                 else:
                     # try:
                     #     inner.cardinality()
@@ -379,20 +785,135 @@ class _Concatenation(_BasePattern):
                     fsm_parts.append((None, current))
                     fsm_parts.append((part, inner))
                     current = []
-            else:
+                    consumed = 0
+            elif part.reach == (0, 0):
                 current.append(part.to_fsm(alphabet, (0, 0), flags))
+                consumed += part.lengths[0]
+            else:
+                if not self._at_ends(i, part.reach):
+                    raise NotImplementedError("lookarounds reaching out of a repetition are not implemented")
+                pre, post = part.reach
+                # Lookarounds reaching out of the first or last part see what this concatenation
+                # is padded with
+                padding = (prefix_postfix[0] if pre else 0, prefix_postfix[1] if post else 0)
+                if pre:
+                    current = []
+                current.append(part.to_fsm(alphabet, padding, flags))
+                consumed += part.lengths[0]
+                if post:
+                    return self._apply_lookaheads(FSM.concatenate(*current), fsm_parts)
         current.append(all.times(prefix_postfix[1]))
-        result = FSM.concatenate(*current)
-        for m, f in reversed(fsm_parts):
+        return self._apply_lookaheads(FSM.concatenate(*current), fsm_parts)
+
+    def _at_ends(self, i: int, reach: Tuple[int, int]) -> bool:
+        """Whether lookarounds of `self.parts[i]` reaching as far as `reach` can only look
+        outside of this concatenation"""
+        pre, post = reach
+        return not (pre and i != 0) and not (post and i != len(self.parts) - 1)
+
+    def _word_boundary(self, i: int, current: List[FSM], consumed: int, split: bool, alphabet,
+                       prefix_postfix: Tuple[int, int], flags) -> FSM:
+        """Builds `current`, the parts before the word boundary `self.parts[i]`, and the parts
+        after it, such that either side of it exactly one char is a word char (`\\b`), or
+        either none or both are (`\\B`). The start and end of the string count as non-word
+        chars. If `split` by a lookahead, `current` has to contain the char before."""
+        if split and consumed < 1:
+            raise NotImplementedError("word boundaries right after lookaheads are not implemented")
+        rest = _Concatenation(self.parts[i + 1:])
+        if rest.reach[0]:
+            raise NotImplementedError("lookbacks reaching back over word boundaries are not implemented")
+        before = FSM.concatenate(*current)
+        after = rest.to_fsm(alphabet, (0, prefix_postfix[1]), flags)
+        all_star = _ALL_STAR.to_fsm(alphabet)
+        word = _CHAR_GROUPS['w'].to_fsm(alphabet)
+        word_before, word_after = before.intersection(all_star + word), after.intersection(word + all_star)
+        other_before, other_after = before.difference(all_star + word), after.difference(word + all_star)
+        if self.parts[i].kind == 'b':
+            return (word_before + other_after) | (other_before + word_after)
+        return (word_before + word_after) | (other_before + other_after)
+
+    @staticmethod
+    def _apply_lookaheads(result: FSM, fsm_parts) -> FSM:
+        """Concatenates the FSMs in `fsm_parts`, split by the lookaheads in between, and `result`.
+        This is done in one crawl, instead of a product per lookahead: a state is a set of
+        positions `(i, state, pending)`, at `state` of the `i`th FSM, with `pending` holding
+        the lookaheads passed so far which are yet to (not) match, as `(j, state)` pairs at
+        `state` of the `j`th lookahead."""
+        if not fsm_parts:
+            return result
+        fsms: List[FSM] = []
+        lookaheads: List[Tuple[bool, FSM, Set]] = []
+        before = defaultdict(list)  # The lookaheads right before each FSM
+        for m, f in fsm_parts:
             if m is None:
-                result = FSM.concatenate(*f, result)
+                fsms.extend(f)
             else:
                 assert isinstance(m, _NonCapturing) and not m.backwards
-                if m.negate:
-                    result = result.difference(f)
+                before[len(fsms)].append(len(lookaheads))
+                lookaheads.append((m.negate, f, {state for state in f.states if f.islive(state)}))
+        fsms.append(result)
+        last = len(fsms) - 1
+
+        def settle(j, state):
+            """`(j, state)` if still pending, None if met, or False if failed"""
+            negate, f, live = lookaheads[j]
+            if state in f.finals:
+                return False if negate else None
+            if state not in live:
+                return None if negate else False
+            return j, state
+
+        def enter(i, state, pending, positions):
+            """Adds the position at `state` of the `i`th FSM to `positions`, and those of the
+            next FSMs while at a final state, starting the lookaheads on the way"""
+            while True:
+                positions.add((i, state, pending))
+                if i == last or state not in fsms[i].finals:
+                    return
+                i += 1
+                started = set(pending)
+                for j in before[i]:
+                    settled = settle(j, lookaheads[j][1].initial)
+                    if settled is False:
+                        return
+                    if settled is not None:
+                        started.add(settled)
+                state, pending = fsms[i].initial, frozenset(started)
+
+        initial = set()
+        enter(0, fsms[0].initial, frozenset(), initial)
+        initial = frozenset(initial)
+
+        def final(positions):
+            return any(
+                i == last and state in result.finals and all(lookaheads[j][0] for j, _ in pending)
+                for i, state, pending in positions
+            )
+
+        def follow(positions, symbol):
+            next = set()
+            for i, state, pending in positions:
+                transitions = fsms[i].map.get(state)
+                if transitions is None or symbol not in transitions:
+                    continue
+                still = set()
+                for j, substate in pending:
+                    inner = lookaheads[j][1].map.get(substate)
+                    if inner is not None and symbol in inner:
+                        settled = settle(j, inner[symbol])
+                    else:
+                        settled = None if lookaheads[j][0] else False
+                    if settled is False:
+                        break
+                    if settled is not None:
+                        still.add(settled)
                 else:
-                    result = result.intersection(f + all_star)
-        return result
+                    enter(i, transitions[symbol], frozenset(still), next)
+            if not next:
+                raise OblivionError
+            return frozenset(next)
+
+        return crawl(result.alphabet, initial, final, follow)
 
 
 @dataclass(frozen=True)
@@ -404,10 +925,10 @@ class Pattern(_Repeatable):
     def __str__(self):
         return "Pattern:\n" + "\n".join(indent(str(o), '  ') for o in self.options)
 
-    def _get_alphabet(self) -> Iterable:
+    def _get_char_sets(self, flags: _REFlags = None) -> Iterable[FrozenSet[str]]:
+        flags = _combine_flags(flags if flags is not None else _REFlags(0), self.added_flags, self.removed_flags)
         for o in self.options:
-            yield from o.alphabet
-        yield anything_else
+            yield from o._get_char_sets(flags)
 
     def _get_lengths(self) -> Tuple[int, Optional[int]]:
         l, h = None, 0
@@ -419,6 +940,15 @@ class Pattern(_Repeatable):
                 h = oh
         return l, h
 
+    def _get_signature(self, flags: _REFlags = None) -> _Signature:
+        flags = _combine_flags(flags if flags is not None else _REFlags(0), self.added_flags, self.removed_flags)
+        signatures = [o._get_signature(flags) for o in self.options]
+        first = last = chars = _NO_CHARS
+        for s in signatures:
+            first, last, chars = first.union(s.first), last.union(s.last), chars.union(s.chars)
+        required = frozenset.intersection(*(s.required for s in signatures))
+        return _Signature(first, last, chars, required)
+
     def _get_prefix_postfix(self) -> Tuple[int, Optional[int]]:
         pre, post = 0, 0
         for o in self.options:
@@ -429,6 +959,10 @@ class Pattern(_Repeatable):
                 post = opost
         return pre, post
 
+    def _get_reach(self) -> Tuple[int, int]:
+        return max(o.reach[0] for o in self.options), max(o.reach[1] for o in self.options)
+
+    @_cached_fsm
     def to_fsm(self, alphabet=None, prefix_postfix=None, flags=None) -> FSM:
         if alphabet is None:
             alphabet = self.alphabet
@@ -439,20 +973,70 @@ class Pattern(_Repeatable):
         flags = _combine_flags(flags, self.added_flags, self.removed_flags)
         return FSM.union(*(o.to_fsm(alphabet, prefix_postfix, flags) for o in self.options))
 
+    def counted(self, threshold=COUNTING_THRESHOLD) -> bool:
+        return any(o.counted(threshold) for o in self.options)
+
+    def to_cfsm(self, alphabet=None, prefix_postfix=None, flags=None, threshold=COUNTING_THRESHOLD) -> CFSM:
+        if alphabet is None:
+            alphabet = self.alphabet
+        if prefix_postfix is None:
+            prefix_postfix = self.prefix_postfix
+        if prefix_postfix != (0, 0) or not self.counted(threshold):
+            return super(Pattern, self).to_cfsm(alphabet, prefix_postfix, flags)
+        if flags is None:
+            flags = _REFlags(0)
+        flags = _combine_flags(flags, self.added_flags, self.removed_flags)
+        return CFSM.union(*(o.to_cfsm(alphabet, prefix_postfix, flags, threshold) for o in self.options))
+
     def with_flags(self, added: _REFlags, removed: _REFlags = _REFlags(0)) -> Pattern:
         return self.__class__(self.options, added, removed)
 
+def _with_flags(part: Union[_BasePattern, _NonCapturing, _Anchor], added: _REFlags, removed: _REFlags,
+                flags: _REFlags) -> Union[_BasePattern, _NonCapturing, _Anchor]:
+    """`part` taken out of a group which adds and removes flags, with these moved into it.
+    `flags` are those in effect inside the group."""
+    if not added and not removed:
+        return part
+    if isinstance(part, Pattern):
+        # The same as applying the group's flags first and then those of `part`
+        return Pattern(part.options, (added & ~part.removed_flags) | part.added_flags,
+                       (removed & ~part.added_flags) | part.removed_flags)
+    if isinstance(part, _Repeated):
+        return _Repeated(_with_flags(part.base, added, removed, flags), part.min, part.max)
+    if isinstance(part, _NonCapturing):
+        return _NonCapturing(_with_flags(part.inner, added, removed, flags), part.backwards, part.negate)
+    if isinstance(part, _Anchor):
+        # The lookarounds standing for anchors don't depend on flags anymore
+        return part.lookaround(flags) or part
+    return Pattern((_Concatenation((part,)),), added, removed)
+
+
+def _inline(option: _BasePattern, group: Pattern, flags: Optional[_REFlags]) -> Tuple:
+    """The parts of `option` of `group`, to be put in place of `group` in a concatenation"""
+    parts = option.parts if isinstance(option, _Concatenation) else (option,)
+    inner = _combine_flags(flags if flags is not None else _REFlags(0), group.added_flags, group.removed_flags)
+    return tuple(_with_flags(p, group.added_flags, group.removed_flags, inner) for p in parts)
+
+
+# What must not follow `$`: anything but a newline, or a newline which doesn't end the string
+_NOT_END = Pattern((_Concatenation((_NOT_NEWLINE,)), _Concatenation((_CharGroup(_NEWLINE, False), _ALL))))
+
 
 class _ParsePattern(SimpleParser[Pattern]):
     SPECIAL_CHARS_STANDARD: FrozenSet[str] = frozenset({
-        '+', '?', '*', '.', '$', '^', '\\', '(', ')', '[', ']', '{', '}', '|'
+        '+', '?', '*', '.', '$', '^', '\\', '(', ')', '[', ']', '{', '|'
     })
     SPECIAL_CHARS_INNER: FrozenSet[str] = frozenset({
         '\\', '[', ']'
     })
     RESERVED_ESCAPES: FrozenSet[str] = frozenset({
-        'u', 'U', 'A', 'Z', 'b', 'B'
+        'u', 'U'
     })
+    ANCHORS: Tuple[str, ...] = ('^', '$', '\\A', '\\Z', '\\b', '\\B')
+    ANCHOR_STARTS: FrozenSet[str] = frozenset(a[0] for a in ANCHORS)
+    # What an `obj` other than a plain char starts with, and what can follow it
+    OBJ_STARTS: Tuple[str, ...] = ('(',) + ANCHORS + ('[', '\\', '.')
+    REPEATS: Tuple[str, ...] = ('*', '+', '?', '{')
 
     def __init__(self, data: str):
         super(_ParsePattern, self).__init__(data)
@@ -474,16 +1058,26 @@ class _ParsePattern(SimpleParser[Pattern]):
     def conc(self):
         parts = []
         while True:
-            try:
-                parts.append(self.obj())
-            except nomatch:
+            part = self.obj()
+            if part is None:
                 break
+            parts.append(part)
         return _Concatenation(tuple(parts))
 
     def obj(self):
-        if self.static_b("("):
+        """The next part of a concatenation, or None if there is none"""
+        c = self.peek()
+        if c == "(":
+            self.index += 1
             return self.group()
-        return self.repetition(self.atom())
+        if c in self.ANCHOR_STARTS:
+            anchor = self.anyof_b(*self.ANCHORS)
+            if anchor is not None:
+                return _Anchor(anchor[-1])
+        atom = self.atom()
+        if atom is None:
+            return None
+        return self.repetition(atom)
 
     def group(self):
         if self.static_b("?"):
@@ -529,6 +1123,7 @@ class _ParsePattern(SimpleParser[Pattern]):
         elif c == '#':
             while not self.static_b(')'):
                 self.any()
+            return _EMPTY
         elif c == '=':
             p = self.pattern()
             self.static(")")
@@ -538,109 +1133,118 @@ class _ParsePattern(SimpleParser[Pattern]):
             self.static(")")
             return _NonCapturing(p, False, True)
         elif c == '<':
-            c = self.any()
-            if c == '=':
-                p = self.pattern()
-                self.static(")")
-                return _NonCapturing(p, True, False)
-            elif c == '!':
-                p = self.pattern()
-                self.static(")")
-                return _NonCapturing(p, True, True)
+            c = self.anyof('=', '!')
+            p = self.pattern()
+            self.static(")")
+            return _NonCapturing(p, True, c == '!')
         elif c == '(':
             raise NotImplementedError("Conditional matching is not implmented")
         else:
             raise ValueError(f"Unknown group-extension: {c!r} (Context: {self.data[self.index - 3:self.index + 5]!r}")
+        raise nomatch
 
     def atom(self):
-        if self.static_b("["):
+        c = self.peek()
+        if c == "[":
+            self.index += 1
             return self.repetition(self.chargroup())
-        elif self.static_b("\\"):
+        elif c == "\\":
+            self.index += 1
             return self.repetition(self.escaped())
-        elif self.static_b("."):
+        elif c == ".":
+            self.index += 1
             return self.repetition(_DOT)
-        else:
-            c = self.any_but(*self.SPECIAL_CHARS_STANDARD)
+        elif c and c not in self.SPECIAL_CHARS_STANDARD or c == "{" and self.literal_brace():
+            self.index += 1
             return self.repetition(_CharGroup(frozenset({c}), False))
+        else:
+            self.expect(self.index, self.OBJ_STARTS)
+            self.expect_any_but(*self.SPECIAL_CHARS_STANDARD)
+            return None
+
+    def literal_brace(self) -> bool:
+        """Whether the `{` next is just a char, as it is in `re` unless it starts bounds"""
+        start = self.index
+        self.index += 1
+        literal = self.bounds() is None
+        self.index = start
+        return literal
+
+    def bounds(self) -> Optional[Tuple[int, Optional[int]]]:
+        """The bounds of a repeat after its `{`: `n}`, `n,}`, `,m}`, `n,m}` or `,}`. For
+        anything else, `{}` included, returns None without moving."""
+        start = self.index
+        n = self.multiple_b("0123456789", 1, None)
+        if self.static_b(','):
+            m = self.multiple_b("0123456789", 1, None)
+            m = None if m is None else int(m)
+        elif n is not None:
+            m = int(n)
+        else:
+            return None
+        if not self.static_b("}"):
+            self.index = start
+            return None
+        return 0 if n is None else int(n), m
 
     def repetition(self, base: _Repeatable):
-        if self.static_b("*"):
+        c = self.peek()
+        if c not in self.REPEATS:
+            self.expect(self.index, self.REPEATS)
+            return base
+        self.index += 1
+        if c == "*":
             if self.static_b("?"):
                 pass
             return _Repeated(base, 0, None)
-        elif self.static_b("+"):
+        elif c == "+":
             if self.static_b("?"):
                 pass
             return _Repeated(base, 1, None)
-        elif self.static_b("?"):
+        elif c == "?":
             if self.static_b("?"):
                 pass
             return _Repeated(base, 0, 1)
-        elif self.static_b("{"):
-            try:
-                n = self.number()
-            except nomatch:
-                n = 0
-            if self.static_b(','):
-                try:
-                    m = self.number()
-                except nomatch:
-                    m = None
-            else:
-                m = n
-            self.static("}")
+        else:
+            bounds = self.bounds()
+            if bounds is None:
+                # Not a repeat, but a `{` for `atom` to parse
+                self.index -= 1
+                return base
             if self.static_b('?'):
                 pass
-            return _Repeated(base, n, m)
-        else:
-            return base
+            return _Repeated(base, *bounds)
 
     def number(self) -> int:
         return int(self.multiple("0123456789", 1, None))
 
     def escaped(self, inner=False):
         if self.static_b("x"):
-            n = self.multiple("0123456789", 2, 2)
+            n = self.multiple("0123456789abcdefABCDEF", 2, 2)
             c = chr(int(n, 16))
             return _CharGroup(frozenset({c}), False)
         if self.static_b("0"):
-            n = self.multiple("01234567", 1, 2)
-            c = chr(int(n, 8))
+            n = self.multiple("01234567", 0, 2)
+            c = chr(int("0" + n, 8))
             return _CharGroup(frozenset({c}), False)
         if not inner:
-            try:
-                n = self.multiple("01234567", 3, 3)
-            except nomatch:
-                pass
-            else:
+            n = self.multiple_b("01234567", 3, 3)
+            if n is not None:
                 c = chr(int(n, 8))
                 return _CharGroup(frozenset({c}), False)
-            try:
-                n = self.multiple("0123456789", 1, 2)
-            except nomatch:
-                pass
-            else:
+            if self.multiple_b("0123456789", 1, 2) is not None:
                 raise NotImplementedError("Group references are not implemented")
         else:
-            try:
-                n = self.multiple("01234567", 1, 3)
-            except nomatch:
-                pass
-            else:
+            n = self.multiple_b("01234567", 1, 3)
+            if n is not None:
                 c = chr(int(n, 8))
                 return _CharGroup(frozenset({c}), False)
         if not inner:
-            try:
-                c = self.anyof(*self.RESERVED_ESCAPES)
-            except nomatch:
-                pass
-            else:
+            c = self.anyof_b(*self.RESERVED_ESCAPES)
+            if c is not None:
                 raise NotImplementedError(f"Escape \\{c} is not implemented")
-        try:
-            c = self.anyof(*_CHAR_GROUPS)
-        except nomatch:
-            pass
-        else:
+        c = self.anyof_b(*_CHAR_GROUPS)
+        if c is not None:
             return _CHAR_GROUPS[c]
         c = self.any_but("abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ")
         if c.isalpha():
@@ -654,25 +1258,37 @@ class _ParsePattern(SimpleParser[Pattern]):
             negate = False
         groups = []
         while True:
-            try:
-                groups.append(self.chargroup_inner())
-            except nomatch:
+            group = self.chargroup_inner()
+            if group is None:
                 break
+            groups.append(group)
         self.static("]")
         if len(groups) == 1:
-            return tuple(groups)[0]
+            (group,) = groups
+            return _CharGroup(group.chars, group.negated != negate)
         elif len(groups) == 0:
             return _CharGroup(frozenset({}),negate)
         else:
             return _CompositeCharGroup(tuple(groups), negate)
 
-    def chargroup_inner(self) -> _CharGroup:
+    def chargroup_inner(self) -> Optional[_CharGroup]:
         start = self.index
-        if self.static_b('\\'):
+        c = self.peek()
+        if c == '\\':
+            self.index += 1
             base = self.escaped(True)
+        elif c and c not in self.SPECIAL_CHARS_INNER:
+            self.index += 1
+            base = _CharGroup(frozenset(c), False)
         else:
-            base = _CharGroup(frozenset(self.any_but(*self.SPECIAL_CHARS_INNER)), False)
+            self.expect(self.index, ('\\',))
+            self.expect_any_but(*self.SPECIAL_CHARS_INNER)
+            return None
         if self.static_b('-'):
+            if self.peek() == ']':
+                # A '-' right before the end is just a char
+                self.index -= 1
+                return base
             if self.static_b('\\'):
                 end = self.escaped(True)
             else:
@@ -686,17 +1302,342 @@ class _ParsePattern(SimpleParser[Pattern]):
         return base
 
 
-def parse_pattern(pattern: str) -> Pattern:
-    p = _ParsePattern(pattern)
-    return p.parse()
+def parse_pattern(pattern: str, flags: str = "") -> Pattern:
+    """Parses `pattern`, as `re` would with `flags` given as letters, e.g. "is". The
+    flags apply to the parsed pattern, so they don't change what parses."""
+    p = _ParsePattern(pattern).parse()
+    if not flags:
+        return p
+    if not set(flags) <= set(_flags):
+        raise ValueError(f"Unsupported flags {flags!r}, expected some of {''.join(_flags)!r}")
+    return p.with_flags(p.added_flags | _get_flags(flags), p.removed_flags)
+
+
+# The cheap checks `_prefilter` makes, in order, each named after what it compares
+PREFILTERS = ("lengths", "first", "last", "literals")
+
+
+def _disjoint_by(a: Tuple[Tuple[int, Optional[int]], _Signature],
+                 b: Tuple[Tuple[int, Optional[int]], _Signature],
+                 filters: Iterable[str] = PREFILTERS) -> Optional[str]:
+    """Returns the name of the first of `filters` which proves that two patterns, given
+    as their lengths and signatures, can't match the same string, or None"""
+    (al, ah), sa = a
+    (bl, bh), sb = b
+    if "lengths" in filters and ((ah is not None and ah < bl) or (bh is not None and bh < al)):
+        return "lengths"
+    if al > 0 or bl > 0:
+        # The empty string aside, a common match needs a common first and last char
+        if "first" in filters and sa.first.isdisjoint(sb.first):
+            return "first"
+        if "last" in filters and sa.last.isdisjoint(sb.last):
+            return "last"
+    if "literals" in filters and (not sb.chars.issuperset(sa.required) or not sa.chars.issuperset(sb.required)):
+        return "literals"
+    return None
+
+
+def _prefilter(patterns: Tuple[Pattern, ...], prefix_postfix: Tuple[int, int],
+               stats: Optional[Dict[str, int]] = None,
+               pairs: Optional[Iterable[Tuple[int, int]]] = None,
+               filters: Iterable[str] = PREFILTERS) -> List[Tuple[int, int]]:
+    """Returns the pairs of indices `(i, j)`, `i < j`, of patterns which might collide
+    once padded with `prefix_postfix`, leaving out those which `_disjoint_by` rules out
+    with `filters`. Only `pairs` are considered, if given. Padding shifts all lengths by
+    the same amount, so they are compared unpadded. If given, `stats` gets the number
+    of pairs each filter pruned."""
+    infos = []
+    for p in patterns:
+        lengths = p.lengths
+        infos.append((lengths, p._get_signature().padded(prefix_postfix, lengths[0] == 0)))
+    pruned = dict.fromkeys(PREFILTERS, 0)
+    if pairs is None:
+        pairs = combinations(range(len(patterns)), 2)
+    candidates = []
+    for i, j in pairs:
+        reason = _disjoint_by(infos[i], infos[j], filters)
+        if reason is None:
+            candidates.append((i, j))
+        else:
+            pruned[reason] += 1
+    if stats is not None:
+        stats.update(pruned)
+    return candidates
+
+
+@traced("collisions")
+def _collisions(fsms: List[FSM], pairs: Optional[Iterable[Tuple[int, int]]] = None) -> Set[Tuple[int, int]]:
+    """Crawls the product of all `fsms` (which share one alphabet) at once, instead of one
+    product per pair. Every two FSMs which are final in the same reachable state accept
+    a common string. Only `pairs` are checked, all pairs if None. An FSM stops being
+    followed once it is dead, or once all its pairs are decided, and a state is not
+    followed at all once fewer than two FSMs are still alive in it. Returns pairs of
+    indices `(i, j)` with `i < j`."""
+    if pairs is None:
+        pairs = combinations(range(len(fsms)), 2)
+    pairs = set(pairs)
+    alphabet = set().union(*(f.alphabet for f in fsms))
+    live = [{state for state in f.states if f.islive(state)} for f in fsms]
+    unknown = [0] * len(fsms)  # Number of undecided pairs per FSM
+    for i, j in pairs:
+        unknown[i] += 1
+        unknown[j] += 1
+    found = set()
+
+    def prune(states):
+        return tuple(
+            s if s in live[i] and unknown[i] else None
+            for i, s in enumerate(states)
+        )
+
+    initial = prune(f.initial for f in fsms)
+    seen = {initial}
+    pending = [initial]
+    while pending:
+        state = pending.pop()
+        finals = [i for i, s in enumerate(state) if s is not None and s in fsms[i].finals]
+        for pair in combinations(finals, 2):
+            if pair in pairs and pair not in found:
+                found.add(pair)
+                unknown[pair[0]] -= 1
+                unknown[pair[1]] -= 1
+        for symbol in alphabet:
+            next = prune(
+                None if s is None else fsms[i].map.get(s, {}).get(symbol)
+                for i, s in enumerate(state)
+            )
+            if len(next) - next.count(None) >= 2 and next not in seen:
+                seen.add(next)
+                pending.append(next)
+    return found
 
 
-def compare_patterns(*patterns: Pattern) -> Iterable[Tuple[Pattern, Pattern]]:
-    alphabet = frozenset(c for p in patterns for c in p.alphabet)
+@dataclass(frozen=True)
+class _PackedFSM:
+    """An FSM flattened for sending to another process: states are numbered from 0 (the
+    initial state), symbols by their index in a list shared by both processes, and
+    `table[state * width + symbol]` is the next state, or -1 for oblivion."""
+    width: int
+    finals: FrozenSet[int]
+    table: array
+
+
+def _pack(f: FSM, symbols: List) -> _PackedFSM:
+    numbers = {f.initial: 0}
+    for state in f.states:
+        numbers.setdefault(state, len(numbers))
+    table = array('l', [-1]) * (len(numbers) * len(symbols))
+    for state, transitions in f.map.items():
+        base = numbers[state] * len(symbols)
+        for i, symbol in enumerate(symbols):
+            if symbol in transitions:
+                table[base + i] = numbers[transitions[symbol]]
+    return _PackedFSM(len(symbols), frozenset(numbers[state] for state in f.finals), table)
+
+
+def _packed_isdisjoint(a: _PackedFSM, b: _PackedFSM) -> bool:
+    width = a.width
+    seen = {(0, 0)}
+    pending = [(0, 0)]
+    while pending:
+        sa, sb = pending.pop()
+        if sa in a.finals and sb in b.finals:
+            return False
+        for i in range(width):
+            na, nb = a.table[sa * width + i], b.table[sb * width + i]
+            if na != -1 and nb != -1 and (na, nb) not in seen:
+                seen.add((na, nb))
+                pending.append((na, nb))
+    return True
+
+
+# State of the worker processes used by `compare_patterns(workers=...)`
+_worker_symbols = None
+_worker_fsms = None
+
+
+def _init_compiler(symbols: List):
+    global _worker_symbols
+    _worker_symbols = symbols
+
+
+def _compile_packed(pattern: Pattern, prefix_postfix: Tuple[int, int]) -> Union[_PackedFSM, NotImplementedError]:
+    try:
+        return _pack(pattern.to_fsm(frozenset(_worker_symbols), prefix_postfix), _worker_symbols)
+    except NotImplementedError as e:
+        return e
+
+
+def _init_checker(fsms: Dict[int, _PackedFSM]):
+    global _worker_fsms
+    _worker_fsms = fsms
+
+
+def _check_pairs(pairs: List[Tuple[int, int]]) -> List[Tuple[int, int]]:
+    return [(i, j) for i, j in pairs if not _packed_isdisjoint(_worker_fsms[i], _worker_fsms[j])]
+
+
+def _compare_parallel(patterns, pairs, alphabet, prefix_postfix, workers: int,
+                      unsupported: Optional[Dict[int, str]]) -> Iterable[Tuple[Pattern, Pattern]]:
+    """Builds the FSMs in one process pool, then checks the `pairs` of indices in chunks in
+    another, yielding collisions as soon as their chunk is done. Closing the generator
+    cancels whatever has not started yet."""
+    symbols = list(alphabet)  # The processes agree on symbol numbers by sharing this list
+    needed = sorted({i for pair in pairs for i in pair})
+    with ProcessPoolExecutor(workers, initializer=_init_compiler, initargs=(symbols,)) as executor:
+        compiled = executor.map(_compile_packed, [patterns[i] for i in needed], [prefix_postfix] * len(needed))
+        fsms = {}
+        for i, f in zip(needed, compiled):
+            if isinstance(f, NotImplementedError):
+                _unsupported(unsupported, i, f)
+            else:
+                fsms[i] = f
+    pairs = [(i, j) for i, j in pairs if i in fsms and j in fsms]
+    if not pairs:
+        return
+
+    size = max(1, len(pairs) // (workers * 8))
+    executor = ProcessPoolExecutor(workers, initializer=_init_checker, initargs=(fsms,))
+    try:
+        futures = [executor.submit(_check_pairs, pairs[k:k + size]) for k in range(0, len(pairs), size)]
+        for future in as_completed(futures):
+            for i, j in future.result():
+                yield patterns[i], patterns[j]
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+def common_padding(patterns: Iterable[Pattern]) -> Tuple[int, int]:
+    """The `prefix_postfix` that all of `patterns` can be compiled with"""
     prefix_postfix_s = [p.prefix_postfix for p in patterns]
-    prefix_postfix = max(p[0] for p in prefix_postfix_s), max(p[1] for p in prefix_postfix_s)
-    fsms = [(p, p.to_fsm(alphabet, prefix_postfix)) for p in patterns]
-    for (ka, fa), (kb, fb) in combinations(fsms, 2):
-        fa: FSM
-        if not fa.isdisjoint(fb):
-            yield (ka, kb)
+    return max(p[0] for p in prefix_postfix_s), max(p[1] for p in prefix_postfix_s)
+
+
+def witness(*patterns: Pattern) -> Optional[str]:
+    """Returns a shortest string matched by all of `patterns`, or None if there is none.
+    If some have lookarounds, the string includes the context they look at. Each
+    symbol class is written as its smallest char, and chars that no pattern mentions
+    as the first printable char of that kind."""
+    classes = SymbolClasses(*patterns)
+    prefix_postfix = common_padding(patterns)
+    f = FSM.intersection(*(p.to_fsm(classes.alphabet, prefix_postfix) for p in patterns))
+    for string in f.strings():
+        other = next(chr(i) for i in range(0x20, 0x110000) if chr(i) not in classes.classes)
+        return "".join(other if symbol is anything_else else min(symbol) for symbol in string)
+    return None
+
+
+def _unsupported(unsupported: Optional[Dict], key, error: NotImplementedError):
+    if unsupported is not None:
+        unsupported[key] = str(error)
+
+
+def compare_patterns(*patterns: Pattern, workers: Optional[int] = None,
+                     stats: Optional[Dict[str, int]] = None,
+                     pairs: Optional[Iterable[Tuple[int, int]]] = None,
+                     unsupported: Optional[Dict[int, str]] = None) -> Iterable[Tuple[Pattern, Pattern]]:
+    """Yields every pair of patterns which can match the same string. With `workers`, the
+    work is spread over that many processes and pairs are yielded in no particular order.
+    `pairs` restricts the comparison to those pairs of indices `(i, j)`, with `i < j`.
+
+    Pairs which cheap checks (see `PREFILTERS`) prove disjoint never get FSMs built for
+    them. If given, `stats` is filled in with the number of pairs each check pruned,
+    and the number of "products" left to build.
+
+    Patterns using something `to_fsm` doesn't implement aren't compared with any other.
+    If given, `unsupported` is filled in with their indices and what it is."""
+    prefix_postfix = common_padding(patterns)
+    pairs = _prefilter(patterns, prefix_postfix, stats, pairs)
+    if stats is not None:
+        stats["products"] = len(pairs)
+    if not pairs:
+        return
+    # Patterns without any pairs left don't get an FSM, nor a say in the alphabet
+    needed = sorted({i for pair in pairs for i in pair})
+    alphabet = SymbolClasses(*(patterns[i] for i in needed)).alphabet
+    if workers is not None:
+        yield from _compare_parallel(patterns, pairs, alphabet, prefix_postfix, workers, unsupported)
+        return
+    compiled = {}
+    for i in needed:
+        try:
+            compiled[i] = patterns[i].to_fsm(alphabet, prefix_postfix)
+        except NotImplementedError as e:
+            _unsupported(unsupported, i, e)
+    if len(compiled) < len(needed):
+        pairs = [(i, j) for i, j in pairs if i in compiled and j in compiled]
+        needed = sorted({i for pair in pairs for i in pair})
+    fsms = [compiled[i] for i in needed]
+    index = {i: k for k, i in enumerate(needed)}
+    collisions = _collisions(fsms, [(index[i], index[j]) for i, j in pairs])
+    for i, j in pairs:
+        if (index[i], index[j]) in collisions:
+            yield patterns[i], patterns[j]
+
+
+class TaggedDFA:
+    """The product of the FSMs of several named patterns, tagged in every state with the
+    names of the patterns which accept there. Running a string through it tells which
+    of the patterns match all of it, in one pass however many patterns there are.
+    States are only built as strings reach them, so this stays cheap even where the
+    full product would be huge.
+
+    Patterns using something `to_fsm` doesn't implement never match. `unsupported` maps
+    their names to what it is."""
+
+    def __init__(self, patterns: Dict[str, Pattern]):
+        self.classes = SymbolClasses(*patterns.values())
+        alphabet = self.classes.alphabet
+        self.names = []
+        self.fsms = []
+        self.unsupported: Dict[str, str] = {}
+        for name, p in patterns.items():
+            try:
+                self.fsms.append(p.to_fsm(alphabet, (0, 0)))
+            except NotImplementedError as e:
+                _unsupported(self.unsupported, name, e)
+                continue
+            self.names.append(name)
+        self.initial = tuple(f.initial for f in self.fsms)
+        self._transitions: Dict[Tuple[Tuple, Any], Tuple] = {}
+        self._tags: Dict[Tuple, Tuple[str, ...]] = {}
+
+    def _next(self, state: Tuple, symbol) -> Tuple:
+        key = (state, symbol)
+        if key not in self._transitions:
+            self._transitions[key] = tuple(
+                None if s is None else f.map.get(s, {}).get(symbol)
+                for f, s in zip(self.fsms, state)
+            )
+        return self._transitions[key]
+
+    def tags(self, state: Tuple) -> Tuple[str, ...]:
+        if state not in self._tags:
+            self._tags[state] = tuple(
+                name for name, f, s in zip(self.names, self.fsms, state)
+                if s is not None and s in f.finals
+            )
+        return self._tags[state]
+
+    def matches(self, string: str) -> Tuple[str, ...]:
+        """The names of the patterns which match all of `string`"""
+        state = self.initial
+        for symbol in self.classes.normalize(string):
+            state = self._next(state, symbol)
+        return self.tags(state)
+
+
+def match_literals(patterns: Dict[str, Pattern], literals: Dict[str, str],
+                   unsupported: Optional[Dict[str, str]] = None) -> Dict[str, Tuple[str, ...]]:
+    """For every named literal string, e.g. a keyword, returns the names of the `patterns`
+    which match it. Literals no pattern matches are left out. If given, `unsupported` gets
+    the patterns `TaggedDFA` leaves out."""
+    dfa = TaggedDFA(patterns)
+    if unsupported is not None:
+        unsupported.update(dfa.unsupported)
+    result = {}
+    for name, literal in literals.items():
+        matched = dfa.matches(literal)
+        if matched:
+            result[name] = matched
+    return result
@@ -0,0 +1,272 @@
+# -*- coding: utf-8 -*-
+
+if __name__ == "__main__":
+	raise Exception("Test files can't be run directly. Use `python -m pytest`")
+
+import ast
+import gc
+import os
+import pickle
+import re
+from itertools import combinations, product
+
+import pytest
+
+from simple_parser import NoMatch
+from greenery.fsm import anything_else
+from pattern_parser import PREFILTERS, SymbolClasses, TaggedDFA, _char_group_fsm, _collisions, _pack, \
+	_packed_isdisjoint, _prefilter, clear_fsm_caches, common_padding, compare_patterns, match_literals, parse_pattern, \
+	witness
+
+CHARS = "ab \n"
+
+def strings(length, chars=CHARS):
+	for n in range(length + 1):
+		for chars_ in product(chars, repeat=n):
+			yield "".join(chars_)
+
+def in_context(regex, prefix_postfix):
+	"""Whether `re` matches `regex` in a string, after `prefix` chars and before `postfix`
+	chars of context, which `compare_patterns` pads patterns with"""
+	prefix, postfix = prefix_postfix
+	compiled = re.compile(f"(?:{regex})(?=(?s:.){{{postfix}}}\\Z)")
+	return lambda string: len(string) >= prefix + postfix and compiled.match(string, prefix) is not None
+
+def check_against_re(regex, prefix_postfix=(0, 0), length=4):
+	pattern = parse_pattern(regex)
+	classes = SymbolClasses(pattern)
+	f = pattern.to_fsm(classes.alphabet, prefix_postfix)
+	matches = in_context(regex, prefix_postfix)
+	for string in strings(length + sum(prefix_postfix)):
+		if not string and "\\B" in regex:
+			# Before Python 3.14, re never matches \B in an empty string
+			continue
+		assert f.accepts(classes.normalize(string)) == matches(string), (regex, prefix_postfix, string)
+
+LOOKBEHINDS = [r"(?<=a)b", r"a(?<=a)b", r"(?<!a)b", r"a(?<!a)b", r".(?<=[ab])b", r"a(?<!b)", r"ab(?<=ab)", r"(?<=a)", r"(?<!a)"]
+ANCHORS = [r"^a", r"a$", r"\Aa", r"a\Z", r"a^", r"$a", r"a$\n", r"(?m:a$\nb)", r"(?m:^a)", r"^$", r"(?m:.$)", r"\A\Z"]
+BOUNDARIES = [r"\ba", r"a\b", r"a\Bb", r"a\b b", r"\b", r"\B", r" \b", r".\b.", r"\Ba\B", r"a\b\n"]
+OPTIONAL = [r"(?:a(?=b))?b?", r"(?:a(?=b)|c)b", r"b(?:(?<=b)a)?", r"(a(?!b))?.", r"(?:\ba)?b", r"(?:a$)?\n?", r"(?:(?<=a)|b)a"]
+REPEATED_ZERO = [r"(?:a(?=b)){0}b", r"(?:b|a(?<=b)){0}a", r"(?:^a){0}a", r"a(?:\b){0}b"]
+
+@pytest.mark.parametrize("regex", LOOKBEHINDS + ANCHORS + BOUNDARIES + OPTIONAL + REPEATED_ZERO)
+def test_against_re(regex):
+	check_against_re(regex)
+	prefix_postfix = parse_pattern(regex).prefix_postfix
+	if prefix_postfix != (0, 0):
+		check_against_re(regex, prefix_postfix, length=3)
+	check_against_re(regex, (1, 1), length=3)
+
+PAIRS = [
+	("a(?=b)", "a"), ("a(?=b)", "ab"), ("a(?!b)", "a(?=b)"), ("(?<=b)a", "a"), ("(?<=b)a", "(?<!b)a"),
+	("a$", "a"), ("a$", "a(?=b)"), ("^a", "(?<=b)a"), ("^a", "a"), (r"\ba", r"\Ba"), (r"a\b", "a(?=b)"),
+	(r"a\b", "a(?= )"), (r"(?:a(?=b))?", "a"), ("(?:a(?=b)){0}", "a?"), (r"(?:^a)?", r"(?<=b)a"),
+]
+
+@pytest.mark.parametrize("a, b", PAIRS)
+def test_compare_against_re(a, b):
+	patterns = parse_pattern(a), parse_pattern(b)
+	collide = bool(list(compare_patterns(*patterns)))
+	prefix_postfix = common_padding(patterns)
+	matches = in_context(a, prefix_postfix), in_context(b, prefix_postfix)
+	shared = [string for string in strings(3 + sum(prefix_postfix)) if matches[0](string) and matches[1](string)]
+	assert collide == bool(shared), shared[:1]
+
+UNSUPPORTED = "(?:a(?=b))*"
+
+def test_unsupported():
+	with pytest.raises(NotImplementedError):
+		parse_pattern(UNSUPPORTED).to_fsm()
+	patterns = [parse_pattern(regex) for regex in ["a", UNSUPPORTED, "[ab]", "b"]]
+	for workers in (None, 2):
+		unsupported = {}
+		found = list(compare_patterns(*patterns, workers=workers, unsupported=unsupported))
+		assert set(found) == {(patterns[0], patterns[2]), (patterns[2], patterns[3])}
+		assert list(unsupported) == [1]
+		assert "repetition" in unsupported[1]
+	# Without anywhere to report them, they are left out just the same
+	assert len(list(compare_patterns(*patterns))) == 2
+
+def test_unsupported_tagged():
+	patterns = {"a": parse_pattern("a"), "bad": parse_pattern(UNSUPPORTED), "ab": parse_pattern("[ab]+")}
+	dfa = TaggedDFA(patterns)
+	assert list(dfa.unsupported) == ["bad"]
+	assert dfa.matches("a") == ("a", "ab")
+	assert dfa.matches("") == ()
+	unsupported = {}
+	assert match_literals(patterns, {"A": "a", "ABAB": "abab", "C": "c"}, unsupported) == {"A": ("a", "ab"), "ABAB": ("ab",)}
+	assert list(unsupported) == ["bad"]
+
+def test_fsm_cache():
+	pattern = parse_pattern("a(?=b)|c")
+	alphabet = SymbolClasses(pattern).alphabet
+	f = pattern.to_fsm(alphabet, (0, 1))
+	assert pattern.to_fsm(alphabet, (0, 1)) is f
+	# Any iterable of the same symbols is the same alphabet
+	assert pattern.to_fsm(set(alphabet), (0, 1)) is f
+	# Keyed by alphabet, padding and flags
+	ignorecase = parse_pattern("(?i)").added_flags
+	assert ignorecase
+	others = [
+		pattern.to_fsm(SymbolClasses(pattern, parse_pattern("d")).alphabet, (0, 1)),
+		pattern.to_fsm(alphabet, (1, 1)),
+		pattern.to_fsm(alphabet, (0, 1), flags=ignorecase),
+	]
+	assert all(other is not f for other in others)
+	assert len({id(other) for other in others}) == len(others)
+	assert pattern.to_fsm(alphabet, (0, 1), flags=ignorecase) is others[2]
+
+	# Only weakly held
+	size = len(pattern._fsm_cache)
+	del f, others
+	gc.collect()
+	assert len(pattern._fsm_cache) < size
+
+def test_clear_fsm_caches():
+	pattern = parse_pattern("[ab]c")
+	f = pattern.to_fsm()
+	assert _char_group_fsm.cache_info().currsize > 0
+	clear_fsm_caches()
+	assert _char_group_fsm.cache_info().currsize == 0
+	g = pattern.to_fsm()
+	assert g is not f and g.equivalent(f)
+	assert pattern.to_fsm() is g
+
+@pytest.mark.parametrize("regex, index, expected", [
+	("(a", 2, ")"), ("[a", 2, "]"), ("a\\q", 2, "d"), ("(?P<x", 5, ">"), ("\\", 1, "x"),
+	("a)", 1, "|"), ("a|(", 3, ")"), ("{1}", 2, ","),
+])
+def test_no_match(regex, index, expected):
+	with pytest.raises(re.error):
+		re.compile(regex)
+	with pytest.raises(NoMatch) as e:
+		parse_pattern(regex)
+	assert e.value.index == index
+	assert expected in e.value.expected
+
+@pytest.mark.parametrize("regex", ["a{}", "a{", "a{1", "a{x}", "a{1,2", "a{ 1}", "x|{", "a}", "{}", "}", "a*{", "[{}]", "a{2}{",
+	"a{,}", "a{,2}", "a{1,}", "a{1}?}"])
+def test_braces(regex):
+	# Unless it starts bounds, "{" is just a char, like "}"
+	pattern = parse_pattern(regex)
+	classes = SymbolClasses(pattern)
+	f = pattern.to_fsm(classes.alphabet)
+	for string in strings(4, "a{}1,x"):
+		assert f.accepts(classes.normalize(string)) == bool(re.fullmatch(regex, string)), string
+
+@pytest.mark.parametrize("regex", [r"\ba{70}", r"^a{70}", r"a{70}$", r"(?:\ba)?a{70}", r"a{70}(?:a\b)?",
+	r"x?\b[ab]{2,70}", r"x?(?:\ba)a{69}", r"(?:b|x?\b)a{70}"])
+def test_cfsm_against_re(regex):
+	# Repeated anchors only see what is around the whole repeat
+	pattern = parse_pattern(regex)
+	classes = SymbolClasses(pattern)
+	assert pattern.counted()
+	f = pattern.to_cfsm(classes.alphabet)
+	for string in ["a" * 70, "a" * 71, "x" + "a" * 70, "ab" * 35, "b" + "a" * 69, "a" * 70 + "x", ""]:
+		assert f.accepts(classes.normalize(string)) == bool(re.fullmatch(regex, string)), string
+
+@pytest.mark.parametrize("regex", [r"(?:\ba){100}", r"(?:^a){70}", r"x(?:a$){70}", r"(?:^a|b){70}"])
+def test_cfsm_unsupported(regex):
+	# Like to_fsm, rather than counting blind repetitions of the anchor
+	with pytest.raises(NotImplementedError):
+		parse_pattern(regex).to_cfsm()
+
+def terminals():
+	"""The terminals of Python's grammar, the strings escaped"""
+	with open(os.path.join(os.path.dirname(__file__), "terminals.pydata")) as f:
+		return [parse_pattern(regex if type == "re" else re.escape(regex)) for type, name, regex in ast.literal_eval(f.read())]
+
+def naive_collisions(patterns):
+	"""Every pair of indices whose FSMs intersect, with no prefilter"""
+	prefix_postfix = common_padding(patterns)
+	alphabet = SymbolClasses(*patterns).alphabet
+	fsms = {}
+	for i, p in enumerate(patterns):
+		try:
+			fsms[i] = p.to_fsm(alphabet, prefix_postfix)
+		except NotImplementedError:
+			pass
+	return {(i, j) for i, j in combinations(sorted(fsms), 2) if not fsms[i].isdisjoint(fsms[j])}
+
+def test_prefilters():
+	# Without the terminals with lookarounds: padding for them lets any char come last,
+	# or anywhere, which leaves nothing for "last" and "literals" to prune
+	patterns = [p for p in terminals() if common_padding([p]) == (0, 0)]
+	prefix_postfix = (0, 0)
+	every = set(combinations(range(len(patterns)), 2))
+	colliding = naive_collisions(patterns)
+	assert colliding
+	# Each filter on its own prunes some pairs, and never one which collides
+	for name in PREFILTERS:
+		stats = {}
+		kept = _prefilter(patterns, prefix_postfix, stats, filters=(name,))
+		pruned = every - set(kept)
+		assert pruned and not pruned & colliding, name
+		assert stats == {**dict.fromkeys(PREFILTERS, 0), name: len(pruned)}
+
+	stats = {}
+	index = {id(p): i for i, p in enumerate(patterns)}
+	found = {(index[id(a)], index[id(b)]) for a, b in compare_patterns(*patterns, stats=stats)}
+	assert found == colliding
+	assert set(stats) == set(PREFILTERS) | {"products"}
+	assert sum(stats.values()) == len(every)
+	assert stats["products"] == len(_prefilter(patterns, prefix_postfix)) < len(every)
+
+COLLIDING = ["a+", "[ab]*", "b", "ab(?=a)", "(?<=b)a", r"\s+", r"a\b", "", "[^a]"]
+
+def test_collisions():
+	# One crawl of the product of all FSMs finds what intersecting each pair does
+	patterns = [parse_pattern(regex) for regex in COLLIDING]
+	prefix_postfix = common_padding(patterns)
+	alphabet = SymbolClasses(*patterns).alphabet
+	fsms = [p.to_fsm(alphabet, prefix_postfix) for p in patterns]
+	pairs = {(i, j) for i, j in combinations(range(len(fsms)), 2) if not fsms[i].isdisjoint(fsms[j])}
+	assert 0 < len(pairs) < len(fsms) * (len(fsms) - 1) // 2
+	assert _collisions(fsms) == pairs
+	some = [(0, 1), (0, 2), (2, 8), (3, 4)]
+	assert _collisions(fsms, some) == pairs & set(some)
+
+def test_compare_workers():
+	# The same collisions and witnesses, in whichever order the workers find them
+	patterns = [parse_pattern(regex) for regex in COLLIDING + ["(?:a(?=b))+"]]
+	index = {id(p): i for i, p in enumerate(patterns)}
+	results = []
+	for workers in (None, 2):
+		unsupported = {}
+		found = sorted((index[id(a)], index[id(b)], witness(a, b))
+			for a, b in compare_patterns(*patterns, workers=workers, unsupported=unsupported))
+		results.append((found, unsupported))
+	assert results[0][0]
+	assert results[0][1] == {len(COLLIDING): "lookarounds reaching out of a repetition are not implemented"}
+	assert results[0] == results[1]
+
+def test_packed_pickle():
+	patterns = [parse_pattern(regex) for regex in COLLIDING]
+	prefix_postfix = common_padding(patterns)
+	symbols = list(SymbolClasses(*patterns).alphabet)
+	fsms = [p.to_fsm(frozenset(symbols), prefix_postfix) for p in patterns]
+	packed = [pickle.loads(pickle.dumps(_pack(f, symbols))) for f in fsms]
+	assert packed == [_pack(f, symbols) for f in fsms]
+	for i, j in combinations(range(len(fsms)), 2):
+		assert _packed_isdisjoint(packed[i], packed[j]) == fsms[i].isdisjoint(fsms[j])
+
+def test_symbol_classes():
+	patterns = [parse_pattern(regex) for regex in ["(?i)ab", "b|x", "[b-d]y"]]
+	classes = SymbolClasses(*patterns)
+	# The classes partition the chars, each char in its own class
+	symbols = classes.alphabet - {anything_else}
+	assert set().union(*symbols) == set(classes.classes) == set("aAbBcdxy")
+	assert sum(len(symbol) for symbol in symbols) == len(classes.classes)
+	assert all(c in classes.classes[c] for c in classes.classes)
+	# A and a are only ever matched together, and so are c and d, unlike B and b
+	assert {classes.classes[c] for c in "aAbBcdxy"} == {
+		frozenset("aA"), frozenset("b"), frozenset("B"), frozenset("cd"), frozenset("x"), frozenset("y")}
+	assert len(classes.alphabet) == 7
+	assert classes.normalize("Aaz") == [frozenset("aA"), frozenset("aA"), anything_else]
+	f = patterns[0].to_fsm(classes.alphabet)
+	assert all(f.accepts(classes.normalize(string)) for string in ["ab", "AB", "aB"])
+	assert not f.accepts(classes.normalize("ac"))
+	# Case folding reaches every class a folded pattern uses
+	classes = SymbolClasses(parse_pattern("(?i)ab"), parse_pattern("(?i:b)|x"))
+	assert classes.classes["b"] == frozenset("bB")
+	assert classes.classes["x"] == frozenset("x")
@@ -0,0 +1,90 @@
+"""
+A small blocking client for `query_server`:
+
+    with Client(socket="/tmp/greenery.sock") as client:
+        client.isdisjoint("[a-z]+", Regex("if", "i"))
+"""
+import json
+import socket as sockets
+from dataclasses import dataclass
+from itertools import count
+from typing import List, Optional, Tuple, Union
+
+
+@dataclass(frozen=True)
+class Regex:
+    """A regex with Python `re` flags, e.g. `Regex("abc", "i")`"""
+    regex: str
+    flags: str = ""
+
+
+class QueryError(Exception):
+    """The server could not answer a request"""
+
+
+class Client:
+    def __init__(self, socket: str = None, port: int = None, timeout: Optional[float] = None):
+        if socket is not None:
+            self._socket = sockets.socket(sockets.AF_UNIX, sockets.SOCK_STREAM)
+            self._socket.settimeout(timeout)
+            self._socket.connect(socket)
+        elif port is not None:
+            self._socket = sockets.create_connection(("127.0.0.1", port), timeout)
+        else:
+            raise ValueError("Need either a socket path or a port")
+        self._file = self._socket.makefile("rwb")
+        self._ids = count()
+
+    def close(self):
+        self._file.close()
+        self._socket.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def request(self, op: str, *regexes: Union[str, Regex]):
+        id = next(self._ids)
+        request = {
+            "id": id,
+            "op": op,
+            "regexes": [r if isinstance(r, str) else {"regex": r.regex, "flags": r.flags} for r in regexes],
+        }
+        self._file.write(json.dumps(request).encode() + b"\n")
+        self._file.flush()
+        line = self._file.readline()
+        if not line:
+            raise QueryError("Connection closed by server")
+        reply = json.loads(line)
+        assert reply["id"] == id, (reply["id"], id)
+        if not reply["ok"]:
+            raise QueryError(reply["error"])
+        return reply["result"]
+
+    def parse(self, regex: Union[str, Regex]) -> dict:
+        """Returns the number of states of the regex's reduced FSM and whether it is empty"""
+        return self.request("parse", regex)
+
+    def intersect(self, *regexes: Union[str, Regex]) -> dict:
+        """Returns the number of states of the reduced intersection and whether it is empty"""
+        return self.request("intersect", *regexes)
+
+    def isdisjoint(self, a: Union[str, Regex], b: Union[str, Regex]) -> bool:
+        return self.request("isdisjoint", a, b)
+
+    def issubset(self, a: Union[str, Regex], b: Union[str, Regex]) -> bool:
+        return self.request("issubset", a, b)
+
+    def equivalent(self, a: Union[str, Regex], b: Union[str, Regex]) -> bool:
+        return self.request("equivalent", a, b)
+
+    def witness(self, *regexes: Union[str, Regex]) -> Optional[str]:
+        """Returns a shortest string matched by all of the regexes, or None"""
+        return self.request("witness", *regexes)
+
+    def compare(self, *regexes: Union[str, Regex]) -> List[Tuple[int, int]]:
+        """Returns every pair of indices `(i, j)`, `i < j`, of regexes which can match the
+        same string"""
+        return [tuple(pair) for pair in self.request("compare", *regexes)]
@@ -0,0 +1,196 @@
+"""
+A long-running local server answering questions about regexes, so that tools
+which ask many of them pay for Python startup and FSM construction only once.
+
+Run it with e.g. `python query_server.py --socket /tmp/greenery.sock` or
+`python query_server.py --port 8765` (localhost only), and talk to it with
+`query_client.Client`.
+
+The protocol is JSON Lines in both directions. A request looks like
+
+    {"id": 1, "op": "isdisjoint", "regexes": ["[a-z]+", {"regex": "if", "flags": "i"}]}
+
+where `op` is one of `OPERATIONS` and every regex is either a string or an
+object with a "regex" and optional "flags" (Python `re` letters such as "is").
+The reply echoes the `id` and has either `"ok": true` and a "result", or
+`"ok": false` and an "error". Regexes use Python `re` syntax, as parsed by
+`pattern_parser`.
+
+All regexes of a request are compiled with the same padding for the context
+their lookarounds look at, as `pattern_parser.compare_patterns` does, so e.g.
+`a(?=b)` and `a` can match the same string, and `a(?=b)` and `ab` can't.
+"""
+import argparse
+import asyncio
+import json
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from itertools import combinations
+from typing import Tuple
+
+from greenery.fsm import FSM, anything_else
+from pattern_parser import Pattern, parse_pattern, SymbolClasses, common_padding
+
+OPERATIONS = ("parse", "intersect", "isdisjoint", "issubset", "equivalent", "witness", "compare")
+
+
+def parse_regex(regex: str, flags: str = "") -> Pattern:
+    return parse_pattern(regex, flags)
+
+
+def compile_regex(regex: str, flags: str = "", prefix_postfix: Tuple[int, int] = (0, 0)) -> FSM:
+    """Build the reduced FSM for a regex, padded by `prefix_postfix` for its lookarounds.
+    It is over plain chars rather than symbol classes, so that FSMs compiled separately
+    can still be combined."""
+    pattern = parse_regex(regex, flags)
+    alphabet = set(SymbolClasses(pattern).classes) | {anything_else}
+    return pattern.to_fsm(alphabet, prefix_postfix).reduce()
+
+
+def _witness(f: FSM, prefix_postfix: Tuple[int, int]):
+    """The shortest string accepted by `f` without its padding, or None. `anything_else`
+    is replaced by the first printable char outside the alphabet."""
+    for string in f.strings():
+        other = next(chr(i) for i in range(0x20, 0x110000) if chr(i) not in f.alphabet)
+        pre, post = prefix_postfix
+        string = string[pre:len(string) - post]
+        return "".join(other if symbol is anything_else else symbol for symbol in string)
+    return None
+
+
+def apply(op: str, fsms, prefix_postfix: Tuple[int, int] = (0, 0)):
+    """Answer one request, given the FSMs of its regexes, padded by `prefix_postfix`"""
+    if op == "parse":
+        (f,) = fsms
+        return {"states": len(f.states), "empty": f.empty()}
+    if op == "intersect":
+        f = FSM.intersection(*fsms).reduce()
+        return {"states": len(f.states), "empty": f.empty()}
+    if op == "witness":
+        return _witness(FSM.intersection(*fsms), prefix_postfix)
+    if op == "compare":
+        return [[i, j] for i, j in combinations(range(len(fsms)), 2) if not fsms[i].isdisjoint(fsms[j])]
+    a, b = fsms
+    if op == "isdisjoint":
+        return a.isdisjoint(b)
+    if op == "issubset":
+        return a.issubset(b)
+    if op == "equivalent":
+        return a.equivalent(b)
+    raise ValueError(f"Unknown operation {op!r}, expected one of {', '.join(OPERATIONS)}")
+
+
+class QueryServer:
+    """Answers requests, keeping the patterns of the `cache_size` most recently used
+    (regex, flags) pairs, and the FSMs of as many (regex, flags, padding). Patterns are
+    parsed right away, to know the padding; construction and products run in a
+    process pool."""
+
+    def __init__(self, cache_size: int = 1024, workers: int = None):
+        self.cache_size = cache_size
+        self.patterns = OrderedDict()
+        self.cache = OrderedDict()
+        self.executor = ProcessPoolExecutor(workers)
+
+    def pattern(self, regex: str, flags: str = "") -> Pattern:
+        key = (regex, flags)
+        if key in self.patterns:
+            self.patterns.move_to_end(key)
+        else:
+            self.patterns[key] = parse_regex(regex, flags)
+            if len(self.patterns) > self.cache_size:
+                self.patterns.popitem(last=False)
+        return self.patterns[key]
+
+    async def fsm(self, regex: str, flags: str = "", prefix_postfix: Tuple[int, int] = (0, 0)) -> FSM:
+        key = (regex, flags, prefix_postfix)
+        if key in self.cache:
+            self.cache.move_to_end(key)
+            future = self.cache[key]
+        else:
+            # The future itself is cached, so that concurrent requests for the
+            # same regex share one construction.
+            future = asyncio.get_running_loop().run_in_executor(
+                self.executor, compile_regex, regex, flags, prefix_postfix)
+            self.cache[key] = future
+            if len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+        try:
+            return await future
+        except Exception:
+            if self.cache.get(key) is future:
+                del self.cache[key]
+            raise
+
+    async def answer(self, request):
+        op = request.get("op")
+        if op not in OPERATIONS:
+            raise ValueError(f"Unknown operation {op!r}, expected one of {', '.join(OPERATIONS)}")
+        regexes = request.get("regexes", [])
+        if op == "parse":
+            expected = 1
+        elif op in ("intersect", "witness", "compare"):
+            expected = None
+        else:
+            expected = 2
+        if (expected is not None and len(regexes) != expected) or not regexes:
+            raise ValueError(f"{op} needs {expected or 'at least 1'} regexes, got {len(regexes)}")
+        regexes = [(r, "") if isinstance(r, str) else (r["regex"], r.get("flags", "")) for r in regexes]
+        prefix_postfix = common_padding([self.pattern(regex, flags) for regex, flags in regexes])
+        fsms = await asyncio.gather(*(self.fsm(regex, flags, prefix_postfix) for regex, flags in regexes))
+        if op == "parse":
+            return apply(op, fsms)
+        return await asyncio.get_running_loop().run_in_executor(self.executor, apply, op, fsms, prefix_postfix)
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                if not line.strip():
+                    continue
+                request = None
+                try:
+                    request = json.loads(line)
+                    reply = {"id": request.get("id"), "ok": True, "result": await self.answer(request)}
+                except Exception as e:
+                    reply = {"id": request.get("id") if isinstance(request, dict) else None,
+                             "ok": False, "error": f"{type(e).__name__}: {e}"}
+                writer.write(json.dumps(reply).encode() + b"\n")
+                await writer.drain()
+        finally:
+            writer.close()
+
+    async def serve(self, socket: str = None, port: int = None):
+        if socket is not None:
+            server = await asyncio.start_unix_server(self.handle, path=socket)
+        else:
+            server = await asyncio.start_server(self.handle, host="127.0.0.1", port=port)
+        async with server:
+            await server.serve_forever()
+
+    def close(self):
+        self.executor.shutdown(cancel_futures=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve regex queries over a local socket.")
+    where = parser.add_mutually_exclusive_group(required=True)
+    where.add_argument("--socket", help="path of a Unix socket to listen on")
+    where.add_argument("--port", type=int, help="TCP port to listen on, on 127.0.0.1 only")
+    parser.add_argument("--cache-size", type=int, default=1024, help="number of FSMs to keep (default: %(default)s)")
+    parser.add_argument("--workers", type=int, default=None, help="number of worker processes")
+    args = parser.parse_args(argv)
+
+    server = QueryServer(args.cache_size, args.workers)
+    try:
+        asyncio.run(server.serve(args.socket, args.port))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+
+if __name__ == "__main__":
+	raise Exception("Test files can't be run directly. Use `python -m pytest`")
+
+import asyncio
+import os
+import re
+import threading
+import time
+
+import pytest
+
+from pattern_parser import compare_patterns, parse_pattern
+from query_client import Client, QueryError, Regex
+from query_server import QueryServer
+
+@pytest.fixture(scope="module")
+def client(tmp_path_factory):
+	path = str(tmp_path_factory.mktemp("server") / "greenery.sock")
+	server = QueryServer(workers=2)
+	started = threading.Event()
+	running = {}
+
+	async def serve():
+		running["loop"] = asyncio.get_running_loop()
+		running["task"] = asyncio.ensure_future(server.serve(socket=path))
+		started.set()
+		try:
+			await running["task"]
+		except asyncio.CancelledError:
+			pass
+
+	# asyncio.run() cancels the connection handlers left once the server stops
+	thread = threading.Thread(target=asyncio.run, args=(serve(),), daemon=True)
+	thread.start()
+	started.wait()
+	deadline = time.monotonic() + 10
+	while not os.path.exists(path):
+		assert time.monotonic() < deadline, "server didn't start"
+		time.sleep(0.01)
+	try:
+		with Client(socket=path, timeout=60) as client:
+			yield client
+	finally:
+		running["loop"].call_soon_threadsafe(running["task"].cancel)
+		thread.join()
+		server.close()
+
+def test_operations(client):
+	assert client.parse("ab*") == {"states": 2, "empty": False}
+	assert client.intersect("[ab]+", "[bc]+")["empty"] is False
+	assert client.isdisjoint("a+", "b+")
+	assert not client.isdisjoint("IF", Regex("if", "i"))
+	assert client.issubset("ab", "[ab]+")
+	assert client.equivalent("a|b", "[ab]")
+	assert client.witness("[ab]+", "[bc]+") == "b"
+	assert client.witness("a", "b") is None
+	with pytest.raises(QueryError):
+		client.parse("a(")
+
+def test_flags(client):
+	# Flags don't change what parses: this is "(?i:a)|(b)" if spliced in
+	for flags in ["", "i", "is"]:
+		with pytest.raises(QueryError):
+			client.parse(Regex("a)|(b", flags))
+	assert client.equivalent(Regex("(?s)a.", "i"), "[aA](.|\n)")
+	with pytest.raises(QueryError):
+		client.parse(Regex("a", "q"))
+
+def test_lookarounds(client):
+	# The regexes of a request share their padding, so the answers agree with
+	# compare_patterns
+	assert not client.isdisjoint("a(?=b)", "a")
+	assert client.isdisjoint("a(?=b)", "ab")
+	assert not client.isdisjoint("(?<=x)a", "a")
+	assert client.isdisjoint("a(?!b)", "a(?=b)")
+
+	# The witness is the text matched, without the context
+	witness = client.witness("a(?=b)", "a")
+	assert witness == "a"
+	assert re.match("a(?=b)", witness + "b").group() == witness
+
+def test_compare(client):
+	regexes = ["a(?=b)", "a", "ab", "[ab]+", "a(?!b)"]
+	patterns = [parse_pattern(regex) for regex in regexes]
+	expected = {(patterns.index(a), patterns.index(b)) for a, b in compare_patterns(*patterns)}
+	assert set(client.compare(*regexes)) == expected
+	assert (0, 1) in expected and (0, 2) not in expected
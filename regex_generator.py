@@ -1,4 +1,10 @@
+import argparse
+import json
+import random
+import sys
+from dataclasses import dataclass, fields
 from random import choice, randrange
+from typing import Iterator, List, Optional
 
 import re
 
@@ -76,7 +82,172 @@ def create_random(max_depth: int = 1) -> str:
     return _pattern(max_depth)
 
 
+@dataclass
+class Features:
+    """Which constructs `Generator` may use. Repeats of repeats, such as `(?:a+b{2,4})*`,
+    and large bounds are what makes a regex take long to compile, so by default
+    repeats don't nest and bounds stay small."""
+    lookaheads: bool = True
+    lookbehinds: bool = False
+    anchors: bool = False
+    bounded_repeats: bool = True
+    max_bound: int = 4
+    nested_repeats: bool = False
+    lazy_repeats: bool = True
+    classes: bool = True
+    flags: bool = True
+    alternation: bool = True
+    # The chars literals and classes are made of
+    alphabet: str = "abcdefxyz0189 -_."
+
+
+class Generator:
+    """Generates random regexes with an exact number of nodes, in Python `re` syntax. A
+    node is a char, a class, a dot, an anchor, a repeat, a capturing group, a flags group,
+    a lookaround or a concatenation or alternation of two or more nodes, so `size` grows
+    linearly with the length of the regex. Non-capturing groups only there for the syntax,
+    as in `(?:ab)*`, are not nodes. The same `seed` always gives the same regexes."""
+
+    def __init__(self, seed: Optional[int] = None, features: Features = None):
+        self.random = random.Random(seed)
+        self.features = features if features is not None else Features()
+
+    def generate(self, size: int) -> str:
+        if size < 1:
+            raise ValueError(f"A regex needs at least 1 node, not {size}")
+        return self._node(size)
+
+    # How often each kind of inner node is picked, relative to the others
+    WEIGHTS = {'concatenation': 4, 'alternation': 2, 'repeat': 3, 'lookahead': 1, 'lookbehind': 1, 'flags': 1}
+
+    def _node(self, size: int, repeatable: bool = False, lookahead: bool = False, repeated: bool = False) -> str:
+        """A regex of `size` nodes. If `repeatable`, it can take a quantifier as it is. Only
+        parts of a concatenation may be `lookahead`s, so they never get repeated and there
+        is always something for them to look at. Inside a repeat, the regex is `repeated`."""
+        if size == 1:
+            if self.features.anchors and lookahead and self.random.random() < 0.15:
+                return self.random.choice(('^', '$', r'\A', r'\Z', r'\b', r'\B'))
+            return self._leaf()
+        kinds = ['flags'] if self.features.flags else []
+        if size > 2:
+            kinds.append('concatenation')
+            if self.features.alternation:
+                kinds.append('alternation')
+        if self.features.nested_repeats or not repeated:
+            kinds.append('repeat')
+        if self.features.lookaheads and lookahead:
+            kinds.append('lookahead')
+        if self.features.lookbehinds and lookahead and size != 3:
+            # Two nodes made of leaves only would be three, with their concatenation
+            kinds.append('lookbehind')
+        if not kinds:
+            # Only possible for two nodes inside a repeat, with neither flags nor nesting
+            return f"({self._node(1)})"
+        kind = self.random.choices(kinds, [self.WEIGHTS[kind] for kind in kinds])[0]
+        if kind == 'repeat':
+            result = self._node(size - 1, repeatable=True, repeated=True) + self._quantifier()
+            return f"(?:{result})" if repeatable else result
+        if kind == 'lookahead':
+            return f"(?{self.random.choice('=!')}{self._node(size - 1, repeated=repeated)})"
+        if kind == 'lookbehind':
+            # Lookbehinds have to be of fixed length, so they only hold leaves
+            leaves = 1 if size == 2 else size - 2
+            return f"(?<{self.random.choice('=!')}{''.join(self._leaf() for _ in range(leaves))})"
+        if kind == 'flags':
+            flags = self.random.choice(('i', 's', 'is'))
+            return f"(?{flags}:{self._node(size - 1, lookahead=lookahead, repeated=repeated)})"
+        parts = self._split(size - 1)
+        if kind == 'alternation':
+            return f"(?:{'|'.join(self._node(part, repeated=repeated) for part in parts)})"
+        result = ''.join(self._node(part, repeatable=True, lookahead=True, repeated=repeated) for part in parts)
+        return f"(?:{result})" if repeatable else result
+
+    def _split(self, total: int) -> List[int]:
+        """`total` nodes split into 2 to 4 parts of at least 1 node each"""
+        count = self.random.randint(2, min(4, total))
+        cuts = sorted(self.random.sample(range(1, total), count - 1))
+        return [b - a for a, b in zip([0] + cuts, cuts + [total])]
+
+    def _leaf(self) -> str:
+        kinds = ['char', 'char', 'char', 'dot']
+        if self.features.classes:
+            kinds += ['class', 'class', 'shorthand']
+        kind = self.random.choice(kinds)
+        if kind == 'char':
+            return re.escape(self.random.choice(self.features.alphabet))
+        if kind == 'dot':
+            return '.'
+        if kind == 'shorthand':
+            return '\\' + self.random.choice('dDwWsS')
+        entries = []
+        for _ in range(self.random.randint(1, 3)):
+            a, b = sorted(self.random.sample(self.features.alphabet, 2))
+            if self.random.random() < 0.3:
+                entries.append(f"{re.escape(a)}-{re.escape(b)}")
+            else:
+                entries.append(re.escape(a))
+        negate = '^' if self.random.random() < 0.3 else ''
+        return f"[{negate}{''.join(entries)}]"
+
+    def _quantifier(self) -> str:
+        kinds = ['*', '+', '?']
+        if self.features.bounded_repeats:
+            kinds += ['bounded', 'bounded']
+        kind = self.random.choice(kinds)
+        lazy = '?' if self.features.lazy_repeats and self.random.random() < 0.2 else ''
+        if kind != 'bounded':
+            return kind + lazy
+        low = self.random.randint(0, self.features.max_bound)
+        high = self.random.randint(low, self.features.max_bound)
+        if low == high:
+            return f"{{{low}}}{lazy}"
+        return f"{{{low},{high}}}{lazy}"
+
+
+def corpus(seed: int, sizes: List[int], count: int, features: Features = None) -> Iterator[dict]:
+    """`count` regexes of each of `sizes` nodes. Each one has its own generator seeded from
+    `seed`, its size and its number, so it does not change with `count` or the other
+    sizes. Yields dicts with "id", "regex", "size" and "seed"."""
+    for size in sizes:
+        for i in range(count):
+            item_seed = f"{seed}/{size}/{i}"
+            yield {
+                'id': f"{size}:{i}",
+                'regex': Generator(item_seed, features).generate(size),
+                'size': size,
+                'seed': item_seed,
+            }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Write a reproducible corpus of random regexes as JSON Lines.")
+    parser.add_argument("--seed", type=int, default=0, help="(default: %(default)s)")
+    parser.add_argument("--size", default="10", help="comma-separated node counts (default: %(default)s)")
+    parser.add_argument("--count", type=int, default=10, help="regexes per size (default: %(default)s)")
+    parser.add_argument("--output", metavar="FILE", help="write to FILE instead of stdout")
+    defaults = Features()
+    for field in fields(Features):
+        option = field.name.replace('_', '-')
+        if field.type in (bool, 'bool') and getattr(defaults, field.name):
+            parser.add_argument(f"--no-{option}", dest=field.name, action="store_false",
+                                help=f"leave out {field.name.replace('_', ' ')}")
+        elif field.type in (bool, 'bool'):
+            parser.add_argument(f"--{option}", action="store_true", help=f"allow {field.name.replace('_', ' ')}")
+        else:
+            parser.add_argument(f"--{option}", type=type(getattr(defaults, field.name)),
+                                default=getattr(defaults, field.name), help="(default: %(default)r)")
+    args = parser.parse_args(argv)
+
+    features = Features(**{field.name: getattr(args, field.name) for field in fields(Features)})
+    sizes = [int(size) for size in args.size.split(",") if size]
+    output = open(args.output, 'w') if args.output is not None else sys.stdout
+    try:
+        for item in corpus(args.seed, sizes, args.count, features):
+            output.write(json.dumps(item) + "\n")
+    finally:
+        if output is not sys.stdout:
+            output.close()
+
+
 if __name__ == '__main__':
-    print(create_random())
-    print(create_random())
-    print(create_random())
+    main()
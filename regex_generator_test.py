@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+
+if __name__ == "__main__":
+	raise Exception("Test files can't be run directly. Use `python -m pytest`")
+
+import re
+
+import pytest
+
+from regex_generator import Features, Generator, corpus
+
+def count_nodes(regex):
+	"""The number of nodes in `regex`, as `Generator` counts them"""
+	index = 0
+
+	def alternation():
+		nonlocal index
+		sizes = [concatenation()]
+		while regex.startswith("|", index):
+			index += 1
+			sizes.append(concatenation())
+		return sizes[0] if len(sizes) == 1 else 1 + sum(sizes)
+
+	def concatenation():
+		sizes = []
+		while index < len(regex) and regex[index] not in "|)":
+			sizes.append(repeat())
+		return sizes[0] if len(sizes) == 1 else 1 + sum(sizes)
+
+	def repeat():
+		nonlocal index
+		size = atom()
+		quantifier = re.compile(r"(?:[*+?]|\{\d+(?:,\d+)?\})\??").match(regex, index)
+		if quantifier:
+			index = quantifier.end()
+			size += 1
+		return size
+
+	def atom():
+		nonlocal index
+		group = re.compile(r"\((\?(?::|[is]+:|<?[=!]))?").match(regex, index)
+		if group:
+			index = group.end()
+			size = alternation()
+			assert regex[index] == ")"
+			index += 1
+			# Groups only there for the syntax are not nodes
+			return size if group.group(1) == "?:" else 1 + size
+		leaf = re.compile(r"\[\^?(?:\\.|[^\]])+\]|\\.|.").match(regex, index)
+		index = leaf.end()
+		return 1
+
+	size = alternation()
+	assert index == len(regex)
+	return size
+
+FEATURES = [
+	Features(),
+	Features(lookbehinds=True, anchors=True, nested_repeats=True),
+	# Without flags or nested repeats, a repeat of two nodes has to be a capturing group
+	Features(flags=False),
+	Features(flags=False, alternation=False, lookaheads=False, classes=False),
+]
+
+@pytest.mark.parametrize("features", FEATURES)
+def test_sizes(features):
+	generator = Generator(0, features)
+	for size in range(1, 15):
+		for _ in range(20):
+			regex = generator.generate(size)
+			re.compile(regex)
+			assert count_nodes(regex) == size, regex
+
+def test_count_nodes():
+	assert count_nodes(r"a") == 1
+	assert count_nodes(r"(?:ab)*") == 4
+	assert count_nodes(r"(?:a|[b-c]|\d)") == 4
+	assert count_nodes(r"(?i:a(?=b))") == 5
+	assert count_nodes(r"(?<!\.x)(a)+?") == 8
+
+def test_seed():
+	assert Generator(1).generate(10) == Generator(1).generate(10)
+	assert [Generator(1).generate(size) for size in (5, 20)] != [Generator(2).generate(size) for size in (5, 20)]
+	items = list(corpus(3, [4, 8], 5))
+	assert items == list(corpus(3, [4, 8], 5))
+	assert [item["id"] for item in items[:2]] == ["4:0", "4:1"]
+	assert all(count_nodes(item["regex"]) == item["size"] for item in items)
+	# An item doesn't depend on the others
+	assert list(corpus(3, [8], 2)) == items[5:7]
+	assert list(corpus(4, [4, 8], 5)) != items
@@ -1,6 +1,5 @@
 from abc import ABC, abstractmethod
-from collections import defaultdict
-from typing import Generic, TypeVar, Tuple, Optional, List
+from typing import Generic, TypeVar, Tuple, Optional, List, Iterable
 
 
 class nomatch(BaseException):
@@ -22,47 +21,75 @@ T = TypeVar('T')
 
 
 class SimpleParser(Generic[T], ABC):
+    """Base of recursive descent parsers. The `*_b` methods try an alternative and return
+    False or None if it isn't there, without moving; the others raise `nomatch`, which
+    `parse` turns into a `NoMatch` for the whole input. Only the expectations at the
+    furthest index any of them failed at are kept, since that's where `NoMatch` points."""
+
     def __init__(self, data: str):
         self.data = data
         self.index = 0
-        self._expected = defaultdict(list)
+        self._furthest = 0
+        self._expected: List[Iterable[str]] = []
 
     def parse(self) -> T:
         try:
             result = self.start()
         except nomatch:
-            raise NoMatch(self.data, max(self._expected), self._expected[max(self._expected)]) from None
+            raise NoMatch(self.data, self._furthest, self.expected) from None
         if self.index < len(self.data):
-            raise NoMatch(self.data, max(self._expected), self._expected[max(self._expected)])
+            raise NoMatch(self.data, self._furthest, self.expected)
         return result
 
     @abstractmethod
     def start(self) -> T:
         raise NotImplementedError
 
+    @property
+    def expected(self) -> List[str]:
+        """What could have come at the furthest index anything failed at"""
+        return [e for group in self._expected for e in group]
+
+    def expect(self, index: int, expected: Iterable[str]):
+        """Records that `expected` didn't match at `index`. The group is only flattened by
+        `expected`, if it's ever needed."""
+        if index > self._furthest:
+            self._furthest = index
+            self._expected = [expected]
+        elif index == self._furthest:
+            self._expected.append(expected)
+
+    def peek(self) -> str:
+        """The next char, or '' at the end"""
+        return self.data[self.index:self.index + 1]
+
     def static(self, expected: str):
-        length = len(expected)
-        if self.data[self.index:self.index + length] == expected:
-            self.index += length
-        else:
-            self._expected[self.index].append(expected)
+        if not self.static_b(expected):
             raise nomatch
 
     def static_b(self, expected: str) -> bool:
         l = len(expected)
-        if self.data[self.index:self.index + l] == expected:
+        if self.data.startswith(expected, self.index):
             self.index += l
             return True
         else:
-            self._expected[self.index].append(expected)
+            self.expect(self.index, (expected,))
             return False
 
     def anyof(self, *strings: str) -> str:
+        s = self.anyof_b(*strings)
+        if s is None:
+            raise nomatch
+        return s
+
+    def anyof_b(self, *strings: str) -> Optional[str]:
+        c = self.peek()
         for s in strings:
-            if self.static_b(s):
+            if s[:1] == c and self.data.startswith(s, self.index):
+                self.index += len(s)
                 return s
-        else:
-            raise nomatch
+        self.expect(self.index, strings)
+        return None
 
     def any(self, length: int = 1) -> str:
         if self.index + length <= len(self.data):
@@ -70,45 +97,48 @@ class SimpleParser(Generic[T], ABC):
             self.index += length
             return res
         else:
-            self._expected[self.index].append(f"<Any {length}>")
+            self.expect(self.index, (f"<Any {length}>",))
             raise nomatch
 
     def any_but(self, *strings, length: int = 1) -> str:
+        res = self.any_but_b(*strings, length=length)
+        if res is None:
+            raise nomatch
+        return res
+
+    def any_but_b(self, *strings, length: int = 1) -> Optional[str]:
         if self.index + length <= len(self.data):
             res = self.data[self.index:self.index + length]
             if res not in strings:
                 self.index += length
                 return res
-            else:
-                self._expected[self.index].append(f"<Any {length} except {strings}>")
-                raise nomatch
-        else:
-            self._expected[self.index].append(f"<Any {length} except {strings}>")
-            raise nomatch
+        self.expect_any_but(*strings, length=length)
+        return None
+
+    def expect_any_but(self, *strings, length: int = 1):
+        """Records that any `length` chars but `strings` could have come next, like a
+        failed `any_but_b`, without trying to match them"""
+        if self.index >= self._furthest:
+            self.expect(self.index, (f"<Any {length} except {strings}>",))
 
     def multiple(self, chars: str, mi: int, ma: Optional[int]) -> str:
-        result = []
-        for off in range(mi):
-            if self.data[self.index + off] in chars:
-                result.append(self.data[self.index + off])
-            else:
-                self._expected[self.index + off].extend(chars)
-                raise nomatch
-        self.index += mi
-        if ma is None:
-            while True:
-                if self.data[self.index] in chars:
-                    result.append(self.data[self.index])
-                    self.index += 1
-                else:
-                    self._expected[self.index].extend(chars)
-                    break
-        else:
-            for _ in range(ma - mi):
-                if self.data[self.index] in chars:
-                    result.append(self.data[self.index])
-                    self.index += 1
-                else:
-                    self._expected[self.index].extend(chars)
-                    break
-        return ''.join(result)
+        res = self.multiple_b(chars, mi, ma)
+        if res is None:
+            raise nomatch
+        return res
+
+    def multiple_b(self, chars: str, mi: int, ma: Optional[int]) -> Optional[str]:
+        """Between `mi` and `ma` (or any number, if None) of `chars`, as many as there are"""
+        data = self.data
+        limit = len(data) if ma is None else min(len(data), self.index + ma)
+        i = self.index
+        while i < limit and data[i] in chars:
+            i += 1
+        if ma is None or i < self.index + ma:
+            # Stopped by a char, or the end, which isn't one of `chars`
+            self.expect(i, chars)
+        if i < self.index + mi:
+            return None
+        res = data[self.index:i]
+        self.index = i
+        return res